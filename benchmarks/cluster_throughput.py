@@ -0,0 +1,256 @@
+"""Бенчмарк пропускной способности: один воркер против нескольких (bookbot/cluster.py).
+
+Создает временную базу с библиотекой, логом и списками, поднимает заглушку
+Bot API (отвечает на sendMessage и остальные методы) и для каждого числа
+воркеров запускает cluster.py, которому проигрывает одну и ту же запись
+обновлений: команды /search, /summary, /gettrl, /logs, /report и /year от
+--chats разных чатов. Обновления отправляются на вебхук фронта с
+параллельностью --concurrency; время считается до последнего ответа бота
+в заглушку. Печатает обновлений в секунду и ускорение относительно
+первого варианта.
+
+    python benchmarks/cluster_throughput.py [--workers 1,4] [--updates 2000] [--chats 200]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bookbot'))
+
+CLUSTER_PATH = os.path.join(ROOT, 'bookbot', 'cluster.py')
+TOKEN = '123456:benchmark'
+SECRET = 'benchmark'
+EVENT_TYPES = ('added', 'started_reading', 'finished_reading', 'marked_as_read', 'added_to_buy_list')
+WORDS = ('дракон', 'стража', 'город', 'море', 'звезда', 'тень', 'ветер', 'огонь')
+COMMANDS = (
+    (lambda rnd: f"/search {rnd.choice(WORDS)}", 4),
+    (lambda rnd: f"/search author:Автор {rnd.randint(0, 499)}", 2),
+    (lambda rnd: "/summary", 2),
+    (lambda rnd: "/gettrl", 2),
+    (lambda rnd: "/logs", 2),
+    (lambda rnd: f"/report 2025-{rnd.randint(1, 6):02d}..2025-{rnd.randint(7, 12):02d}", 1),
+    (lambda rnd: "/year 2025", 1),
+)
+
+
+def chat_id(i, chats):
+    return 100000 + i % chats
+
+
+def seed(db, rnd, books, events, chats):
+    """Библиотека делится между пользователями чатов: книга i принадлежит чату i % chats"""
+    conn = db.get_conn()
+    try:
+        conn.executemany(
+            "INSERT INTO books (owner_id, authors, title, format, pages, genre) VALUES (?, ?, ?, 'physical', ?, ?)",
+            [(chat_id(i, chats), f"Автор {i % 500}", f"{rnd.choice(WORDS).capitalize()} {rnd.choice(WORDS)} {i}",
+              rnd.randint(50, 900), rnd.choice(('фэнтези', 'фантастика', 'детектив')))
+             for i in range(books)],
+        )
+        log_books = [rnd.randint(1, books) for _ in range(events)]
+        conn.executemany(
+            "INSERT INTO book_log (owner_id, book_id, event_type, event_date) VALUES (?, ?, ?, ?)",
+            [(chat_id(book_id - 1, chats), book_id, rnd.choice(EVENT_TYPES),
+              f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} {rnd.randint(0, 23):02d}:00:00")
+             for book_id in log_books],
+        )
+        conn.executemany(
+            "INSERT INTO to_read_list (owner_id, book_id, priority) VALUES (?, ?, ?)",
+            [(chat_id(book_id - 1, chats), book_id, rnd.randint(1, 5))
+             for book_id in rnd.sample(range(1, books + 1), min(books, 300))],
+        )
+        conn.commit()
+        db.rebuild_library_stats()
+    finally:
+        db.release_conn(conn)
+
+
+def make_updates(rnd, count, chats):
+    makers = [maker for maker, weight in COMMANDS for _ in range(weight)]
+    updates = []
+    for i in range(count):
+        user_id = chat_id(rnd.randrange(chats), chats)
+        text = rnd.choice(makers)(rnd)
+        command = text.split()[0]
+        updates.append({
+            'update_id': 1 + i,
+            'message': {
+                'message_id': 1 + i,
+                'date': 1735689600,
+                'chat': {'id': user_id, 'type': 'private', 'first_name': 'Bench'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+            },
+        })
+    return updates
+
+
+class FakeBotApi:
+    """Заглушка Bot API: считает вызовы методов и время последнего"""
+
+    def __init__(self):
+        self.calls = 0
+        self.last_call = 0.0
+
+    async def handle(self, request: web.Request):
+        method = request.match_info['method']
+        form = await request.post()
+        self.calls += 1
+        self.last_call = time.perf_counter()
+        if method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method in ('sendMessage', 'editMessageText'):
+            chat_id = int(form.get('chat_id', 0))
+            result = {'message_id': self.calls, 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'text': form.get('text', '')}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+
+async def wait_http(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} не ответил за {timeout} с")
+
+
+async def run_cluster(workers, updates, api, args, db_path, log_path):
+    env = dict(os.environ)
+    env.update({
+        'TG_BOT_TOKEN': TOKEN,
+        'TG_API_URL': f'http://127.0.0.1:{args.api_port}',
+        'WEBHOOK_SECRET': SECRET,
+        'WEBHOOK_HOST': '127.0.0.1',
+        'WEBHOOK_PORT': str(args.port),
+        'WEBHOOK_PATH': '/webhook',
+        'WEBHOOK_BASE_URL': '',
+        'DB_PATH': db_path,
+        'CLUSTER_WORKERS': str(workers),
+    })
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen([sys.executable, CLUSTER_PATH], env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        await wait_http(f'http://127.0.0.1:{args.port}/healthz')
+        url = f'http://127.0.0.1:{args.port}/webhook'
+        headers = {'X-Telegram-Bot-Api-Secret-Token': SECRET, 'Content-Type': 'application/json'}
+        bodies = [json.dumps(update, ensure_ascii=False).encode() for update in updates]
+        errors = 0
+        calls_before = api.calls
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def post(session, body):
+            nonlocal errors
+            async with semaphore:
+                async with session.post(url, data=body, headers=headers) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+
+        started = time.perf_counter()
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(post(session, body) for body in bodies))
+        posted = time.perf_counter()
+
+        # Обработка продолжается после ответа вебхука: ждем, пока ответы бота перестанут приходить
+        calls = api.calls
+        while True:
+            await asyncio.sleep(args.settle)
+            if api.calls == calls:
+                break
+            calls = api.calls
+        elapsed = max(api.last_call, posted) - started
+        return {
+            'workers': workers,
+            'updates_per_s': len(updates) / elapsed,
+            'seconds': elapsed,
+            'replies': api.calls - calls_before,
+            'errors': errors,
+        }
+    finally:
+        process.send_signal(signal.SIGTERM)
+        await asyncio.to_thread(process.wait)
+
+
+async def run(args):
+    import logging
+    logging.disable(logging.INFO)
+    import db
+
+    tmp_dir = tempfile.mkdtemp(prefix='bookgoblin-cluster-')
+    db_path = os.path.join(tmp_dir, 'library.db')
+    db.DB_FILE = db_path
+    db.init_db()
+    rnd = random.Random(args.seed)
+    seed(db, rnd, args.books, args.events, args.chats)
+    db.close_pool()
+    updates = make_updates(rnd, args.updates, args.chats)
+
+    api = FakeBotApi()
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.api_port).start()
+
+    results = []
+    try:
+        for workers in (int(value) for value in args.workers.split(',')):
+            log_path = os.path.join(tmp_dir, f'cluster-{workers}.log')
+            try:
+                results.append(await run_cluster(workers, updates, api, args, db_path, log_path))
+            except Exception:
+                print(f"Запуск с {workers} воркерами не удался, лог: {log_path}", file=sys.stderr)
+                raise
+    finally:
+        await runner.cleanup()
+
+    print(f"ядер: {os.cpu_count()}, обновлений: {len(updates)}, чатов: {args.chats}")
+    print(f"{'воркеров':<10}{'обновл./с':>11}{'секунд':>9}{'ответов':>9}{'ошибок':>8}{'ускорение':>11}")
+    for r in results:
+        print(f"{r['workers']:<10}{r['updates_per_s']:>11.1f}{r['seconds']:>9.2f}{r['replies']:>9}"
+              f"{r['errors']:>8}{r['updates_per_s'] / results[0]['updates_per_s']:>10.2f}x")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default=f"1,{max(os.cpu_count() or 1, 2)}",
+                        help='числа воркеров через запятую, первое - база для сравнения')
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=64, help='одновременных запросов к вебхуку')
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--events', type=int, default=50000)
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--api-port', type=int, default=18081)
+    parser.add_argument('--settle', type=float, default=1.0,
+                        help='секунд без новых ответов бота, после которых обработка считается законченной')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    return asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Бенчмарк нечеткого поиска книг на синтетической библиотеке.
+
+Создает временную базу с N книгами (по умолчанию 200 000), затем ищет
+случайные книги по фамилии автора с опечаткой и печатает задержки
+fuzzy_find_books и долю запросов, где искомая книга попала в выдачу.
+
+    python benchmarks/fuzzy_search.py [--books 200000] [--queries 200]
+
+Код выхода 1, если p95 превышает --max-ms (по умолчанию 50 мс).
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bookbot'))
+
+CONSONANTS = 'бвгджзклмнпрстфхцчшщ'
+VOWELS = 'аеиоуыэюя'
+SYLLABLES = ([c + v for c in CONSONANTS for v in VOWELS]
+             + [c + v + e for c in CONSONANTS[:8] for v in VOWELS for e in 'нрлст'])
+# Вся библиотека бенчмарка у одного владельца (значение owner_id по умолчанию)
+OWNER_ID = 0
+
+
+def make_word(rnd, syllables):
+    return ''.join(rnd.choice(SYLLABLES) for _ in range(syllables)).capitalize()
+
+
+def make_book(rnd):
+    title = ' '.join(make_word(rnd, rnd.randint(2, 4)) for _ in range(rnd.randint(1, 4)))
+    authors = f"{make_word(rnd, 2)} {make_word(rnd, 3)}"
+    series = make_word(rnd, 3) if rnd.random() < 0.3 else None
+    return authors, title, series
+
+
+def make_typo(rnd, word):
+    """Одна случайная опечатка: пропуск, замена или перестановка букв"""
+    i = rnd.randrange(1, len(word) - 1)
+    kind = rnd.choice(('drop', 'replace', 'swap'))
+    if kind == 'drop':
+        return word[:i] + word[i + 1:]
+    if kind == 'replace':
+        return word[:i] + rnd.choice(VOWELS + CONSONANTS) + word[i + 1:]
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--max-ms', type=float, default=50.0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='bookgoblin-bench-')
+    os.environ['DB_PATH'] = os.path.join(tmp_dir, 'library.db')
+
+    import db
+
+    rnd = random.Random(args.seed)
+    db.init_db()
+
+    books = [make_book(rnd) for _ in range(args.books)]
+    started = time.perf_counter()
+    conn = db.get_conn()
+    try:
+        conn.executemany(
+            "INSERT INTO books (authors, title, format, series_name) VALUES (?, ?, 'physical', ?)",
+            books,
+        )
+        conn.commit()
+    finally:
+        db.release_conn(conn)
+    print(f"Библиотека из {args.books} книг создана за {time.perf_counter() - started:.1f} с")
+
+    # Прогрев кэша страниц
+    db.fuzzy_find_books(OWNER_ID, books[0][0])
+
+    timings = []
+    found = 0
+    for _ in range(args.queries):
+        book_id = rnd.randrange(args.books) + 1
+        authors, title, _ = books[book_id - 1]
+        query = make_typo(rnd, authors.split()[1])
+
+        started = time.perf_counter()
+        results = db.fuzzy_find_books(OWNER_ID, query)
+        timings.append((time.perf_counter() - started) * 1000)
+        found += any(row[0] == book_id for row in results)
+
+    timings.sort()
+    p50 = statistics.median(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"Запросов: {args.queries}")
+    print(f"p50: {p50:.1f} мс, p95: {p95:.1f} мс, max: {timings[-1]:.1f} мс")
+    print(f"Искомая книга в выдаче: {found}/{args.queries}")
+
+    db.close_pool()
+    return 0 if p95 <= args.max_ms else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Бенчмарк профилей PRAGMA: параллельное чтение отчетов и запись изменений.
+
+Для каждого профиля создает временную базу с библиотекой и годом событий,
+затем в течение --seconds секунд несколько потоков строят отчеты о
+прочитанном за случайный месяц (как /last_read и /report), а один поток
+добавляет книги в список покупок (запись и событие лога одним commit, как
+при действиях пользователя). Печатает пропускную способность чтения и записи, задержки
+и число ошибок блокировки.
+
+    python benchmarks/pragma_profiles.py [--books 20000] [--events 100000] [--readers 4]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bookbot'))
+
+EVENT_TYPES = ('added', 'started_reading', 'finished_reading', 'marked_as_read')
+# Вся библиотека бенчмарка у одного владельца (значение owner_id по умолчанию)
+OWNER_ID = 0
+
+
+def seed(db, rnd, books, events):
+    conn = db.get_conn()
+    try:
+        conn.executemany(
+            "INSERT INTO books (authors, title, format, pages) VALUES (?, ?, 'physical', ?)",
+            [(f"Автор {i % 500}", f"Книга {i}", rnd.randint(50, 900)) for i in range(books)],
+        )
+        conn.executemany(
+            "INSERT INTO book_log (book_id, event_type, event_date) VALUES (?, ?, ?)",
+            [(rnd.randint(1, books), rnd.choice(EVENT_TYPES),
+              f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} {rnd.randint(0, 23):02d}:00:00")
+             for _ in range(events)],
+        )
+        conn.commit()
+    finally:
+        db.release_conn(conn)
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(int(len(values) * share) - 1, 0)]
+
+
+def run_profile(db, reports, profile, args):
+    tmp_dir = tempfile.mkdtemp(prefix=f'bookgoblin-pragma-{profile}-')
+    db.DB_FILE = os.path.join(tmp_dir, 'library.db')
+    db.PRAGMAS = db.load_pragmas(profile)
+    db.init_db()
+    seed(db, random.Random(args.seed), args.books, args.events)
+
+    stop_at = time.perf_counter() + args.seconds
+    read_ms, write_ms = [], []
+    errors = {'read': 0, 'write': 0}
+    lock = threading.Lock()
+
+    def reader():
+        rnd = random.Random()
+        while time.perf_counter() < stop_at:
+            start = datetime(2025, rnd.randint(1, 12), 1)
+            started = time.perf_counter()
+            try:
+                reports.get_reading_report(OWNER_ID, start, reports.next_month_start(start))
+            except sqlite3.OperationalError:
+                with lock:
+                    errors['read'] += 1
+                continue
+            with lock:
+                read_ms.append((time.perf_counter() - started) * 1000)
+
+    def writer():
+        rnd = random.Random(args.seed + 1)
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                db.add_to_buy_list(OWNER_ID, f"Автор {rnd.randint(0, 499)}", f"Покупка {rnd.randint(1, args.books)}")
+            except sqlite3.OperationalError:
+                errors['write'] += 1
+                continue
+            write_ms.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.close_pool()
+
+    return {
+        'profile': profile,
+        'reads_per_s': len(read_ms) / args.seconds,
+        'read_p50': statistics.median(read_ms) if read_ms else 0.0,
+        'read_p95': percentile(read_ms, 0.95),
+        'writes_per_s': len(write_ms) / args.seconds,
+        'write_p50': statistics.median(write_ms) if write_ms else 0.0,
+        'write_p95': percentile(write_ms, 0.95),
+        'errors': errors['read'] + errors['write'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--profiles', default='legacy,wal,durable')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # Пул на всех читателей и писателя, без ожидания свободного подключения
+    os.environ['DB_POOL_SIZE'] = str(args.readers + 2)
+    import logging
+    logging.disable(logging.INFO)
+    import db
+    from handlers import reports
+
+    results = [run_profile(db, reports, profile, args) for profile in args.profiles.split(',')]
+
+    print(f"{'профиль':<10}{'чтений/с':>10}{'p50 мс':>9}{'p95 мс':>9}"
+          f"{'записей/с':>11}{'p50 мс':>9}{'p95 мс':>9}{'ошибок':>8}")
+    for r in results:
+        print(f"{r['profile']:<10}{r['reads_per_s']:>10.1f}{r['read_p50']:>9.1f}{r['read_p95']:>9.1f}"
+              f"{r['writes_per_s']:>11.1f}{r['write_p50']:>9.2f}{r['write_p95']:>9.2f}{r['errors']:>8}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict
+from dotenv import load_dotenv
+import logging
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+load_dotenv()
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '16'))
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderMiddleware(BaseMiddleware):
+    """Параллельная обработка обновлений разных чатов при строгом порядке внутри чата.
+
+    Диспетчер запускает каждое обновление отдельной задачей, и без этого
+    два быстрых сообщения одного пользователя могли бы обработаться
+    одновременно и перепутать шаги /addmanual. Здесь обновления одного
+    чата ждут друг друга в очереди (asyncio.Lock отдает блокировку в
+    порядке ожидания), а обновления разных чатов идут параллельно, но не
+    больше concurrency одновременно.
+
+    Регистрируется внешним middleware на dp.update после встроенных,
+    которые определяют чат (event_chat).
+
+    В воркере cluster.py (shard - пара (номер воркера, число воркеров))
+    заодно проверяет, что чат обновления относится к этому воркеру: иначе
+    его состояние диалога и очередь разошлись бы по процессам. Такое
+    обновление все равно обрабатывается, но попадает в лог и метрики.
+    """
+
+    def __init__(self, concurrency=UPDATE_CONCURRENCY, shard=None):
+        self.concurrency = concurrency
+        self.shard = shard
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # чат -> обновлений в работе и в очереди
+        self._depths: Dict[int, int] = {}
+        self._active = 0
+        self._stats = {'processed': 0, 'max_chat_depth': 0, 'max_active': 0, 'misrouted': 0}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get('event_chat')
+        user = data.get('event_from_user')
+        key = chat.id if chat is not None else (user.id if user is not None else None)
+        if key is None:
+            return await self._run(handler, event, data)
+        if self.shard is not None and key % self.shard[1] != self.shard[0]:
+            self._stats['misrouted'] += 1
+            logger.warning(f"Обновление чата {key} пришло воркеру {self.shard[0]}, "
+                           f"а должно было воркеру {key % self.shard[1]}")
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        depth = self._depths[key] = self._depths.get(key, 0) + 1
+        self._stats['max_chat_depth'] = max(self._stats['max_chat_depth'], depth)
+        try:
+            async with lock:
+                return await self._run(handler, event, data)
+        finally:
+            self._depths[key] -= 1
+            if not self._depths[key]:
+                del self._depths[key]
+                del self._locks[key]
+
+    async def _run(self, handler, event, data):
+        async with self._semaphore:
+            self._active += 1
+            self._stats['max_active'] = max(self._stats['max_active'], self._active)
+            try:
+                return await handler(event, data)
+            finally:
+                self._active -= 1
+                self._stats['processed'] += 1
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats['concurrency'] = self.concurrency
+        stats['active'] = self._active
+        stats['chats'] = len(self._depths)
+        # Ждут, пока обработается предыдущее обновление того же чата
+        stats['queued'] = sum(self._depths.values()) - len(self._depths)
+        # Только сводные числа: ID чатов в метрики не попадают
+        stats['chats_waiting'] = sum(1 for depth in self._depths.values() if depth > 1)
+        stats['chat_depth'] = max(self._depths.values(), default=0)
+        return stats
+
+
+_middleware = None
+
+
+def setup(dp, concurrency=UPDATE_CONCURRENCY, shard=None):
+    """Подключает упорядочивание обновлений по чатам к диспетчеру; shard - (воркер, число воркеров) в кластере"""
+    global _middleware
+    _middleware = ChatOrderMiddleware(concurrency, shard)
+    dp.update.outer_middleware(_middleware)
+    logger.info(f"Обработка обновлений: до {concurrency} одновременно, по порядку внутри чата")
+    return _middleware
+
+
+def get_stats():
+    """Метрики обработки обновлений: в работе, в очереди, глубина очередей чатов"""
+    return _middleware.get_stats() if _middleware is not None else None
@@ -0,0 +1,261 @@
+"""Запуск бота несколькими процессами: фронт принимает вебхук и раздает обновления воркерам.
+
+Каждый воркер - обычный main.py в режиме webhook, слушающий свой
+unix-сокет. Обновление уходит воркеру по остатку от деления ID чата
+(для обновлений без чата - ID пользователя) на число воркеров, поэтому
+все обновления одного чата обрабатывает один и тот же процесс: его
+состояние диалога, очередь чата и кэши остаются в этом процессе.
+Воркеры делят один файл базы (WAL), каждый со своим потоком записи;
+кэши сбрасываются, когда базу изменил другой воркер.
+
+    CLUSTER_WORKERS=4 WEBHOOK_SECRET=... python bookbot/cluster.py
+"""
+import asyncio
+import json
+import logging
+import os
+import secrets
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from dotenv import load_dotenv
+
+import db
+from handlers import register_all_handlers
+
+load_dotenv()
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', str(os.cpu_count() or 1)))
+# Каталог для сокетов воркеров; по умолчанию временный, удаляется при остановке
+CLUSTER_SOCKET_DIR = os.getenv('CLUSTER_SOCKET_DIR', '')
+CLUSTER_START_TIMEOUT = float(os.getenv('CLUSTER_START_TIMEOUT', '30'))
+
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+logger = logging.getLogger(__name__)
+
+
+def update_shard_key(update):
+    """ID чата обновления (как event_chat в aiogram), иначе ID пользователя, иначе None"""
+    for name, event in update.items():
+        if name == 'update_id' or not isinstance(event, dict):
+            continue
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+    return None
+
+
+def shard_for(update, workers):
+    """Номер воркера для обновления; обновления без чата и пользователя идут нулевому"""
+    key = update_shard_key(update)
+    return key % workers if key is not None else 0
+
+
+class Worker:
+    """Процесс main.py, принимающий обновления своего шарда через unix-сокет"""
+
+    def __init__(self, shard, workers, socket_dir):
+        self.shard = shard
+        self.workers = workers
+        self.socket_path = os.path.join(socket_dir, f'worker-{shard}.sock')
+        self.process = None
+        self.session = None
+        self.restarts = 0
+        self.forwarded = 0
+        self.errors = 0
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        env = dict(os.environ)
+        env.update({
+            'BOT_MODE': 'webhook',
+            'WEBHOOK_SOCKET': self.socket_path,
+            # Вебхук в Telegram регистрирует фронт
+            'WEBHOOK_BASE_URL': '',
+            'SHARD_ID': str(self.shard),
+            'SHARD_COUNT': str(self.workers),
+        })
+        # Свою группу процессов: Ctrl+C в терминале останавливает фронт, а воркеры - уже он
+        self.process = subprocess.Popen([sys.executable, MAIN_PATH], env=env, start_new_session=True)
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=self.socket_path))
+        logger.info(f"Воркер {self.shard} запущен (pid {self.process.pid})")
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    async def wait_ready(self, timeout=CLUSTER_START_TIMEOUT):
+        """Ждет, пока воркер начнет отвечать на /healthz"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.alive():
+                raise RuntimeError(f"Воркер {self.shard} завершился при запуске (код {self.process.returncode})")
+            try:
+                async with self.session.get(f'http://worker{self.shard}/healthz') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+        raise RuntimeError(f"Воркер {self.shard} не запустился за {timeout} с")
+
+    async def forward(self, body, headers):
+        async with self.session.post(f'http://worker{self.shard}{WEBHOOK_PATH}', data=body, headers=headers) as response:
+            return response.status, await response.read(), response.content_type
+
+    async def stop(self, timeout=30):
+        """Останавливает воркер штатно (SIGTERM), при зависании - принудительно"""
+        if self.alive():
+            self.process.terminate()
+            try:
+                await asyncio.to_thread(self.process.wait, timeout)
+            except subprocess.TimeoutExpired:
+                logger.error(f"Воркер {self.shard} не остановился за {timeout} с, завершаем принудительно")
+                self.process.kill()
+                await asyncio.to_thread(self.process.wait)
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class Front:
+    """HTTP-сервер, принимающий вебхук Telegram и пересылающий обновления воркерам"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.stopping = False
+
+    async def handle_update(self, request: web.Request):
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ''), WEBHOOK_SECRET):
+            return web.Response(status=401, text="Unauthorized")
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400, text="Bad Request")
+
+        worker = self.workers[shard_for(update, len(self.workers))]
+        try:
+            status, payload, content_type = await worker.forward(body, {
+                SECRET_HEADER: WEBHOOK_SECRET,
+                'Content-Type': 'application/json',
+            })
+        except aiohttp.ClientError as e:
+            # Telegram повторит обновление, когда воркер поднимется
+            worker.errors += 1
+            logger.error(f"Воркер {worker.shard} недоступен: {e}")
+            return web.Response(status=502, text="Bad Gateway")
+        worker.forwarded += 1
+        return web.Response(status=status, body=payload, content_type=content_type)
+
+    async def healthcheck(self, request: web.Request):
+        if all(worker.alive() for worker in self.workers):
+            return web.Response(text="ok")
+        return web.Response(status=503, text="worker down")
+
+    async def supervise(self):
+        """Перезапускает упавшие воркеры"""
+        while not self.stopping:
+            for worker in self.workers:
+                if not self.stopping and not worker.alive():
+                    logger.error(f"Воркер {worker.shard} завершился (код {worker.process.returncode}), перезапускаем")
+                    worker.restarts += 1
+                    worker.start()
+            await asyncio.sleep(1)
+
+
+async def set_webhook():
+    """Регистрирует адрес вебхука в Telegram (если задан WEBHOOK_BASE_URL)"""
+    if not WEBHOOK_BASE_URL:
+        logger.info("WEBHOOK_BASE_URL не задан, вебхук в Telegram не устанавливается")
+        return
+    # Типы обновлений берем из тех же обработчиков, что у воркеров
+    dp = Dispatcher()
+    register_all_handlers(dp)
+    url = WEBHOOK_BASE_URL.rstrip('/') + WEBHOOK_PATH
+    bot = Bot(token=os.getenv("TG_BOT_TOKEN"))
+    try:
+        await bot.set_webhook(url, secret_token=WEBHOOK_SECRET, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        await bot.session.close()
+    logger.info(f"Вебхук установлен: {url}")
+
+
+def migrate():
+    """Применяет миграции один раз до запуска воркеров, чтобы они не ждали друг друга"""
+    db.open_pool()
+    try:
+        db.init_db()
+    finally:
+        db.close_pool()
+    if db.PRAGMAS.get('journal_mode', '').lower() != 'wal':
+        logger.warning("Воркеры делят базу без WAL: чтение будет ждать записи других воркеров")
+
+
+async def main():
+    if not os.getenv("TG_BOT_TOKEN"):
+        raise RuntimeError("TG_BOT_TOKEN is not set in environment variables")
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET is not set in environment variables")
+
+    migrate()
+    socket_dir = CLUSTER_SOCKET_DIR or tempfile.mkdtemp(prefix='bookgoblin-')
+    os.makedirs(socket_dir, exist_ok=True)
+    workers = [Worker(shard, CLUSTER_WORKERS, socket_dir) for shard in range(CLUSTER_WORKERS)]
+    front = Front(workers)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, front.handle_update)
+    app.router.add_get('/healthz', front.healthcheck)
+    runner = web.AppRunner(app)
+    supervisor = None
+    try:
+        for worker in workers:
+            worker.start()
+        await asyncio.gather(*(worker.wait_ready() for worker in workers))
+        supervisor = asyncio.create_task(front.supervise(), name='cluster_supervisor')
+
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info(f"Фронт слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, воркеров: {CLUSTER_WORKERS}")
+        await set_webhook()
+        await stop.wait()
+    finally:
+        # Сначала перестаем принимать обновления, потом воркеры дописывают свои очереди
+        front.stopping = True
+        if supervisor is not None:
+            supervisor.cancel()
+        await runner.cleanup()
+        await asyncio.gather(*(worker.stop() for worker in workers))
+        for worker in workers:
+            logger.info(f"Воркер {worker.shard}: переслано {worker.forwarded}, ошибок {worker.errors}, "
+                        f"перезапусков {worker.restarts}")
+        if not CLUSTER_SOCKET_DIR:
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,132 +1,1338 @@
 import sqlite3
 import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from dotenv import load_dotenv
 import logging
 
+from search_query import parse_search_query
+
 load_dotenv()
-DB_FILE = os.getenv('DB_PATH', '/app/data/library.db')
+# Раскладка данных: shared - одна база на всех пользователей (DB_PATH - файл),
+# per_user - библиотека каждого пользователя в своем файле в каталоге DB_PATH
+DB_LAYOUT = os.getenv('DB_LAYOUT', 'shared')
+if DB_LAYOUT not in ('shared', 'per_user'):
+    raise ValueError(f"Неизвестная раскладка базы DB_LAYOUT={DB_LAYOUT!r}: ожидается shared или per_user")
+DB_PATH = os.getenv('DB_PATH', '/app/data/library.db')
+# Общая база процесса; в per_user в ней остаются только данные не из библиотек (состояния диалогов)
+DB_FILE = os.path.join(DB_PATH, 'common.db') if DB_LAYOUT == 'per_user' else DB_PATH
+LIBRARY_DIR = DB_PATH
+# per_user: сколько библиотек держать открытыми, подключений на библиотеку,
+# через сколько секунд без обращений библиотека закрывается и сколько потоков записи
+DB_OPEN_LIBRARIES = int(os.getenv('DB_OPEN_LIBRARIES', '64'))
+DB_LIBRARY_POOL_SIZE = int(os.getenv('DB_LIBRARY_POOL_SIZE', '2'))
+DB_LIBRARY_IDLE_TIMEOUT = float(os.getenv('DB_LIBRARY_IDLE_TIMEOUT', '300'))
+DB_WRITERS = int(os.getenv('DB_WRITERS', '4'))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', '256'))
+DB_PRAGMA_PROFILE = os.getenv('DB_PRAGMA_PROFILE', 'wal')
+BOOK_CACHE_SIZE = int(os.getenv('BOOK_CACHE_SIZE', '1000'))
+# Сколько владельцев держат словари подсказок /addmanual в памяти (давно не обращавшиеся вытесняются)
+VOCAB_CACHE_SIZE = int(os.getenv('VOCAB_CACHE_SIZE', '100'))
+# Telegram ID владельца, которому миграция 6 отдает библиотеку, собранную до разделения по пользователям
+LEGACY_OWNER_ID = int(os.getenv('LEGACY_OWNER_ID', '0'))
+
+# Наборы PRAGMA, которые применяются к каждому подключению при его создании.
+# wal - по умолчанию: чтение не блокирует запись и наоборот;
+# durable - то же, но с fsync на каждый commit; legacy - прежний журнал отката
+PRAGMA_PROFILES = {
+    'wal': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,  # 256 МБ
+        'cache_size': -65536,  # 64 МБ (отрицательное значение - в КиБ)
+        'temp_store': 'MEMORY',
+    },
+    'durable': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'mmap_size': 268435456,
+        'cache_size': -65536,
+        'temp_store': 'MEMORY',
+    },
+    'legacy': {
+        'busy_timeout': 5000,
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+    },
+}
+_PRAGMA_NAMES = ('busy_timeout', 'journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store')
+_PRAGMA_VALUE_RE = re.compile(r'^-?\w+$')
+
+
+def load_pragmas(profile, overrides=''):
+    """Собирает PRAGMA из профиля и переопределений вида mmap_size=0;cache_size=-8000"""
+    if profile not in PRAGMA_PROFILES:
+        raise ValueError(f"Неизвестный профиль PRAGMA {profile!r}, доступны: {', '.join(PRAGMA_PROFILES)}")
+    pragmas = dict(PRAGMA_PROFILES[profile])
+    for item in filter(None, (part.strip() for part in overrides.split(';'))):
+        name, _, value = item.partition('=')
+        name, value = name.strip().lower(), value.strip()
+        if name not in _PRAGMA_NAMES or not _PRAGMA_VALUE_RE.match(value):
+            raise ValueError(f"Недопустимое переопределение PRAGMA {item!r}")
+        pragmas[name] = value
+    return pragmas
+
+
+PRAGMAS = load_pragmas(DB_PRAGMA_PROFILE, os.getenv('DB_PRAGMAS', ''))
+
+# Составные индексы под горячие запросы: (имя, таблица, колонки).
+# Все запросы идут в пределах библиотеки одного владельца, поэтому индексы начинаются с owner_id.
+# При изменении набора замененные индексы переносятся в OBSOLETE_INDEXES
+QUERY_INDEXES = (
+    # Отчеты и итоги месяцев: event_type IN (...) AND event_date в диапазоне;
+    # book_id в индексе, чтобы дедупликация по книге не ходила в таблицу
+    ('idx_book_log_owner_type_date', 'book_log', ('owner_id', 'event_type', 'event_date', 'book_id')),
+    # /logs: события владельца от новых к старым
+    ('idx_book_log_owner_date', 'book_log', ('owner_id', 'event_date')),
+    # /booklog: история одной книги по дате
+    ('idx_book_log_book_date', 'book_log', ('book_id', 'event_date')),
+    # /gettrl и /gettbr: сортировка по приоритету, затем по дате добавления
+    ('idx_to_read_list_owner_priority', 'to_read_list', ('owner_id', 'priority DESC', 'added_date')),
+    ('idx_to_buy_list_owner_priority', 'to_buy_list', ('owner_id', 'priority DESC', 'added_date')),
+    # Книги владельца по ID (дочитывание словарей подсказок) и поиск по префиксу названия и автора
+    ('idx_books_owner', 'books', ('owner_id',)),
+    ('idx_books_owner_title_norm', 'books', ('owner_id', 'title_norm')),
+    ('idx_books_owner_authors_norm', 'books', ('owner_id', 'authors_norm')),
+    # Фильтры структурированного поиска (/search series:... year:>2000 genre:фэнтези unread)
+    ('idx_books_owner_series_norm', 'books', ('owner_id', 'series_norm')),
+    ('idx_books_owner_year', 'books', ('owner_id', 'year')),
+    ('idx_books_owner_genre_norm', 'books', ('owner_id', 'genre_norm')),
+    ('idx_books_owner_format', 'books', ('owner_id', 'format')),
+    ('idx_books_owner_source', 'books', ('owner_id', 'source')),
+    ('idx_books_owner_is_read', 'books', ('owner_id', 'is_read')),
+)
+OBSOLETE_INDEXES = (
+    'idx_book_log_type',  # префикс idx_book_log_type_date
+    # Индексы без owner_id, замененные индексами по владельцу (миграция 6)
+    'idx_book_log_type_date', 'idx_book_log_date',
+    'idx_to_read_list_priority', 'idx_to_buy_list_priority',
+    'idx_books_title', 'idx_books_authors', 'idx_books_title_norm', 'idx_books_authors_norm',
+    'idx_books_series_norm', 'idx_books_year', 'idx_books_genre', 'idx_books_format',
+    'idx_books_source', 'idx_books_is_read',
+    'idx_books_owner_genre',  # заменен idx_books_owner_genre_norm (миграция 7)
+)
+# Наборы индексов миграции 6: до нормализованного жанра
+QUERY_INDEXES_V6 = (
+    ('idx_book_log_owner_type_date', 'book_log', ('owner_id', 'event_type', 'event_date', 'book_id')),
+    ('idx_book_log_owner_date', 'book_log', ('owner_id', 'event_date')),
+    ('idx_book_log_book_date', 'book_log', ('book_id', 'event_date')),
+    ('idx_to_read_list_owner_priority', 'to_read_list', ('owner_id', 'priority DESC', 'added_date')),
+    ('idx_to_buy_list_owner_priority', 'to_buy_list', ('owner_id', 'priority DESC', 'added_date')),
+    ('idx_books_owner', 'books', ('owner_id',)),
+    ('idx_books_owner_title_norm', 'books', ('owner_id', 'title_norm')),
+    ('idx_books_owner_authors_norm', 'books', ('owner_id', 'authors_norm')),
+    ('idx_books_owner_series_norm', 'books', ('owner_id', 'series_norm')),
+    ('idx_books_owner_year', 'books', ('owner_id', 'year')),
+    ('idx_books_owner_genre', 'books', ('owner_id', 'genre')),
+    ('idx_books_owner_format', 'books', ('owner_id', 'format')),
+    ('idx_books_owner_source', 'books', ('owner_id', 'source')),
+    ('idx_books_owner_is_read', 'books', ('owner_id', 'is_read')),
+)
+OBSOLETE_INDEXES_V6 = (
+    'idx_book_log_type',  # префикс idx_book_log_type_date
+    'idx_book_log_type_date', 'idx_book_log_date',
+    'idx_to_read_list_priority', 'idx_to_buy_list_priority',
+    'idx_books_title', 'idx_books_authors', 'idx_books_title_norm', 'idx_books_authors_norm',
+    'idx_books_series_norm', 'idx_books_year', 'idx_books_genre', 'idx_books_format',
+    'idx_books_source', 'idx_books_is_read',
+)
+# Наборы индексов миграции 4: она создавала их до появления owner_id
+OBSOLETE_INDEXES_V4 = (
+    'idx_book_log_type',
+)
+QUERY_INDEXES_V4 = (
+    ('idx_book_log_type_date', 'book_log', ('event_type', 'event_date', 'book_id')),
+    ('idx_book_log_book_date', 'book_log', ('book_id', 'event_date')),
+    ('idx_to_read_list_priority', 'to_read_list', ('priority DESC', 'added_date')),
+    ('idx_to_buy_list_priority', 'to_buy_list', ('priority DESC', 'added_date')),
+)
+
+# Подсказки в /addmanual: вес свежести значения (сколько книг она стоит)
+# и через сколько добавленных книг он уменьшается вдвое
+VOCAB_RECENCY_WEIGHT = 3.0
+VOCAB_RECENCY_HALF_LIFE = 50
+
+# Размер страницы для /gettrl, /gettbr и /logs
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', '10'))
+
+# Нечеткий поиск: сколько строк индекса можно прочитать, сколько кандидатов оценить
+# и какой минимальной похожести должно хватить для выдачи
+FUZZY_ROW_BUDGET = 30000
+FUZZY_CANDIDATES = 200
+FUZZY_MIN_SIMILARITY = 0.3
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_conn():
-    """Создает подключение к базе данных с включенными внешними ключами"""
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        conn.execute("PRAGMA foreign_keys = ON")  
+_NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def normalize_text(text):
+    """Нормализует текст для поиска: casefold, ё→е, знаки препинания заменяются пробелами"""
+    if text is None:
+        return None
+    text = text.casefold().replace('ё', 'е')
+    return _NON_WORD_RE.sub(' ', text).strip()
+
+
+def connect(path):
+    """Открывает подключение к базе с настройками, общими для пула и потока записи"""
+    conn = sqlite3.connect(path, check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
+    conn.execute("PRAGMA foreign_keys = ON")
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    # Нужна триггерам, которые поддерживают нормализованные колонки книг
+    conn.create_function("normalize_text", 1, normalize_text, deterministic=True)
+    return conn
+
+
+class ConnectionPool:
+    """Пул долгоживущих подключений к SQLite.
+
+    Подключения создаются по требованию (не больше size), PRAGMA применяются
+    один раз при создании, подготовленные запросы кэшируются самим sqlite3.
+    """
+
+    def __init__(self, path, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return connect(self.path)
+
+    def acquire(self):
+        """Берет свободное подключение, при необходимости создавая новое"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._connections) < self.size:
+                conn = self._connect()
+                self._connections.append(conn)
+                return conn
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Нет свободных подключений к базе данных")
+
+    def release(self, conn):
+        """Возвращает подключение в пул, откатывая незавершенную транзакцию"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        """Закрывает все подключения пула"""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._idle = queue.LifoQueue()
+
+
+class _OpenLibrary:
+    """Открытая библиотека пользователя: пул подключений к ее файлу и счетчики обращений"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self.migrated = False
+        self.migrate_lock = threading.Lock()
+
+
+class LibraryPools:
+    """Библиотеки пользователей в отдельных файлах (DB_LAYOUT=per_user): LRU открытых пулов.
+
+    Файл библиотеки открывается при первом обращении к ней, тогда же к нему
+    применяются недостающие миграции. Открытыми держатся не больше capacity
+    библиотек: при превышении закрываются давно не использованные, а
+    библиотеки без обращений дольше idle_timeout секунд закрываются при
+    очередном обращении к любой библиотеке. Библиотека с занятым
+    подключением не закрывается, даже если лимит превышен.
+    """
+
+    def __init__(self, directory, capacity=DB_OPEN_LIBRARIES, idle_timeout=DB_LIBRARY_IDLE_TIMEOUT,
+                 pool_size=DB_LIBRARY_POOL_SIZE):
+        self.directory = directory
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self.pool_size = pool_size
+        self._libraries = OrderedDict()
+        # Выданное подключение -> владелец, чтобы release_conn вернул его в нужный пул
+        self._borrowed = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'opened': 0, 'evicted': 0, 'closed_idle': 0}
+
+    def path(self, owner_id):
+        return os.path.join(self.directory, f'library-{owner_id}.db')
+
+    def acquire(self, owner_id):
+        """Берет подключение к библиотеке владельца, открывая и мигрируя ее при необходимости"""
+        with self._lock:
+            library = self._libraries.get(owner_id)
+            if library is None:
+                library = self._libraries[owner_id] = _OpenLibrary(ConnectionPool(self.path(owner_id), self.pool_size))
+                self._stats['opened'] += 1
+            else:
+                self._libraries.move_to_end(owner_id)
+                self._stats['hits'] += 1
+            # Занятую библиотеку _evict не закроет, пока подключение не вернется
+            library.in_use += 1
+            library.last_used = time.monotonic()
+            self._evict()
+
+        try:
+            conn = library.pool.acquire()
+        except BaseException:
+            self._done(library)
+            raise
+        try:
+            if not library.migrated:
+                with library.migrate_lock:
+                    if not library.migrated:
+                        apply_migrations(conn)
+                        library.migrated = True
+        except BaseException:
+            library.pool.release(conn)
+            self._done(library)
+            raise
+
+        with self._lock:
+            self._borrowed[conn] = owner_id
         return conn
+
+    def owns(self, conn):
+        with self._lock:
+            return conn in self._borrowed
+
+    def release(self, conn):
+        with self._lock:
+            library = self._libraries[self._borrowed.pop(conn)]
+        library.pool.release(conn)
+        self._done(library)
+
+    def _done(self, library):
+        with self._lock:
+            library.in_use -= 1
+            library.last_used = time.monotonic()
+            self._evict()
+
+    def _evict(self):
+        """Закрывает лишние и простаивающие библиотеки, начиная с давно не использованных"""
+        now = time.monotonic()
+        for owner_id, library in list(self._libraries.items()):
+            over_capacity = len(self._libraries) > self.capacity
+            idle = now - library.last_used > self.idle_timeout
+            if not over_capacity and not idle:
+                break
+            if library.in_use:
+                continue
+            del self._libraries[owner_id]
+            library.pool.close()
+            self._stats['evicted' if over_capacity else 'closed_idle'] += 1
+
+    def close(self):
+        """Закрывает все открытые библиотеки"""
+        with self._lock:
+            for library in self._libraries.values():
+                library.pool.close()
+            self._libraries.clear()
+            self._borrowed.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open'] = len(self._libraries)
+            stats['in_use'] = sum(1 for library in self._libraries.values() if library.in_use)
+        stats['capacity'] = self.capacity
+        return stats
+
+
+_pool = None
+_libraries = None
+_pool_lock = threading.Lock()
+
+
+def open_pool():
+    """Открывает пул подключений (вызывается при старте бота)"""
+    global _pool, _libraries
+    with _pool_lock:
+        if _pool is None:
+            os.makedirs(os.path.dirname(DB_FILE) or '.', exist_ok=True)
+            _pool = ConnectionPool(DB_FILE)
+            logger.info(f"Пул подключений к базе данных открыт ({DB_POOL_SIZE} подключений)")
+        if DB_LAYOUT == 'per_user' and _libraries is None:
+            os.makedirs(LIBRARY_DIR, exist_ok=True)
+            _libraries = LibraryPools(LIBRARY_DIR)
+            logger.info(f"Библиотеки пользователей в {LIBRARY_DIR}: открыто не больше {DB_OPEN_LIBRARIES}, "
+                        f"по {DB_LIBRARY_POOL_SIZE} подключения")
+    return _pool
+
+
+def close_pool():
+    """Закрывает пул подключений (вызывается при остановке бота)"""
+    global _pool, _libraries
+    with _pool_lock:
+        if _libraries is not None:
+            _libraries.close()
+            _libraries = None
+            logger.info("Библиотеки пользователей закрыты")
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+            logger.info("Пул подключений к базе данных закрыт")
+
+
+def get_conn(owner_id=None):
+    """Берет подключение из пула; после работы его нужно вернуть через release_conn.
+
+    owner_id - владелец библиотеки, с которой идет работа: в раскладке per_user
+    подключение берется к файлу его библиотеки, в shared - к общей базе.
+    """
+    try:
+        if owner_id is not None and DB_LAYOUT == 'per_user':
+            if _libraries is None:
+                open_pool()
+            return _libraries.acquire(owner_id)
+        conn = getattr(_local, 'conn', None)
+        if conn is not None:
+            return conn
+        return (_pool or open_pool()).acquire()
     except sqlite3.Error as e:
         logger.error(f"Ошибка подключения к базе данных: {e}")
         raise
 
+
+def release_conn(conn):
+    """Возвращает подключение в пул"""
+    if conn is getattr(_local, 'conn', None):
+        return
+    if _libraries is not None and _libraries.owns(conn):
+        _libraries.release(conn)
+    elif _pool is not None:
+        _pool.release(conn)
+    else:
+        conn.close()
+
+
+def get_library_stats():
+    """Метрики открытых библиотек пользователей (только в раскладке per_user)"""
+    return _libraries.get_stats() if _libraries is not None else None
+
+
+class SerialWriter:
+    """Единственный поток записи в базу.
+
+    Все изменения данных отправляются сюда как единицы работы (функции) и
+    выполняются строго по очереди на собственном подключении, поэтому
+    писатели не конкурируют за блокировку базы. Результат или исключение
+    каждой единицы работы возвращается через отдельный Future.
+    Чтение по-прежнему идет через пул подключений.
+
+    Без path поток не держит своего подключения: так работают потоки записи
+    библиотек в раскладке per_user, за каждым из которых закреплена часть
+    владельцев, а подключения берутся из пулов их библиотек.
+    """
+
+    def __init__(self, path, name="db-writer"):
+        self.path = path
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._conn = None
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        if self.path is not None:
+            self._conn = connect(self.path)
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Выполняет уже поставленные единицы работы и останавливает поток"""
+        self._queue.put(None)
+        self._thread.join()
+        if self._conn is not None:
+            self._conn.close()
+
+    def in_writer_thread(self):
+        return threading.current_thread() is self._thread
+
+    def get_stats(self):
+        return {'queue_depth': self._queue.qsize(), 'completed': self.completed, 'failed': self.failed}
+
+    def submit(self, func, *args, **kwargs):
+        """Ставит func(*args, **kwargs) в очередь записи, возвращает concurrent.futures.Future"""
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _run(self):
+        _local.conn = self._conn
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+                self.completed += 1
+            except BaseException as e:
+                self.failed += 1
+                future.set_exception(e)
+            finally:
+                # Единица работы должна завершиться commit или rollback
+                if self._conn is not None and self._conn.in_transaction:
+                    self._conn.rollback()
+
+
+_writer = None
+# per_user: потоки записи библиотек, владелец закреплен за потоком owner_id % DB_WRITERS
+_library_writers = []
+# Подключение потока записи: get_conn в нем отдает его вместо подключения из пула
+_local = threading.local()
+
+
+def start_writer():
+    """Запускает поток записи (вызывается при старте бота, после init_db)"""
+    global _writer, _library_writers
+    if _writer is None:
+        _writer = SerialWriter(DB_FILE)
+        _writer.start()
+        logger.info("Поток записи в базу данных запущен")
+        if DB_LAYOUT == 'per_user':
+            _library_writers = [SerialWriter(None, name=f"db-writer-{i + 1}") for i in range(DB_WRITERS)]
+            for writer in _library_writers:
+                writer.start()
+            logger.info(f"Потоки записи в библиотеки пользователей запущены ({DB_WRITERS})")
+    return _writer
+
+
+def stop_writer():
+    """Останавливает поток записи, дождавшись очереди (вызывается при остановке бота)"""
+    global _writer, _library_writers
+    for writer in _library_writers:
+        writer.stop()
+    _library_writers = []
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+        logger.info("Поток записи в базу данных остановлен")
+
+
+def writer_started():
+    return _writer is not None
+
+
+def get_writer_stats():
+    """Метрики потока записи: очередь и число выполненных единиц работы (по всем потокам)"""
+    if _writer is None:
+        return None
+    stats = _writer.get_stats()
+    for writer in _library_writers:
+        for key, value in writer.get_stats().items():
+            stats[key] += value
+    stats['threads'] = 1 + len(_library_writers)
+    return stats
+
+
+def _submit(writer, func, args, kwargs):
+    # Без запущенного потока записи (скрипты, бенчмарки) или из самого потока записи выполняем сразу
+    if writer is None or any(w.in_writer_thread() for w in (_writer, *_library_writers)):
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+    return writer.submit(func, *args, **kwargs)
+
+
+def submit_write(func, *args, **kwargs):
+    """Отправляет изменение в общий поток записи и возвращает Future с его результатом.
+
+    Если поток записи не запущен (скрипты, бенчмарки) или вызов уже идет
+    из потока записи, функция выполняется сразу.
+    """
+    return _submit(_writer, func, args, kwargs)
+
+
+def submit_library_write(owner_id, func, *args, **kwargs):
+    """Отправляет изменение библиотеки владельца owner_id в ее поток записи.
+
+    В per_user владелец закреплен за потоком owner_id % DB_WRITERS, поэтому
+    файл одной библиотеки всегда пишет один поток, а библиотеки разных
+    владельцев пишутся параллельно. В shared и без владельца - общий поток.
+    """
+    writer = _writer
+    if _library_writers and owner_id is not None:
+        writer = _library_writers[owner_id % len(_library_writers)]
+    return _submit(writer, func, args, kwargs)
+
+
+def write(func, *args, **kwargs):
+    """Выполняет изменение через поток записи и ждет результат"""
+    return submit_write(func, *args, **kwargs).result()
+
+
+# Уведомления об изменении данных: каждая изменяющая функция после commit
+# вызывает notify_data_changed с затронутыми таблицами (и ID книг, если они известны)
+# и владельцем библиотеки, а кэши подписываются через on_data_changed
+_change_listeners = []
+
+
+def on_data_changed(listener):
+    """Подписывает listener(tables, book_ids, owner_id) на изменения.
+
+    tables=None - изменилось все; owner_id=None - изменения не одного владельца.
+    """
+    _change_listeners.append(listener)
+
+
+def notify_data_changed(tables=None, book_ids=None, owner_id=None):
+    tables = frozenset(tables) if tables is not None else None
+    for listener in _change_listeners:
+        listener(tables, book_ids, owner_id)
+
+
+_data_version = None
+
+
+def check_external_changes():
+    """Сбрасывает кэши, если базу изменил другой процесс (воркеры cluster.py делят один файл).
+
+    Выполняется в потоке записи: PRAGMA data_version его подключения меняется
+    только после commit из других подключений, а все изменения этого процесса
+    идут через поток записи и уведомляют кэши сами. Возвращает True, если
+    изменения были.
+    """
+    global _data_version
+    conn = get_conn()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute('PRAGMA data_version')
+        version = cursor.fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при проверке изменений базы другими процессами: {e}")
+        raise
+    finally:
+        release_conn(conn)
+
+    changed = _data_version is not None and version != _data_version
+    _data_version = version
+    if changed:
+        notify_data_changed()
+    return changed
+
+
+class BookCache:
+    """LRU-кэш строк books по ключу (владелец, ID книги) с ограничением по размеру.
+
+    Владелец входит в ключ: чужая книга не отдается из кэша, а в библиотеках
+    по пользователям (DB_LAYOUT=per_user) ID книг в разных файлах совпадают.
+
+    Строка, прочитанная до изменения книги, но положенная в кэш после
+    уведомления о нем, могла бы остаться в кэше устаревшей, поэтому
+    put принимает номер поколения, полученный до чтения из базы,
+    и ничего не кладет, если с тех пор кэш сбрасывался.
+    """
+
+    def __init__(self, size=BOOK_CACHE_SIZE):
+        self.size = size
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        """Возвращает (найдено, строка, поколение)"""
+        with self._lock:
+            if key in self._rows:
+                self._rows.move_to_end(key)
+                self._stats['hits'] += 1
+                return True, self._rows[key], self._generation
+            self._stats['misses'] += 1
+            return False, None, self._generation
+
+    def put(self, key, row, generation):
+        if self.size <= 0:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._rows[key] = row
+            self._rows.move_to_end(key)
+            while len(self._rows) > self.size:
+                self._rows.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, book_ids=None, owner_id=None):
+        """Сбрасывает книги с book_ids (None - все) владельца owner_id (None - всех владельцев)"""
+        with self._lock:
+            self._generation += 1
+            self._stats['invalidations'] += 1
+            if book_ids is None and owner_id is None:
+                self._rows.clear()
+            else:
+                book_ids = set(book_ids) if book_ids is not None else None
+                for key in [key for key in self._rows
+                            if (owner_id is None or key[0] == owner_id)
+                            and (book_ids is None or key[1] in book_ids)]:
+                    del self._rows[key]
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._rows)
+            stats['capacity'] = self.size
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+_book_cache = BookCache()
+
+
+def _invalidate_book_cache(tables, book_ids, owner_id):
+    if tables is None:
+        _book_cache.invalidate(owner_id=owner_id)
+    elif 'books' in tables:
+        _book_cache.invalidate(book_ids, owner_id)
+
+
+on_data_changed(_invalidate_book_cache)
+
+
+def get_book_cache_stats():
+    """Метрики кэша книг: попадания, промахи, вытеснения"""
+    return _book_cache.get_stats()
+
+
 def init_db():
-    """Инициализация базы данных - создание всех таблиц"""
+    """Инициализация базы данных: применяет миграции схемы, которых в ней еще нет.
+
+    Версия схемы хранится в PRAGMA user_version; если она актуальна,
+    никакие CREATE/ALTER не выполняются. В раскладке per_user так
+    инициализируется общая база, а библиотеки - при первом обращении к ним.
+    """
     conn = get_conn()
+    try:
+        apply_migrations(conn)
+    finally:
+        release_conn(conn)
+
+def apply_migrations(conn):
+    """Применяет к базе подключения conn недостающие миграции из MIGRATIONS"""
     cursor = conn.cursor()
     
     try:
-        os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
+        cursor.execute('PRAGMA user_version')
+        version = cursor.fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            logger.info(f"Схема базы данных актуальна (версия {version})")
+            return
+
+        # Пересборка таблиц требует выключенных внешних ключей,
+        # а переключить их можно только вне транзакции
+        cursor.execute('PRAGMA foreign_keys = OFF')
+        for target, description, migration in MIGRATIONS:
+            if target <= version:
+                continue
+            cursor.execute('BEGIN IMMEDIATE')
+            # Другой процесс мог успеть обновить схему, пока мы ждали блокировку
+            cursor.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] >= target:
+                conn.commit()
+                continue
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {target}')
+            conn.commit()
+            logger.info(f"Миграция {target} применена: {description}")
+            notify_data_changed()
+
+        logger.info(f"База данных успешно инициализирована (версия схемы {SCHEMA_VERSION})")
         
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            authors TEXT NOT NULL,
-            title TEXT NOT NULL,
-            description TEXT,
-            isbn TEXT,
-            format TEXT NOT NULL CHECK (format IN ('physical', 'digital')),
-            source TEXT CHECK (source IN ('shop', 'author.today', 'ficbook', 'ao3')),
-            year INTEGER CHECK (year > 1000 AND year <= 2030),
-            pages INTEGER CHECK (pages > 0),
-            char_count INTEGER CHECK (char_count >= 0),  
-            publisher TEXT,
-            genre TEXT,
-            url TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            series_name TEXT,
-            series_number INTEGER,
-            is_read BOOLEAN DEFAULT 0
-        )
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при инициализации базы данных: {e}")
+        conn.rollback()
+        raise
+    except RuntimeError as e:
+        # Миграция отказалась применяться: схема остается на прежней версии
+        logger.error(f"Миграция базы данных не применена: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute('PRAGMA foreign_keys = ON')
+
+def rebuild_table(cursor, table, create_sql, columns):
+    """Пересоздает таблицу по новому определению, сохраняя данные, индексы и триггеры.
+
+    create_sql - CREATE TABLE с {table} вместо имени, columns - переносимые колонки.
+    Вызывается внутри транзакции при выключенных внешних ключах.
+    """
+    cursor.execute('''
+    SELECT sql FROM sqlite_master
+    WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL
+    ''', (table,))
+    dependents = [row[0] for row in cursor.fetchall()]
+
+    column_list = ', '.join(columns)
+    cursor.execute(create_sql.format(table=f'{table}_new'))
+    cursor.execute(f'INSERT INTO {table}_new ({column_list}) SELECT {column_list} FROM {table}')
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+    for sql in dependents:
+        cursor.execute(sql)
+
+    cursor.execute(f'PRAGMA foreign_key_check({table})')
+    if cursor.fetchone() is not None:
+        raise sqlite3.IntegrityError(f"После пересборки {table} нарушены внешние ключи")
+
+def _init_library_stats_v1(cursor):
+    """Общие счетчики статистики в том виде, в каком их создавала миграция 1.
+
+    Заморожены вместе с миграцией: миграция 6 удаляет их и заводит счетчики по владельцам.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'library_stats'")
+    stats_exist = cursor.fetchone() is not None
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS library_stats (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS library_format_stats (
+        format TEXT PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS library_genre_stats (
+        genre TEXT PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    # События считаются по дням, чтобы сводка могла взять окно последних 30 дней
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS library_event_stats (
+        day TEXT NOT NULL,
+        event_type TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, event_type)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_stats_ai AFTER INSERT ON books BEGIN
+        UPDATE library_stats SET value = value + 1 WHERE key = 'total_books';
+        UPDATE library_stats SET value = value + COALESCE(new.is_read, 0) WHERE key = 'read_books';
+        INSERT INTO library_format_stats (format, count) VALUES (new.format, 1)
+            ON CONFLICT (format) DO UPDATE SET count = count + 1;
+        INSERT INTO library_genre_stats (genre, count)
+            SELECT new.genre, 1 WHERE new.genre IS NOT NULL AND new.genre != ''
+            ON CONFLICT (genre) DO UPDATE SET count = count + 1;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_stats_ad AFTER DELETE ON books BEGIN
+        UPDATE library_stats SET value = value - 1 WHERE key = 'total_books';
+        UPDATE library_stats SET value = value - COALESCE(old.is_read, 0) WHERE key = 'read_books';
+        UPDATE library_format_stats SET count = count - 1 WHERE format = old.format;
+        UPDATE library_genre_stats SET count = count - 1 WHERE genre = old.genre;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_stats_au AFTER UPDATE OF is_read, format, genre ON books BEGIN
+        UPDATE library_stats SET value = value - COALESCE(old.is_read, 0) + COALESCE(new.is_read, 0)
+            WHERE key = 'read_books';
+        UPDATE library_format_stats SET count = count - 1 WHERE format = old.format;
+        INSERT INTO library_format_stats (format, count) VALUES (new.format, 1)
+            ON CONFLICT (format) DO UPDATE SET count = count + 1;
+        UPDATE library_genre_stats SET count = count - 1 WHERE genre = old.genre;
+        INSERT INTO library_genre_stats (genre, count)
+            SELECT new.genre, 1 WHERE new.genre IS NOT NULL AND new.genre != ''
+            ON CONFLICT (genre) DO UPDATE SET count = count + 1;
+    END
+    ''')
+    for table, key in (('to_read_list', 'to_read_count'), ('to_buy_list', 'to_buy_count')):
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_stats_ai AFTER INSERT ON {table} BEGIN
+            UPDATE library_stats SET value = value + 1 WHERE key = '{key}';
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_stats_ad AFTER DELETE ON {table} BEGIN
+            UPDATE library_stats SET value = value - 1 WHERE key = '{key}';
+        END
         ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS book_log_stats_ai AFTER INSERT ON book_log BEGIN
+        INSERT INTO library_event_stats (day, event_type, count) VALUES (date(new.event_date), new.event_type, 1)
+            ON CONFLICT (day, event_type) DO UPDATE SET count = count + 1;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS book_log_stats_ad AFTER DELETE ON book_log BEGIN
+        UPDATE library_event_stats SET count = count - 1
+            WHERE day = date(old.event_date) AND event_type = old.event_type;
+    END
+    ''')
 
-        # Список для чтения (только книги, которые уже есть в библиотеке)
+    # Счетчики появились в уже заполненной базе - считаем их по существующим данным
+    if not stats_exist:
         cursor.execute('''
-        CREATE TABLE IF NOT EXISTS to_read_list (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            book_id INTEGER NOT NULL,
-            added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            notes TEXT,
-            FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE
-        )
+        INSERT INTO library_stats (key, value)
+        SELECT 'total_books', COUNT(*) FROM books
+        UNION ALL SELECT 'read_books', COUNT(*) FROM books WHERE is_read = 1
+        UNION ALL SELECT 'to_read_count', COUNT(*) FROM to_read_list
+        UNION ALL SELECT 'to_buy_count', COUNT(*) FROM to_buy_list
         ''')
-
-        # Список для покупки 
+        cursor.execute('INSERT INTO library_format_stats (format, count) SELECT format, COUNT(*) FROM books GROUP BY format')
         cursor.execute('''
-        CREATE TABLE IF NOT EXISTS to_buy_list (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            authors TEXT,
-            title TEXT,
-            notes TEXT,
-            priority INTEGER DEFAULT 1 CHECK (priority IN (1, 2, 3, 4, 5)),
-            added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            CONSTRAINT check_author_or_title CHECK (authors IS NOT NULL OR title IS NOT NULL)
-        )
+        INSERT INTO library_genre_stats (genre, count)
+        SELECT genre, COUNT(*) FROM books WHERE genre IS NOT NULL AND genre != '' GROUP BY genre
         ''')
-
-        # Лог событий с книгами
         cursor.execute('''
-        CREATE TABLE IF NOT EXISTS book_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            book_id INTEGER NOT NULL,
-            event_type TEXT NOT NULL CHECK (event_type IN ('added', 'started_reading', 'finished_reading', 'reviewed', 'moved_to_read_list')),
-            event_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            notes TEXT,
-            FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE
-        )
+        INSERT INTO library_event_stats (day, event_type, count)
+        SELECT date(event_date), event_type, COUNT(*) FROM book_log GROUP BY date(event_date), event_type
         ''')
 
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_title ON books(title)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_authors ON books(authors)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_isbn ON books(isbn)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_book_log_date ON book_log(event_date)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_book_log_type ON book_log(event_type)')
+def _migrate_base_schema(cursor):
+    """Схема, которую создавал init_db до появления миграций"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        authors TEXT NOT NULL,
+        title TEXT NOT NULL,
+        description TEXT,
+        isbn TEXT,
+        format TEXT NOT NULL CHECK (format IN ('physical', 'digital')),
+        source TEXT CHECK (source IN ('shop', 'author.today', 'ficbook', 'ao3')),
+        year INTEGER CHECK (year > 1000 AND year <= 2030),
+        pages INTEGER CHECK (pages > 0),
+        char_count INTEGER CHECK (char_count >= 0),  
+        publisher TEXT,
+        genre TEXT,
+        url TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        series_name TEXT,
+        series_number INTEGER,
+        is_read BOOLEAN DEFAULT 0,
+        title_norm TEXT,
+        authors_norm TEXT,
+        series_norm TEXT
+    )
+    ''')
+    init_normalized_columns(cursor)
 
-        conn.commit()
-        logger.info("База данных успешно инициализирована")
-        
-    except sqlite3.Error as e:
-        logger.error(f"Ошибка при инициализации базы данных: {e}")
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+    # Список для чтения (только книги, которые уже есть в библиотеке)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS to_read_list (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER NOT NULL,
+        added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        notes TEXT,
+        FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE
+    )
+    ''')
+
+    # Список для покупки 
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS to_buy_list (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        authors TEXT,
+        title TEXT,
+        notes TEXT,
+        priority INTEGER DEFAULT 1 CHECK (priority IN (1, 2, 3, 4, 5)),
+        added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        CONSTRAINT check_author_or_title CHECK (authors IS NOT NULL OR title IS NOT NULL)
+    )
+    ''')
+
+    # Лог событий с книгами
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS book_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER NOT NULL,
+        event_type TEXT NOT NULL CHECK (event_type IN ('added', 'started_reading', 'finished_reading', 'reviewed', 'moved_to_read_list')),
+        event_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        notes TEXT,
+        FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE
+    )
+    ''')
+
+    # Помесячные итоги для отчетов: закрытые месяцы запечатываются (sealed = 1)
+    # и больше не пересчитываются, текущий дозаполняется по событиям после last_log_id
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS monthly_rollup (
+        month TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        books_count INTEGER NOT NULL DEFAULT 0,
+        total_pages INTEGER NOT NULL DEFAULT 0,
+        total_chars INTEGER NOT NULL DEFAULT 0,
+        book_ids TEXT NOT NULL DEFAULT '[]',
+        last_log_id INTEGER NOT NULL DEFAULT 0,
+        sealed BOOLEAN NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (month, kind)
+    )
+    ''')
 
-def add_book(authors, title, description=None, isbn=None, format_type='physical', 
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_title ON books(title)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_authors ON books(authors)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_isbn ON books(isbn)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_book_log_date ON book_log(event_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_to_read_list_book ON to_read_list(book_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_title_norm ON books(title_norm)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_authors_norm ON books(authors_norm)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_series_norm ON books(series_norm)')
+    # Фильтры структурированного поиска (/search year:>2000 genre:фэнтези unread)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_year ON books(year)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_genre ON books(genre)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_format ON books(format)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_source ON books(source)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_books_is_read ON books(is_read)')
+
+    init_search_index(cursor)
+    _init_library_stats_v1(cursor)
+
+
+def _migrate_list_columns(cursor):
+    """Колонки, от которых зависят обработчики списков и лога"""
+    cursor.execute('PRAGMA table_info(to_read_list)')
+    if 'priority' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE to_read_list ADD COLUMN priority INTEGER DEFAULT 1 CHECK (priority IN (1, 2, 3, 4, 5))')
+
+    cursor.execute('PRAGMA table_info(book_log)')
+    if 'list_item_id' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE book_log ADD COLUMN list_item_id INTEGER')
+
+def _migrate_book_log_events(cursor):
+    """Новые типы событий в CHECK лога; у событий списка покупок book_id может быть пустым"""
+    event_types = (
+        'added', 'started_reading', 'finished_reading', 'reviewed', 'moved_to_read_list',
+        'added_to_read_list', 'removed_from_read_list', 'marked_as_read', 'priority_changed',
+        'added_to_buy_list', 'removed_from_buy_list', 'moved_from_buy_to_library',
+    )
+    placeholders = ', '.join('?' * len(event_types))
+    cursor.execute(f'SELECT DISTINCT event_type FROM book_log WHERE event_type NOT IN ({placeholders})', event_types)
+    unknown = [row[0] for row in cursor.fetchall()]
+    if unknown:
+        raise sqlite3.IntegrityError(f"В book_log есть неизвестные типы событий: {', '.join(map(str, unknown))}")
+
+    allowed = ', '.join(f"'{event_type}'" for event_type in event_types)
+    rebuild_table(cursor, 'book_log', f'''
+    CREATE TABLE {{table}} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER,
+        event_type TEXT NOT NULL CHECK (event_type IN ({allowed})),
+        event_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        notes TEXT,
+        list_item_id INTEGER,
+        FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE
+    )
+    ''', ('id', 'book_id', 'event_type', 'event_date', 'notes', 'list_item_id'))
+
+def _migrate_query_indexes(cursor):
+    """Составные индексы под горячие запросы (нужны колонки из миграции 2)"""
+    init_query_indexes(cursor, QUERY_INDEXES_V4, OBSOLETE_INDEXES_V4)
+
+def _migrate_fsm_state(cursor):
+    """Таблица состояний диалогов (FSM), чтобы они переживали перезапуск бота"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS fsm_state (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}',
+        updated_at REAL NOT NULL
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state(updated_at)')
+
+# Таблицы с данными пользователя: у каждой строки есть владелец (Telegram ID)
+OWNED_TABLES = ('books', 'to_read_list', 'to_buy_list', 'book_log')
+LIBRARY_STATS_TABLES = ('library_stats', 'library_format_stats', 'library_genre_stats', 'library_event_stats')
+
+def _migrate_owner_id(cursor):
+    """Владелец у книг, списков и лога; счетчики, итоги месяцев и индексы - по владельцам.
+
+    Строки существующей базы отдаются владельцу LEGACY_OWNER_ID. Без него
+    миграция с данными не применяется: иначе библиотека молча осталась бы
+    без владельца и пропала бы у пользователя, а повторно миграция не идет.
+    """
+    for table in OWNED_TABLES:
+        cursor.execute(f'PRAGMA table_info({table})')
+        if 'owner_id' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN owner_id INTEGER NOT NULL DEFAULT 0')
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {table} WHERE owner_id = 0)')
+        if cursor.fetchone()[0] and not LEGACY_OWNER_ID:
+            raise RuntimeError(
+                f"В базе есть данные без владельца ({table}): задайте LEGACY_OWNER_ID - "
+                f"Telegram ID пользователя, которому принадлежит эта библиотека, и перезапустите бота"
+            )
+        cursor.execute(f'UPDATE {table} SET owner_id = ? WHERE owner_id = 0', (LEGACY_OWNER_ID,))
+
+    # Итоги месяцев - производные данные: пересчитываются по владельцам при первом обращении
+    cursor.execute('DROP TABLE IF EXISTS monthly_rollup')
+    cursor.execute('''
+    CREATE TABLE monthly_rollup (
+        owner_id INTEGER NOT NULL,
+        month TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        books_count INTEGER NOT NULL DEFAULT 0,
+        total_pages INTEGER NOT NULL DEFAULT 0,
+        total_chars INTEGER NOT NULL DEFAULT 0,
+        book_ids TEXT NOT NULL DEFAULT '[]',
+        last_log_id INTEGER NOT NULL DEFAULT 0,
+        sealed BOOLEAN NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (owner_id, month, kind)
+    )
+    ''')
+
+    # Общие счетчики заменяются счетчиками по владельцам: старые триггеры ссылаются на старые таблицы
+    for table in OWNED_TABLES:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {table}_stats_{suffix}')
+    for table in LIBRARY_STATS_TABLES:
+        cursor.execute(f'DROP TABLE IF EXISTS {table}')
+    init_library_stats(cursor)
+
+    init_query_indexes(cursor, QUERY_INDEXES_V6, OBSOLETE_INDEXES_V6)
+
+def _migrate_genre_norm(cursor):
+    """Нормализованный жанр для фильтра genre: (регистр и ё не важны, в том числе у кириллицы)"""
+    cursor.execute('PRAGMA table_info(books)')
+    if 'genre_norm' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE books ADD COLUMN genre_norm TEXT')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_genre_norm_ai AFTER INSERT ON books BEGIN
+        UPDATE books SET genre_norm = normalize_text(new.genre) WHERE id = new.id;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_genre_norm_au AFTER UPDATE OF genre ON books BEGIN
+        UPDATE books SET genre_norm = normalize_text(new.genre) WHERE id = new.id;
+    END
+    ''')
+    cursor.execute('UPDATE books SET genre_norm = normalize_text(genre) WHERE genre IS NOT NULL')
+
+    init_query_indexes(cursor)
+
+def _migrate_rollup_log_ids(cursor):
+    """События книг в итогах месяцев: отчет за запечатанный месяц строится без пересканирования лога"""
+    cursor.execute('PRAGMA table_info(monthly_rollup)')
+    if 'log_ids' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE monthly_rollup ADD COLUMN log_ids TEXT NOT NULL DEFAULT '[]'")
+    # Итоги - производные данные: без событий запечатанные строки бесполезны, пересчитываются при обращении
+    cursor.execute('DELETE FROM monthly_rollup')
+
+# Миграции схемы по порядку: (версия, описание, функция).
+# Новая миграция добавляется в конец со следующим номером, старые не меняются
+MIGRATIONS = (
+    (1, 'базовая схема', _migrate_base_schema),
+    (2, 'колонки list_item_id и to_read_list.priority', _migrate_list_columns),
+    (3, 'новые типы событий в book_log', _migrate_book_log_events),
+    (4, 'составные индексы под горячие запросы', _migrate_query_indexes),
+    (5, 'таблица состояний диалогов', _migrate_fsm_state),
+    (6, 'владелец (owner_id) у книг, списков и лога', _migrate_owner_id),
+    (7, 'нормализованный жанр книг', _migrate_genre_norm),
+    (8, 'события книг в итогах месяцев', _migrate_rollup_log_ids),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def init_query_indexes(cursor, indexes=QUERY_INDEXES, obsolete=OBSOLETE_INDEXES):
+    """Создает составные индексы под горячие запросы и удаляет те, что ими заменены"""
+    for name in obsolete:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+    for name, table, columns in indexes:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({', '.join(columns)})")
+
+def init_normalized_columns(cursor):
+    """Добавляет нормализованные колонки поиска и триггеры, которые их заполняют"""
+    cursor.execute('PRAGMA table_info(books)')
+    columns = {row[1] for row in cursor.fetchall()}
+    for column in ('title_norm', 'authors_norm', 'series_norm'):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE books ADD COLUMN {column} TEXT')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_norm_ai AFTER INSERT ON books BEGIN
+        UPDATE books SET
+            title_norm = normalize_text(new.title),
+            authors_norm = normalize_text(new.authors),
+            series_norm = normalize_text(new.series_name)
+        WHERE id = new.id;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_norm_au AFTER UPDATE OF title, authors, series_name ON books BEGIN
+        UPDATE books SET
+            title_norm = normalize_text(new.title),
+            authors_norm = normalize_text(new.authors),
+            series_norm = normalize_text(new.series_name)
+        WHERE id = new.id;
+    END
+    ''')
+
+    # Книги, добавленные до появления колонок
+    cursor.execute('''
+    UPDATE books SET
+        title_norm = normalize_text(title),
+        authors_norm = normalize_text(authors),
+        series_norm = normalize_text(series_name)
+    WHERE title_norm IS NULL
+    ''')
+
+def init_search_index(cursor):
+    """Создает полнотекстовый индекс FTS5 по нормализованным колонкам книг и триггеры его синхронизации"""
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'")
+    row = cursor.fetchone()
+    if row and 'title_norm' not in row[0]:
+        # Индекс старого формата (по исходным колонкам) пересоздается
+        for trigger in ('books_fts_ai', 'books_fts_ad', 'books_fts_au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        cursor.execute('DROP TABLE books_fts')
+        row = None
+    index_exists = row is not None
+
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title_norm, authors_norm, series_norm,
+        content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    ''')
+
+    # Значения вычисляются заново: порядок срабатывания триггеров на INSERT не гарантирован
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts (rowid, title_norm, authors_norm, series_norm)
+        VALUES (new.id, normalize_text(new.title), normalize_text(new.authors), normalize_text(new.series_name));
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts (books_fts, rowid, title_norm, authors_norm, series_norm)
+        VALUES ('delete', old.id, normalize_text(old.title), normalize_text(old.authors), normalize_text(old.series_name));
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, authors, series_name ON books BEGIN
+        INSERT INTO books_fts (books_fts, rowid, title_norm, authors_norm, series_norm)
+        VALUES ('delete', old.id, normalize_text(old.title), normalize_text(old.authors), normalize_text(old.series_name));
+        INSERT INTO books_fts (rowid, title_norm, authors_norm, series_norm)
+        VALUES (new.id, normalize_text(new.title), normalize_text(new.authors), normalize_text(new.series_name));
+    END
+    ''')
+
+    # Индекс появился в уже заполненной базе - наполняем его существующими книгами
+    if not index_exists:
+        cursor.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+        logger.info("Полнотекстовый индекс книг построен")
+
+    init_trigram_index(cursor)
+
+def init_trigram_index(cursor):
+    """Создает триграммный индекс книг для нечеткого поиска и триггеры его синхронизации"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_trgm'")
+    index_exists = cursor.fetchone() is not None
+
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_trgm USING fts5(
+        title_norm, authors_norm, series_norm,
+        content='books', content_rowid='id', detail='none',
+        tokenize='trigram'
+    )
+    ''')
+    # Частоты триграмм: по ним выбираются самые редкие (избирательные) триграммы запроса
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS books_trgm_vocab USING fts5vocab(books_trgm, 'row')")
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_trgm_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_trgm (rowid, title_norm, authors_norm, series_norm)
+        VALUES (new.id, normalize_text(new.title), normalize_text(new.authors), normalize_text(new.series_name));
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_trgm_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_trgm (books_trgm, rowid, title_norm, authors_norm, series_norm)
+        VALUES ('delete', old.id, normalize_text(old.title), normalize_text(old.authors), normalize_text(old.series_name));
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_trgm_au AFTER UPDATE OF title, authors, series_name ON books BEGIN
+        INSERT INTO books_trgm (books_trgm, rowid, title_norm, authors_norm, series_norm)
+        VALUES ('delete', old.id, normalize_text(old.title), normalize_text(old.authors), normalize_text(old.series_name));
+        INSERT INTO books_trgm (rowid, title_norm, authors_norm, series_norm)
+        VALUES (new.id, normalize_text(new.title), normalize_text(new.authors), normalize_text(new.series_name));
+    END
+    ''')
+
+    if not index_exists:
+        cursor.execute("INSERT INTO books_trgm (books_trgm) VALUES ('rebuild')")
+        logger.info("Триграммный индекс книг построен")
+
+def _insert_book(cursor, owner_id, authors, title, description=None, isbn=None, format_type='physical',
+                 source='shop', year=None, pages=None, char_count=None, publisher=None, genre=None, url=None,
+                 series_name=None, series_number=None, is_read=False):
+    """Вставляет книгу владельца и событие 'added' в текущей транзакции, возвращает ID книги"""
+    cursor.execute('''
+    INSERT INTO books (
+        owner_id, authors, title, description, isbn, format, source, year, pages, char_count, publisher, genre, url,
+        series_name, series_number, is_read
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        owner_id, authors, title, description, isbn, format_type, source, year, pages, char_count, publisher, genre, url,
+        series_name, series_number, int(is_read)
+    ))
+    
+    book_id = cursor.lastrowid
+    
+    cursor.execute('''
+    INSERT INTO book_log (owner_id, book_id, event_type, notes)
+    VALUES (?, ?, 'added', 'Книга добавлена в библиотеку')
+    ''', (owner_id, book_id))
+    return book_id
+
+def add_book(owner_id, authors, title, description=None, isbn=None, format_type='physical', 
              source='shop', year=None, pages=None, char_count=None, publisher=None, genre=None, url=None,
              series_name=None, series_number=None, is_read=False):
-    """Добавляет новую книгу в библиотеку"""
-    conn = get_conn()
+    """Добавляет новую книгу в библиотеку владельца"""
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
     
     try:
-        cursor.execute('''
-        INSERT INTO books (
-            authors, title, description, isbn, format, source, year, pages, char_count, publisher, genre, url,
-            series_name, series_number, is_read
+        book_id = _insert_book(
+            cursor, owner_id, authors, title, description, isbn, format_type, source, year, pages, char_count,
+            publisher, genre, url, series_name, series_number, is_read
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            authors, title, description, isbn, format_type, source, year, pages, char_count, publisher, genre, url,
-            series_name, series_number, int(is_read)  
-        ))
-        
-        book_id = cursor.lastrowid
-        
-        cursor.execute('''
-        INSERT INTO book_log (book_id, event_type, notes)
-        VALUES (?, 'added', 'Книга добавлена в библиотеку')
-        ''', (book_id,))
         
         conn.commit()
+        notify_data_changed(('books', 'book_log'), [book_id], owner_id)
         logger.info(f"Книга '{title}' успешно добавлена с ID: {book_id}")
         return book_id
         
@@ -139,50 +1345,433 @@ def add_book(authors, title, description=None, isbn=None, format_type='physical'
         conn.rollback()
         raise
     finally:
-        conn.close()
+        release_conn(conn)
 
-def get_all_books():
-    """Получает все книги из библиотеки"""
-    conn = get_conn()
+def get_all_books(owner_id):
+    """Получает все книги из библиотеки владельца"""
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
     
     try:
-        cursor.execute('SELECT * FROM books ORDER BY title')
+        cursor.execute('SELECT * FROM books WHERE owner_id = ? ORDER BY title', (owner_id,))
         books = cursor.fetchall()
         return books
     except sqlite3.Error as e:
         logger.error(f"Ошибка при получении списка книг: {e}")
         raise
     finally:
-        conn.close()
+        release_conn(conn)
 
-def search_books(query):
-    """Поиск книг по названию или автору"""
-    conn = get_conn()
+def build_fts_query(query):
+    """Превращает пользовательский запрос в выражение FTS5: все слова, поиск по префиксу"""
+    terms = []
+    for word in query.split():
+        if any(ch.isalnum() for ch in word):
+            terms.append('"' + word.replace('"', '""') + '"*')
+    return " ".join(terms)
+
+def build_fts_phrase(text):
+    """Выражение FTS5 для фразы: слова должны идти подряд и целиком"""
+    if not any(ch.isalnum() for ch in text):
+        return ''
+    return '"' + " ".join(text.split()).replace('"', '""') + '"'
+
+def find_books(owner_id, query, limit=10, exclude_to_read=False):
+    """Поиск книг владельца по словам из названия, авторов или серии с ранжированием bm25"""
+    fts_query = build_fts_query(normalize_text(query))
+    if not fts_query:
+        return []
+
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
     
     try:
-        cursor.execute('''
-        SELECT * FROM books 
-        WHERE title LIKE ? OR authors LIKE ?
-        ORDER BY title
-        ''', (f'%{query}%', f'%{query}%'))
+        exclude_clause = '''
+        AND NOT EXISTS (SELECT 1 FROM to_read_list trl WHERE trl.book_id = b.id)
+        ''' if exclude_to_read else ''
         
-        books = cursor.fetchall()
-        return books
+        # Название весит больше автора и серии
+        cursor.execute(f'''
+        SELECT b.id, b.title, b.authors, b.pages, b.series_name, b.series_number
+        FROM books_fts
+        JOIN books b ON b.id = books_fts.rowid
+        WHERE books_fts MATCH ? AND b.owner_id = ?
+        {exclude_clause}
+        ORDER BY bm25(books_fts, 10.0, 5.0, 3.0)
+        LIMIT ?
+        ''', (fts_query, owner_id, limit))
+        
+        return cursor.fetchall()
     except sqlite3.Error as e:
         logger.error(f"Ошибка при поиске книг: {e}")
         raise
     finally:
-        conn.close()
+        release_conn(conn)
 
-def add_to_read_list(book_id, notes=None):
-    """Добавляет книгу в список для чтения"""
-    conn = get_conn()
+def structured_search(owner_id, query, limit=10):
+    """Поиск книг владельца по строке с фильтрами (author:, series:, year:, genre:, unread ...) одним SQL-запросом"""
+    parsed = parse_search_query(query)
+
+    fts_terms = []
+    text_query = build_fts_query(normalize_text(" ".join(parsed['words'])))
+    if text_query:
+        fts_terms.append(text_query)
+    for phrase in parsed['phrases']:
+        phrase_query = build_fts_phrase(normalize_text(phrase))
+        if phrase_query:
+            fts_terms.append(phrase_query)
+    for column, values in (('authors_norm', parsed['author']), ('title_norm', parsed['title'])):
+        for value, quoted in values:
+            value_query = (build_fts_phrase if quoted else build_fts_query)(normalize_text(value))
+            if value_query:
+                fts_terms.append(f'{column} : ({value_query})')
+
+    conditions = []
+    params = []
+    for value, exact in parsed['series']:
+        if exact:
+            conditions.append('b.series_norm = ?')
+            params.append(normalize_text(value))
+        else:
+            conditions.append('b.series_norm GLOB ?')
+            params.append(normalize_text(value) + '*')
+    for op, year in parsed['year']:
+        conditions.append(f'b.year {op} ?')
+        params.append(year)
+    for genre in parsed['genre']:
+        # Жанры хранятся как введены, сравниваются нормализованными (регистр, ё)
+        conditions.append('b.genre_norm = ?')
+        params.append(normalize_text(genre))
+    for column in ('format', 'source'):
+        for value in parsed[column]:
+            conditions.append(f'b.{column} = ?')
+            params.append(value)
+    if parsed['is_read'] is not None:
+        conditions.append('b.is_read = ?')
+        params.append(parsed['is_read'])
+
+    if not fts_terms and not conditions:
+        return []
+
+    if fts_terms:
+        sql = '''
+        SELECT b.id, b.title, b.authors, b.pages, b.series_name, b.series_number
+        FROM books_fts
+        JOIN books b ON b.id = books_fts.rowid
+        WHERE books_fts MATCH ? AND b.owner_id = ?
+        '''
+        params[:0] = [" ".join(fts_terms), owner_id]
+        order_by = 'bm25(books_fts, 10.0, 5.0, 3.0)'
+    else:
+        sql = '''
+        SELECT b.id, b.title, b.authors, b.pages, b.series_name, b.series_number
+        FROM books b
+        WHERE b.owner_id = ?
+        '''
+        params.insert(0, owner_id)
+        # Унарный плюс: сортировка не должна тянуть планировщик к индексу по названию
+        # вместо индекса фильтра (формат, источник, год...)
+        order_by = '+b.title_norm'
+
+    for condition in conditions:
+        sql += f' AND {condition}'
+    sql += f' ORDER BY {order_by} LIMIT ?'
+    params.append(limit)
+
+    conn = get_conn(owner_id)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при структурированном поиске книг: {e}")
+        raise
+    finally:
+        release_conn(conn)
+
+def _word_trigrams(word):
+    """Триграммы слова с отступами по краям, как в pg_trgm"""
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _similarity(query_words, text):
+    """Средняя по словам запроса похожесть на самое близкое слово текста (мера Жаккара по триграммам)"""
+    text_grams = [_word_trigrams(word) for word in text.split()]
+    if not text_grams:
+        return 0.0
+
+    total = 0.0
+    for word in query_words:
+        grams = _word_trigrams(word)
+        total += max(len(grams & other) / len(grams | other) for other in text_grams)
+    return total / len(query_words)
+
+def fuzzy_find_books(owner_id, query, limit=10, exclude_to_read=False):
+    """Нечеткий поиск книг владельца с опечатками по триграммному индексу"""
+    query_words = normalize_text(query).split()
+    trigrams = {word[i:i + 3] for word in query_words for i in range(len(word) - 2)}
+    if not trigrams:
+        return []
+
+    conn = get_conn(owner_id)
+    cursor = conn.cursor()
+    
+    try:
+        placeholders = ', '.join('?' * len(trigrams))
+        cursor.execute(f'''
+        SELECT term, doc FROM books_trgm_vocab
+        WHERE term IN ({placeholders})
+        ORDER BY doc
+        ''', tuple(trigrams))
+        frequencies = cursor.fetchall()
+        
+        # Берем триграммы начиная с самых редких, пока не исчерпан бюджет строк;
+        # искаженные опечаткой триграммы в индексе отсутствуют и сюда не попадают
+        terms = []
+        rows_read = 0
+        for term, doc_count in frequencies:
+            if terms and rows_read + doc_count > FUZZY_ROW_BUDGET:
+                break
+            rows_read += doc_count
+            terms.append('"' + term.replace('"', '""') + '"')
+        if not terms:
+            return []
+
+        # Совпавшие триграммы считаются в SQLite одним запросом, а не построчно в Python.
+        # Индекс общий: книги других владельцев отсеиваются уже после группировки,
+        # CROSS JOIN оставляет группировку внешним циклом, а не перебор всех книг владельца
+        union = ' UNION ALL '.join(['SELECT rowid FROM books_trgm WHERE books_trgm MATCH ?'] * len(terms))
+        cursor.execute(f'''
+        SELECT m.rowid FROM (
+            SELECT rowid, COUNT(*) AS hits FROM ({union}) GROUP BY rowid
+        ) m
+        CROSS JOIN books b ON b.id = m.rowid
+        WHERE b.owner_id = ?
+        ORDER BY m.hits DESC
+        LIMIT ?
+        ''', (*terms, owner_id, FUZZY_CANDIDATES))
+        candidate_ids = [row[0] for row in cursor.fetchall()]
+        if not candidate_ids:
+            return []
+        
+        exclude_clause = '''
+        AND NOT EXISTS (SELECT 1 FROM to_read_list trl WHERE trl.book_id = b.id)
+        ''' if exclude_to_read else ''
+        
+        placeholders = ', '.join('?' * len(candidate_ids))
+        cursor.execute(f'''
+        SELECT b.id, b.title, b.authors, b.pages, b.series_name, b.series_number,
+               b.title_norm, b.authors_norm, b.series_norm
+        FROM books b
+        WHERE b.id IN ({placeholders})
+        {exclude_clause}
+        ''', candidate_ids)
+        
+        scored = []
+        for row in cursor.fetchall():
+            text = " ".join(field for field in row[6:] if field)
+            similarity = _similarity(query_words, text)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                scored.append((similarity, row[:6]))
+        
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [row for _, row in scored[:limit]]
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при нечетком поиске книг: {e}")
+        raise
+    finally:
+        release_conn(conn)
+
+def get_book(owner_id, book_id):
+    """Получает основные данные книги владельца по ID (через кэш книг); чужая книга - None"""
+    key = (owner_id, book_id)
+    found, row, generation = _book_cache.get(key)
+    if found:
+        return row
+    
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
     
     try:
-        cursor.execute('SELECT id FROM books WHERE id = ?', (book_id,))
+        cursor.execute('''
+        SELECT id, title, authors, series_name, series_number, pages, format, is_read
+        FROM books
+        WHERE id = ? AND owner_id = ?
+        ''', (book_id, owner_id))
+        row = cursor.fetchone()
+        if row is not None:
+            _book_cache.put(key, row, generation)
+        return row
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении книги: {e}")
+        raise
+    finally:
+        release_conn(conn)
+
+class Vocabulary:
+    """Словари для подсказок в /addmanual по библиотеке одного владельца: жанры, издатели и серии по автору.
+
+    Строится одним проходом по книгам владельца при первом обращении. Если
+    уведомление об изменении books говорит только о новых книгах (ID больше
+    последнего учтенного), дочитываются только они; изменение или удаление
+    уже учтенных книг (и изменение без списка ID) сбрасывает словари, и они
+    строятся заново, чтобы удаленные значения пропали из подсказок. Подсказки отсортированы по
+    частоте и свежести: значение, которое часто встречается или недавно
+    использовалось, идет выше; готовые списки кэшируются до следующего изменения.
+    """
+
+    def __init__(self, owner_id, recency_weight=VOCAB_RECENCY_WEIGHT, half_life=VOCAB_RECENCY_HALF_LIFE):
+        self.owner_id = owner_id
+        self.recency_weight = recency_weight
+        self.half_life = half_life
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._stale = False
+        self._last_id = 0
+        # значение -> [число книг, ID последней книги с ним]
+        self._genres = {}
+        self._publishers = {}
+        self._series = {}
+        self._rankings = {}
+
+    def mark_stale(self, book_ids=None):
+        """Помечает словари устаревшими после изменения книг book_ids (None - неизвестно каких)"""
+        with self._lock:
+            self._stale = True
+            if book_ids is None or any(book_id <= self._last_id for book_id in book_ids):
+                self._loaded = False
+
+    def genres(self, limit):
+        return self._ranked(('genre',), lambda: self._genres, limit)
+
+    def publishers(self, limit):
+        return self._ranked(('publisher',), lambda: self._publishers, limit)
+
+    def series(self, authors, limit):
+        return self._ranked(('series', authors), lambda: self._series.get(authors, {}), limit)
+
+    def _ranked(self, key, counts, limit):
+        self._refresh()
+        with self._lock:
+            ranking = self._rankings.get(key)
+            if ranking is None:
+                ranking = self._rank(counts())
+                self._rankings[key] = ranking
+            return ranking[:limit]
+
+    def _rank(self, counts):
+        def score(item):
+            count, last_id = item[1]
+            age = self._last_id - last_id
+            return count + self.recency_weight * 0.5 ** (age / self.half_life)
+        return [value for value, _ in sorted(counts.items(), key=score, reverse=True)]
+
+    def _refresh(self):
+        with self._lock:
+            if self._loaded and not self._stale:
+                return
+            if not self._loaded:
+                self._genres, self._publishers, self._series = {}, {}, {}
+                self._last_id = 0
+                self._rankings.clear()
+            self._stale = False
+            last_id = self._last_id
+
+        conn = get_conn(self.owner_id)
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+            SELECT id, genre, publisher, authors, series_name
+            FROM books
+            WHERE owner_id = ? AND id > ?
+            ORDER BY id
+            ''', (self.owner_id, last_id))
+            rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при построении словарей подсказок: {e}")
+            with self._lock:
+                self._stale = True
+            raise
+        finally:
+            release_conn(conn)
+
+        with self._lock:
+            if self._last_id != last_id:
+                # Другой поток уже дочитал эти книги
+                return
+            for book_id, genre, publisher, authors, series_name in rows:
+                self._count(self._genres, genre, book_id)
+                self._count(self._publishers, publisher, book_id)
+                if authors:
+                    self._count(self._series.setdefault(authors, {}), series_name, book_id)
+                self._last_id = book_id
+            self._loaded = True
+            if rows:
+                self._rankings.clear()
+
+    @staticmethod
+    def _count(counts, value, book_id):
+        if value is None or not value.strip():
+            return
+        entry = counts.setdefault(value, [0, 0])
+        entry[0] += 1
+        entry[1] = book_id
+
+
+# Владелец -> его словари (LRU на VOCAB_CACHE_SIZE владельцев);
+# при изменении книг помечаются словари ее владельца (без владельца - все)
+_vocabularies = OrderedDict()
+_vocabularies_lock = threading.Lock()
+
+
+def _get_vocabulary(owner_id):
+    with _vocabularies_lock:
+        vocabulary = _vocabularies.get(owner_id)
+        if vocabulary is not None:
+            _vocabularies.move_to_end(owner_id)
+            return vocabulary
+        vocabulary = Vocabulary(owner_id)
+        if VOCAB_CACHE_SIZE > 0:
+            _vocabularies[owner_id] = vocabulary
+            while len(_vocabularies) > VOCAB_CACHE_SIZE:
+                _vocabularies.popitem(last=False)
+        return vocabulary
+
+
+def _refresh_vocabulary(tables, book_ids, owner_id):
+    if tables is not None and 'books' not in tables:
+        return
+    with _vocabularies_lock:
+        if owner_id is None:
+            vocabularies = list(_vocabularies.values())
+        else:
+            vocabularies = [_vocabularies[owner_id]] if owner_id in _vocabularies else []
+    for vocabulary in vocabularies:
+        vocabulary.mark_stale(book_ids if tables is not None else None)
+
+
+on_data_changed(_refresh_vocabulary)
+
+def get_genres(owner_id, limit=20):
+    """Жанры, уже встречающиеся в библиотеке владельца: сначала частые и недавние"""
+    return _get_vocabulary(owner_id).genres(limit)
+
+def get_publishers(owner_id, limit=20):
+    """Издатели, уже встречающиеся в библиотеке владельца: сначала частые и недавние"""
+    return _get_vocabulary(owner_id).publishers(limit)
+
+def get_series_by_author(owner_id, authors, limit=20):
+    """Серии, уже встречающиеся у автора в библиотеке владельца: сначала частые и недавние"""
+    return _get_vocabulary(owner_id).series(authors, limit)
+
+def add_to_read_list(owner_id, book_id, notes=None, priority=1):
+    """Добавляет книгу владельца в его список для чтения"""
+    conn = get_conn(owner_id)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('SELECT id FROM books WHERE id = ? AND owner_id = ?', (book_id, owner_id))
         if not cursor.fetchone():
             raise ValueError(f"Книга с ID {book_id} не найдена")
         
@@ -191,122 +1780,338 @@ def add_to_read_list(book_id, notes=None):
             raise ValueError("Книга уже в списке для чтения")
         
         cursor.execute('''
-        INSERT INTO to_read_list (book_id, notes)
-        VALUES (?, ?)
-        ''', (book_id, notes))
+        INSERT INTO to_read_list (owner_id, book_id, notes, priority)
+        VALUES (?, ?, ?, ?)
+        ''', (owner_id, book_id, notes, priority))
+        
+        list_item_id = cursor.lastrowid
         
         cursor.execute('''
-        INSERT INTO book_log (book_id, event_type, notes)
-        VALUES (?, 'moved_to_read_list', ?)
-        ''', (book_id, notes or 'Книга добавлена в список для чтения'))
+        INSERT INTO book_log (owner_id, book_id, event_type, notes, list_item_id)
+        VALUES (?, ?, 'added_to_read_list', ?, ?)
+        ''', (owner_id, book_id, notes, list_item_id))
         
         conn.commit()
+        notify_data_changed(('to_read_list', 'book_log'), owner_id=owner_id)
         logger.info(f"Книга с ID {book_id} добавлена в список для чтения")
+        return list_item_id
         
     except sqlite3.Error as e:
         logger.error(f"Ошибка при добавлении в список для чтения: {e}")
         conn.rollback()
         raise
     finally:
-        conn.close()
+        release_conn(conn)
 
-def add_to_buy_list(authors=None, title=None, notes=None, priority=1):
-    """Добавляет книгу в список для покупки"""
+def add_to_buy_list(owner_id, authors=None, title=None, notes=None, priority=1):
+    """Добавляет книгу в список для покупки владельца"""
     if not authors and not title:
         raise ValueError("Необходимо указать хотя бы автора или название")
     
-    conn = get_conn()
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
     
     try:
         cursor.execute('''
-        INSERT INTO to_buy_list (authors, title, notes, priority)
-        VALUES (?, ?, ?, ?)
-        ''', (authors, title, notes, priority))
-        
+        INSERT INTO to_buy_list (owner_id, authors, title, notes, priority)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (owner_id, authors, title, notes, priority))
+
+        list_item_id = cursor.lastrowid
+
+        cursor.execute('''
+        INSERT INTO book_log (owner_id, book_id, event_type, notes, list_item_id)
+        VALUES (?, NULL, 'added_to_buy_list', ?, ?)
+        ''', (owner_id, _buy_log_notes(title, authors, notes), list_item_id))
+
         conn.commit()
+        notify_data_changed(('to_buy_list', 'book_log'), owner_id=owner_id)
         logger.info(f"Книга добавлена в список для покупки: {title or 'Без названия'}")
+        return list_item_id
         
     except sqlite3.Error as e:
         logger.error(f"Ошибка при добавлении в список для покупки: {e}")
         conn.rollback()
         raise
     finally:
-        conn.close()
+        release_conn(conn)
 
-def get_to_read_list():
-    """Получает список книг для чтения"""
-    conn = get_conn()
+def get_to_buy_item(owner_id, item_id):
+    """Получает запись из списка для покупки владельца"""
+    conn = get_conn(owner_id)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('SELECT authors, title, notes FROM to_buy_list WHERE id = ? AND owner_id = ?',
+                       (item_id, owner_id))
+        return cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении записи из списка для покупки: {e}")
+        raise
+    finally:
+        release_conn(conn)
+
+def get_to_read_item(owner_id, trl_id):
+    """Получает запись из списка для чтения владельца вместе с данными книги (книга - из кэша)"""
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
     
     try:
+        cursor.execute('SELECT book_id, notes, priority FROM to_read_list WHERE id = ? AND owner_id = ?',
+                       (trl_id, owner_id))
+        item = cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении записи из списка для чтения: {e}")
+        raise
+    finally:
+        release_conn(conn)
+    
+    if item is None:
+        return None
+    book_id, notes, priority = item
+    book = get_book(owner_id, book_id)
+    if book is None:
+        return None
+    return book_id, book[1], book[2], notes, priority
+
+# Операции со списками: изменение и его событие в логе пишутся одной транзакцией,
+# поэтому лог не расходится с данными, даже если бот упадет между шагами
+
+def _buy_log_notes(title, authors, notes):
+    """Описание записи списка покупок для лога: книги в библиотеке у нее еще нет"""
+    parts = []
+    if title:
+        parts.append(f"Название: {title}")
+    if authors:
+        parts.append(f"Автор: {authors}")
+    if notes:
+        parts.append(f"Заметки: {notes}")
+    return " | ".join(parts) if parts else None
+
+def _get_read_item(cursor, owner_id, trl_id):
+    cursor.execute('SELECT book_id, notes, priority FROM to_read_list WHERE id = ? AND owner_id = ?',
+                   (trl_id, owner_id))
+    row = cursor.fetchone()
+    if not row:
+        raise ValueError(f"Запись {trl_id} не найдена в списке для чтения")
+    return row
+
+def _get_buy_item(cursor, owner_id, item_id):
+    cursor.execute('SELECT authors, title, notes FROM to_buy_list WHERE id = ? AND owner_id = ?',
+                   (item_id, owner_id))
+    row = cursor.fetchone()
+    if not row:
+        raise ValueError(f"Запись {item_id} не найдена в списке для покупки")
+    return row
+
+def mark_read(owner_id, trl_id):
+    """Отмечает книгу прочитанной, убирает ее из списка для чтения и пишет событие в лог"""
+    conn = get_conn(owner_id)
+    cursor = conn.cursor()
+    
+    try:
+        book_id, notes, _ = _get_read_item(cursor, owner_id, trl_id)
+        cursor.execute('UPDATE books SET is_read = 1 WHERE id = ?', (book_id,))
+        cursor.execute('DELETE FROM to_read_list WHERE id = ?', (trl_id,))
         cursor.execute('''
-        SELECT trl.id, b.title, b.authors, trl.added_date, trl.notes
-        FROM to_read_list trl
-        JOIN books b ON trl.book_id = b.id
-        ORDER BY trl.added_date DESC
-        ''')
-        
-        books = cursor.fetchall()
-        return books
+        INSERT INTO book_log (owner_id, book_id, event_type, notes, list_item_id)
+        VALUES (?, ?, 'marked_as_read', ?, ?)
+        ''', (owner_id, book_id, notes, trl_id))
+        conn.commit()
+        notify_data_changed(('books', 'to_read_list', 'book_log'), [book_id], owner_id)
+        logger.info(f"Книга с ID {book_id} отмечена как прочитанная")
+        return book_id
     except sqlite3.Error as e:
-        logger.error(f"Ошибка при получении списка для чтения: {e}")
+        logger.error(f"Ошибка при отметке книги как прочитанной: {e}")
+        conn.rollback()
         raise
     finally:
-        conn.close()
+        release_conn(conn)
 
-def get_to_buy_list():
-    """Получает список книг для покупки"""
-    conn = get_conn()
+def change_priority(owner_id, trl_id, priority):
+    """Изменяет приоритет записи в списке для чтения и пишет событие в лог, возвращает старый приоритет"""
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
     
     try:
+        book_id, _, old_priority = _get_read_item(cursor, owner_id, trl_id)
+        cursor.execute('UPDATE to_read_list SET priority = ? WHERE id = ?', (priority, trl_id))
         cursor.execute('''
-        SELECT * FROM to_buy_list 
-        ORDER BY priority DESC, added_date DESC
-        ''')
+        INSERT INTO book_log (owner_id, book_id, event_type, notes, list_item_id)
+        VALUES (?, ?, 'priority_changed', ?, ?)
+        ''', (owner_id, book_id, f"Приоритет изменен с {old_priority} на {priority}", trl_id))
+        conn.commit()
+        notify_data_changed(('to_read_list', 'book_log'), owner_id=owner_id)
+        return old_priority
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при изменении приоритета: {e}")
+        conn.rollback()
+        raise
+    finally:
+        release_conn(conn)
+
+def remove_from_list(owner_id, list_name, item_id):
+    """Удаляет запись из списка ('read' - для чтения, 'buy' - для покупки) и пишет событие в лог"""
+    if list_name not in ('read', 'buy'):
+        raise ValueError(f"Неизвестный список: {list_name}")
+    
+    conn = get_conn(owner_id)
+    cursor = conn.cursor()
+    
+    try:
+        if list_name == 'read':
+            book_id, notes, _ = _get_read_item(cursor, owner_id, item_id)
+            cursor.execute('DELETE FROM to_read_list WHERE id = ?', (item_id,))
+            table, event_type = 'to_read_list', 'removed_from_read_list'
+        else:
+            book_id = None
+            authors, title, item_notes = _get_buy_item(cursor, owner_id, item_id)
+            notes = _buy_log_notes(title, authors, item_notes)
+            cursor.execute('DELETE FROM to_buy_list WHERE id = ?', (item_id,))
+            table, event_type = 'to_buy_list', 'removed_from_buy_list'
         
-        books = cursor.fetchall()
-        return books
+        cursor.execute('''
+        INSERT INTO book_log (owner_id, book_id, event_type, notes, list_item_id)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (owner_id, book_id, event_type, notes, item_id))
+        conn.commit()
+        notify_data_changed((table, 'book_log'), owner_id=owner_id)
+        logger.info(f"Запись {item_id} удалена из списка '{list_name}'")
     except sqlite3.Error as e:
-        logger.error(f"Ошибка при получении списка для покупки: {e}")
+        logger.error(f"Ошибка при удалении из списка '{list_name}': {e}")
+        conn.rollback()
         raise
     finally:
-        conn.close()
+        release_conn(conn)
 
-def log_book_event(book_id, event_type, notes=None):
-    """Добавляет событие в лог книги"""
-    conn = get_conn()
+def move_buy_to_library(owner_id, to_buy_id, authors, title, **book_fields):
+    """Переносит запись из списка для покупки в библиотеку.
+
+    Книга, ее событие 'added', событие 'moved_from_buy_to_library' и удаление
+    записи из списка покупок - одна транзакция. book_fields - остальные
+    аргументы add_book. Возвращает ID новой книги.
+    """
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
     
     try:
+        buy_authors, buy_title, buy_notes = _get_buy_item(cursor, owner_id, to_buy_id)
+        book_id = _insert_book(cursor, owner_id, authors, title, **book_fields)
         cursor.execute('''
-        INSERT INTO book_log (book_id, event_type, notes)
-        VALUES (?, ?, ?)
-        ''', (book_id, event_type, notes))
-        
+        INSERT INTO book_log (owner_id, book_id, event_type, notes, list_item_id)
+        VALUES (?, ?, 'moved_from_buy_to_library', ?, ?)
+        ''', (owner_id, book_id, _buy_log_notes(buy_title, buy_authors, buy_notes), to_buy_id))
+        cursor.execute('DELETE FROM to_buy_list WHERE id = ?', (to_buy_id,))
         conn.commit()
-        logger.info(f"Событие '{event_type}' добавлено для книги ID {book_id}")
-        
+        notify_data_changed(('books', 'to_buy_list', 'book_log'), [book_id], owner_id)
+        logger.info(f"Запись {to_buy_id} из списка для покупки перенесена в библиотеку, ID книги: {book_id}")
+        return book_id
     except sqlite3.Error as e:
-        logger.error(f"Ошибка при добавлении события в лог: {e}")
+        logger.error(f"Ошибка при переносе книги из списка для покупки: {e}")
         conn.rollback()
         raise
     finally:
-        conn.close()
+        release_conn(conn)
 
-def get_book_log(book_id):
-    """Получает историю событий для книги"""
-    conn = get_conn()
+def _keyset_page(cursor, select_sql, order, after=None, before=None, limit=PAGE_SIZE,
+                 where=None, where_params=()):
+    """Читает одну страницу по ключу сортировки, не пропуская строки через OFFSET.
+
+    order - колонки ключа с направлением, например (('trl.priority', 'DESC'), ('trl.id', 'ASC')).
+    after - ключ последней строки предыдущей страницы (листание вперед),
+    before - ключ первой строки следующей страницы (листание назад).
+    where - постоянное условие выборки (например, владелец) с параметрами where_params.
+    Возвращает (rows, has_prev, has_next).
+    """
+    backward = before is not None
+    key = before if backward else after
+    if backward:
+        order = [(column, 'ASC' if direction == 'DESC' else 'DESC') for column, direction in order]
+
+    conditions = [where] if where else []
+    params = list(where_params)
+    if key is not None:
+        # Строка идет после ключа, если равна ему по первым колонкам и "больше" по следующей;
+        # условие по первой колонке отдельно задает начало диапазона в индексе
+        first_column, first_direction = order[0]
+        conditions.append(f"{first_column} {'<=' if first_direction == 'DESC' else '>='} ?")
+        params.append(key[0])
+        branches = []
+        for i, (column, direction) in enumerate(order):
+            terms = [f"{prev_column} = ?" for prev_column, _ in order[:i]]
+            terms.append(f"{column} {'<' if direction == 'DESC' else '>'} ?")
+            branches.append(f"({' AND '.join(terms)})")
+            params.extend(key[:i + 1])
+        conditions.append(f"({' OR '.join(branches)})")
+    sql = select_sql
+    if conditions:
+        sql += f" WHERE {' AND '.join(conditions)}"
+    sql += f" ORDER BY {', '.join(f'{column} {direction}' for column, direction in order)} LIMIT ?"
+    params.append(limit + 1)
+
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        return rows[::-1], has_more, True
+    return rows, key is not None, has_more
+
+def get_to_read_page(owner_id, after=None, before=None, limit=PAGE_SIZE):
+    """Получает страницу списка для чтения владельца по ключу (priority, added_date, id).
+
+    Возвращает (rows, has_prev, has_next), ключ строки - (row[8], row[6], row[0]).
+    """
+    conn = get_conn(owner_id)
+    cursor = conn.cursor()
+    
+    try:
+        return _keyset_page(cursor, '''
+        SELECT trl.id, b.title, b.authors, b.series_name, b.series_number,
+               trl.notes, trl.added_date, b.id, trl.priority
+        FROM to_read_list trl
+        JOIN books b ON trl.book_id = b.id
+        ''', (('trl.priority', 'DESC'), ('trl.added_date', 'ASC'), ('trl.id', 'ASC')), after, before, limit,
+           'trl.owner_id = ?', (owner_id,))
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении списка для чтения: {e}")
+        raise
+    finally:
+        release_conn(conn)
+
+def get_to_buy_page(owner_id, after=None, before=None, limit=PAGE_SIZE):
+    """Получает страницу списка для покупки владельца по ключу (priority, added_date, id).
+
+    Возвращает (rows, has_prev, has_next), ключ строки - (row[4], row[5], row[0]).
+    """
+    conn = get_conn(owner_id)
+    cursor = conn.cursor()
+    
+    try:
+        return _keyset_page(cursor, '''
+        SELECT id, authors, title, notes, priority, added_date
+        FROM to_buy_list
+        ''', (('priority', 'DESC'), ('added_date', 'ASC'), ('id', 'ASC')), after, before, limit,
+           'owner_id = ?', (owner_id,))
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении списка для покупки: {e}")
+        raise
+    finally:
+        release_conn(conn)
+
+def get_book_log(owner_id, book_id):
+    """Получает историю событий для книги владельца"""
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
     
     try:
         cursor.execute('''
-        SELECT event_type, event_date, notes
+        SELECT event_type, event_date, notes, list_item_id
         FROM book_log
-        WHERE book_id = ?
+        -- "+" не дает планировщику взять индекс по владельцу: событий книги намного меньше
+        WHERE book_id = ? AND +owner_id = ?
         ORDER BY event_date DESC
-        ''', (book_id,))
+        ''', (book_id, owner_id))
         
         events = cursor.fetchall()
         return events
@@ -314,24 +2119,205 @@ def get_book_log(book_id):
         logger.error(f"Ошибка при получении лога книги: {e}")
         raise
     finally:
-        conn.close()
+        release_conn(conn)
 
-def get_library_summary():
-    """Получает статистику по библиотеке"""
-    conn = get_conn()
+def get_log_page(owner_id, after=None, before=None, limit=PAGE_SIZE):
+    """Получает страницу лога владельца вместе с данными книг, от новых событий к старым.
+
+    Ключ строки - (event_date, id) = (row[1], row[6]). Возвращает (rows, has_prev, has_next).
+    """
+    conn = get_conn(owner_id)
+    cursor = conn.cursor()
+    
+    try:
+        return _keyset_page(cursor, '''
+        SELECT bl.event_type, bl.event_date, bl.notes, b.title, b.authors, bl.list_item_id, bl.id
+        FROM book_log bl
+        LEFT JOIN books b ON bl.book_id = b.id
+        ''', (('bl.event_date', 'DESC'), ('bl.id', 'DESC')), after, before, limit,
+           'bl.owner_id = ?', (owner_id,))
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при получении последних событий лога: {e}")
+        raise
+    finally:
+        release_conn(conn)
+
+def init_library_stats(cursor):
+    """Создает таблицы счетчиков статистики по владельцам и триггеры, которые их обновляют"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'library_stats'")
+    stats_exist = cursor.fetchone() is not None
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS library_stats (
+        owner_id INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (owner_id, key)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS library_format_stats (
+        owner_id INTEGER NOT NULL,
+        format TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (owner_id, format)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS library_genre_stats (
+        owner_id INTEGER NOT NULL,
+        genre TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (owner_id, genre)
+    )
+    ''')
+    # События считаются по дням, чтобы сводка могла взять окно последних 30 дней
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS library_event_stats (
+        owner_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        event_type TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (owner_id, day, event_type)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_stats_ai AFTER INSERT ON books BEGIN
+        INSERT INTO library_stats (owner_id, key, value)
+            VALUES (new.owner_id, 'total_books', 1), (new.owner_id, 'read_books', COALESCE(new.is_read, 0))
+            ON CONFLICT (owner_id, key) DO UPDATE SET value = value + excluded.value;
+        INSERT INTO library_format_stats (owner_id, format, count) VALUES (new.owner_id, new.format, 1)
+            ON CONFLICT (owner_id, format) DO UPDATE SET count = count + 1;
+        INSERT INTO library_genre_stats (owner_id, genre, count)
+            SELECT new.owner_id, new.genre, 1 WHERE new.genre IS NOT NULL AND new.genre != ''
+            ON CONFLICT (owner_id, genre) DO UPDATE SET count = count + 1;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_stats_ad AFTER DELETE ON books BEGIN
+        UPDATE library_stats SET value = value - 1 WHERE owner_id = old.owner_id AND key = 'total_books';
+        UPDATE library_stats SET value = value - COALESCE(old.is_read, 0)
+            WHERE owner_id = old.owner_id AND key = 'read_books';
+        UPDATE library_format_stats SET count = count - 1 WHERE owner_id = old.owner_id AND format = old.format;
+        UPDATE library_genre_stats SET count = count - 1 WHERE owner_id = old.owner_id AND genre = old.genre;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS books_stats_au AFTER UPDATE OF is_read, format, genre ON books BEGIN
+        UPDATE library_stats SET value = value - COALESCE(old.is_read, 0) + COALESCE(new.is_read, 0)
+            WHERE owner_id = new.owner_id AND key = 'read_books';
+        UPDATE library_format_stats SET count = count - 1 WHERE owner_id = old.owner_id AND format = old.format;
+        INSERT INTO library_format_stats (owner_id, format, count) VALUES (new.owner_id, new.format, 1)
+            ON CONFLICT (owner_id, format) DO UPDATE SET count = count + 1;
+        UPDATE library_genre_stats SET count = count - 1 WHERE owner_id = old.owner_id AND genre = old.genre;
+        INSERT INTO library_genre_stats (owner_id, genre, count)
+            SELECT new.owner_id, new.genre, 1 WHERE new.genre IS NOT NULL AND new.genre != ''
+            ON CONFLICT (owner_id, genre) DO UPDATE SET count = count + 1;
+    END
+    ''')
+    for table, key in (('to_read_list', 'to_read_count'), ('to_buy_list', 'to_buy_count')):
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_stats_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO library_stats (owner_id, key, value) VALUES (new.owner_id, '{key}', 1)
+                ON CONFLICT (owner_id, key) DO UPDATE SET value = value + 1;
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_stats_ad AFTER DELETE ON {table} BEGIN
+            UPDATE library_stats SET value = value - 1 WHERE owner_id = old.owner_id AND key = '{key}';
+        END
+        ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS book_log_stats_ai AFTER INSERT ON book_log BEGIN
+        INSERT INTO library_event_stats (owner_id, day, event_type, count)
+            VALUES (new.owner_id, date(new.event_date), new.event_type, 1)
+            ON CONFLICT (owner_id, day, event_type) DO UPDATE SET count = count + 1;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS book_log_stats_ad AFTER DELETE ON book_log BEGIN
+        UPDATE library_event_stats SET count = count - 1
+            WHERE owner_id = old.owner_id AND day = date(old.event_date) AND event_type = old.event_type;
+    END
+    ''')
+
+    # Счетчики появились в уже заполненной базе - считаем их по существующим данным
+    if not stats_exist:
+        rebuild_library_stats(cursor=cursor)
+        logger.info("Счетчики статистики библиотеки построены")
+
+def rebuild_library_stats(owner_id=None, cursor=None):
+    """Пересчитывает счетчики статистики с нуля: для одного владельца или (owner_id=None) для всех"""
+    conn = None
+    if cursor is None:
+        conn = get_conn(owner_id)
+        cursor = conn.cursor()
+    
+    if owner_id is None:
+        where, params = '', ()
+    else:
+        where, params = 'WHERE owner_id = ?', (owner_id,)
+    
+    try:
+        for table in LIBRARY_STATS_TABLES:
+            cursor.execute(f'DELETE FROM {table} {where}', params)
+        
+        cursor.execute(f'''
+        INSERT INTO library_stats (owner_id, key, value)
+        SELECT owner_id, 'total_books', COUNT(*) FROM books {where} GROUP BY owner_id
+        UNION ALL SELECT owner_id, 'read_books', SUM(is_read = 1) FROM books {where} GROUP BY owner_id
+        UNION ALL SELECT owner_id, 'to_read_count', COUNT(*) FROM to_read_list {where} GROUP BY owner_id
+        UNION ALL SELECT owner_id, 'to_buy_count', COUNT(*) FROM to_buy_list {where} GROUP BY owner_id
+        ''', params * 4)
+        cursor.execute(f'''
+        INSERT INTO library_format_stats (owner_id, format, count)
+        SELECT owner_id, format, COUNT(*) FROM books {where} GROUP BY owner_id, format
+        ''', params)
+        cursor.execute(f'''
+        INSERT INTO library_genre_stats (owner_id, genre, count)
+        SELECT owner_id, genre, COUNT(*) FROM books
+        {where or 'WHERE 1'} AND genre IS NOT NULL AND genre != ''
+        GROUP BY owner_id, genre
+        ''', params)
+        cursor.execute(f'''
+        INSERT INTO library_event_stats (owner_id, day, event_type, count)
+        SELECT owner_id, date(event_date), event_type, COUNT(*) FROM book_log {where}
+        GROUP BY owner_id, date(event_date), event_type
+        ''', params)
+        
+        if conn is not None:
+            conn.commit()
+            notify_data_changed(LIBRARY_STATS_TABLES, owner_id=owner_id)
+            logger.info("Счетчики статистики библиотеки пересчитаны")
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при пересчете статистики библиотеки: {e}")
+        if conn is not None:
+            conn.rollback()
+        raise
+    finally:
+        if conn is not None:
+            release_conn(conn)
+
+# Таблицы, от которых зависит сводка: счетчики и таблицы, из которых их ведут триггеры
+LIBRARY_SUMMARY_TABLES = (
+    'books', 'to_read_list', 'to_buy_list', 'book_log',
+    'library_stats', 'library_format_stats', 'library_genre_stats', 'library_event_stats',
+)
+
+def get_library_summary(owner_id):
+    """Получает статистику по библиотеке владельца из счетчиков, которые поддерживают триггеры"""
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
     
     try:
         summary = {}
         
-        # Общее количество книг в библиотеке
-        cursor.execute('SELECT COUNT(*) FROM books')
-        total_books = cursor.fetchone()[0]
+        cursor.execute('SELECT key, value FROM library_stats WHERE owner_id = ?', (owner_id,))
+        counters = dict(cursor.fetchall())
+        total_books = counters.get('total_books', 0)
+        read_books = counters.get('read_books', 0)
         summary['total_books'] = total_books
-        
-        # Количество прочитанных книг
-        cursor.execute('SELECT COUNT(*) FROM books WHERE is_read = 1')
-        read_books = cursor.fetchone()[0]
         summary['read_books'] = read_books
         
         # Процент прочитанных
@@ -339,43 +2325,34 @@ def get_library_summary():
         
         # Статистика по форматам
         cursor.execute('''
-        SELECT format, COUNT(*) as count
-        FROM books
-        GROUP BY format
+        SELECT format, count FROM library_format_stats
+        WHERE owner_id = ? AND count > 0
         ORDER BY count DESC
-        ''')
-        formats = cursor.fetchall()
-        summary['formats'] = {format_type: count for format_type, count in formats}
+        ''', (owner_id,))
+        summary['formats'] = {format_type: count for format_type, count in cursor.fetchall()}
         
-        # Статистика по жанрам (исключая NULL значения)
+        # Статистика по жанрам
         cursor.execute('''
-        SELECT genre, COUNT(distinct id) as count
-        FROM books
-        WHERE genre IS NOT NULL AND genre != ''
-        GROUP BY genre
+        SELECT genre, count FROM library_genre_stats
+        WHERE owner_id = ? AND count > 0
         ORDER BY count DESC
-        ''')
-        genres = cursor.fetchall()
-        summary['genres'] = {genre: count for genre, count in genres}
-        
+        ''', (owner_id,))
+        summary['genres'] = {genre: count for genre, count in cursor.fetchall()}
         
         # Статистика по спискам
-        cursor.execute('SELECT COUNT(*) FROM to_read_list')
-        summary['to_read_count'] = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM to_buy_list')
-        summary['to_buy_count'] = cursor.fetchone()[0]
+        summary['to_read_count'] = counters.get('to_read_count', 0)
+        summary['to_buy_count'] = counters.get('to_buy_count', 0)
         
         # Статистика активности по логам (последние 30 дней)
         cursor.execute('''
-        SELECT event_type, COUNT(*) as count
-        FROM book_log
-        WHERE event_date >= datetime('now', '-30 days')
+        SELECT event_type, SUM(count) as count
+        FROM library_event_stats
+        WHERE owner_id = ? AND day >= date('now', '-30 days')
         GROUP BY event_type
+        HAVING SUM(count) > 0
         ORDER BY count DESC
-        ''')
-        recent_activity = cursor.fetchall()
-        summary['recent_activity'] = {event: count for event, count in recent_activity}
+        ''', (owner_id,))
+        summary['recent_activity'] = {event: count for event, count in cursor.fetchall()}
         
         logger.info("Статистика библиотеки успешно получена")
         return summary
@@ -384,7 +2361,7 @@ def get_library_summary():
         logger.error(f"Ошибка при получении статистики библиотеки: {e}")
         raise
     finally:
-        conn.close()
+        release_conn(conn)
 
 
 def format_library_summary(summary):
@@ -425,7 +2402,69 @@ def format_library_summary(summary):
     return "\n".join(formatted_text)
 
 
+def load_fsm_state(key):
+    """Читает состояние диалога: (state, data в JSON, updated_at) или None"""
+    conn = get_conn()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('SELECT state, data, updated_at FROM fsm_state WHERE key = ?', (key,))
+        return cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при чтении состояния диалога: {e}")
+        raise
+    finally:
+        release_conn(conn)
+
+def save_fsm_states(rows):
+    """Сохраняет пачку состояний диалогов одной транзакцией.
+
+    rows - кортежи (key, state, data в JSON, updated_at); пустые состояния
+    (без state и данных) удаляются.
+    """
+    conn = get_conn()
+    cursor = conn.cursor()
+    
+    try:
+        empty = [(key,) for key, state, data, _ in rows if state is None and data == '{}']
+        filled = [row for row in rows if not (row[1] is None and row[2] == '{}')]
+        if empty:
+            cursor.executemany('DELETE FROM fsm_state WHERE key = ?', empty)
+        if filled:
+            cursor.executemany('''
+            INSERT INTO fsm_state (key, state, data, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            ''', filled)
+        conn.commit()
+        notify_data_changed(('fsm_state',))
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при сохранении состояний диалогов: {e}")
+        conn.rollback()
+        raise
+    finally:
+        release_conn(conn)
+
+def delete_expired_fsm_states(before):
+    """Удаляет состояния диалогов, не менявшиеся с момента before (unix time), возвращает их число"""
+    conn = get_conn()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('DELETE FROM fsm_state WHERE updated_at < ?', (before,))
+        conn.commit()
+        notify_data_changed(('fsm_state',))
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при удалении устаревших состояний диалогов: {e}")
+        conn.rollback()
+        raise
+    finally:
+        release_conn(conn)
+
+
 
 if __name__ == "__main__":
     init_db()
-    print("База данных инициализирована успешно!")
\ No newline at end of file
+    print("База данных инициализирована успешно!")
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, Mapping, Optional
+from dotenv import load_dotenv
+import logging
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+import db
+import repo
+
+load_dotenv()
+FSM_STATE_TTL = float(os.getenv('FSM_STATE_TTL', '86400'))
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '1.0'))
+FSM_BATCH_SIZE = int(os.getenv('FSM_BATCH_SIZE', '100'))
+FSM_SWEEP_INTERVAL = float(os.getenv('FSM_SWEEP_INTERVAL', '3600'))
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний диалогов (FSM) в таблице fsm_state основной базы.
+
+    Чтение и запись идут через память: изменения копятся и пишутся в базу
+    пачкой раз в flush_interval секунд (или сразу, когда набралось
+    batch_size измененных диалогов), так что шаги /addmanual не ждут диска.
+    Диалог, не менявшийся ttl секунд, считается брошенным: он читается как
+    пустой и удаляется из базы при периодической чистке.
+
+    Память каждого процесса - только кэш, источник правды - таблица.
+    Несколько процессов могут делить одну базу, если все обновления
+    одного чата приходят в один и тот же процесс.
+    """
+
+    def __init__(self, ttl=FSM_STATE_TTL, flush_interval=FSM_FLUSH_INTERVAL,
+                 batch_size=FSM_BATCH_SIZE, sweep_interval=FSM_SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.sweep_interval = sweep_interval
+        self.key_builder = DefaultKeyBuilder(prefix='fsm', with_bot_id=True, with_destiny=True)
+        # ключ -> [state, data, updated_at]
+        self._records: Dict[str, list] = {}
+        self._dirty = set()
+        self._wake = asyncio.Event()
+        self._task = None
+        self._closing = False
+        self._stats = {'loads': 0, 'flushes': 0, 'rows_written': 0, 'expired': 0, 'flush_errors': 0}
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = await self._record(key)
+        record[1] = data.copy()
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(key))[1].copy()
+
+    async def close(self) -> None:
+        """Дописывает все изменения в базу (вызывается диспетчером при остановке)"""
+        self._closing = True
+        if self._task is not None:
+            self._wake.set()
+            await self._task
+            self._task = None
+        else:
+            await self._flush()
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats['cached'] = len(self._records)
+        stats['dirty'] = len(self._dirty)
+        return stats
+
+    async def _record(self, key: StorageKey):
+        storage_key = self.key_builder.build(key)
+        record = self._records.get(storage_key)
+        if record is not None and not self._expired(record):
+            return record
+
+        row = None
+        if record is None:
+            row = await repo.run(db.load_fsm_state, storage_key)
+            self._stats['loads'] += 1
+        if row is not None and not self._expired(row[2:]):
+            state, data, updated_at = row
+            loaded = [state, json.loads(data), updated_at]
+        else:
+            loaded = [None, {}, time.time()]
+
+        # Пока шло чтение, другое обновление этого чата могло уже создать запись
+        current = self._records.get(storage_key)
+        if current is not None and current is not record:
+            return current
+        self._records[storage_key] = loaded
+        return loaded
+
+    def _expired(self, record):
+        return self.ttl > 0 and record[-1] < time.time() - self.ttl
+
+    def _touch(self, key: StorageKey, record):
+        record[2] = time.time()
+        self._dirty.add(self.key_builder.build(key))
+        if self._task is None and not self._closing:
+            self._task = asyncio.create_task(self._run(), name='fsm_storage')
+        if len(self._dirty) >= self.batch_size:
+            self._wake.set()
+
+    async def _run(self):
+        next_sweep = time.monotonic() + self.sweep_interval
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self._flush()
+            if time.monotonic() >= next_sweep:
+                next_sweep = time.monotonic() + self.sweep_interval
+                await self._sweep()
+        # Остановка: изменения, пришедшие за время последней записи
+        await self._flush()
+
+    async def _flush(self):
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        rows = []
+        for key in keys:
+            state, data, updated_at = self._records[key]
+            try:
+                rows.append((key, state, json.dumps(data, ensure_ascii=False), updated_at))
+            except (TypeError, ValueError) as e:
+                logger.error(f"Состояние диалога {key} не сохранено: данные не сериализуются в JSON ({e})")
+
+        try:
+            await repo.write(db.save_fsm_states, rows)
+        except Exception as e:
+            # Не теряем изменения: попробуем записать их в следующий раз
+            self._dirty.update(keys)
+            self._stats['flush_errors'] += 1
+            logger.error(f"Не удалось сохранить {len(rows)} состояний диалогов: {e}")
+            return
+        self._stats['flushes'] += 1
+        self._stats['rows_written'] += len(rows)
+
+    async def _sweep(self):
+        """Удаляет брошенные диалоги из памяти и из базы"""
+        if self.ttl <= 0:
+            return
+        before = time.time() - self.ttl
+        for key in [key for key, record in self._records.items() if record[2] < before and key not in self._dirty]:
+            del self._records[key]
+        try:
+            deleted = await repo.write(db.delete_expired_fsm_states, before)
+        except Exception as e:
+            logger.error(f"Не удалось удалить устаревшие состояния диалогов: {e}")
+            return
+        self._stats['expired'] += deleted
+        if deleted:
+            logger.info(f"Удалено брошенных диалогов: {deleted}")
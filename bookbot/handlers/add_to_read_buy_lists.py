@@ -2,77 +2,37 @@ from aiogram import Dispatcher, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-import sqlite3
 from aiogram.fsm.state import State, StatesGroup
 from datetime import datetime
-
-async def log_book_event(book_id: int, event_type: str, notes: str = None, list_item_id: int = None):
-    """
-    Логирует событие с книгой в таблицу book_log
-    
-    Args:
-        book_id: ID книги (может быть None для событий с to_buy_list)
-        event_type: Тип события из разрешенного списка
-        notes: Дополнительные заметки
-        list_item_id: ID записи из списка (для связи с to_buy_list или to_read_list)
-    """
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        INSERT INTO book_log (book_id, event_type, notes, list_item_id)
-        VALUES (?, ?, ?, ?)
-    """, (book_id, event_type, notes, list_item_id))
-    
-    conn.commit()
-    conn.close()
-
-async def log_to_buy_event(event_type: str, book_id: int = None, list_item_id: int = None, 
-                          title: str = None, authors: str = None, notes: str = None):
-    """
-    Специальная функция для логирования событий to_buy_list
-    Для событий где книги еще нет в основной библиотеке
-    """
-
-    log_notes = []
-    if title:
-        log_notes.append(f"Название: {title}")
-    if authors:
-        log_notes.append(f"Автор: {authors}")
-    if notes:
-        log_notes.append(f"Заметки: {notes}")
-    
-    log_description = " | ".join(log_notes) if log_notes else None
-    
-    await log_book_event(book_id, event_type, log_description, list_item_id)
-
-
-
-async def get_book_logs(message: types.Message):
-    """Показывает последние записи из логов"""
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT 
-            bl.event_type,
-            bl.event_date,
-            bl.notes,
-            b.title,
-            b.authors,
-            bl.list_item_id
-        FROM book_log bl
-        LEFT JOIN books b ON bl.book_id = b.id
-        ORDER BY bl.event_date DESC
-        LIMIT 20
-    """)
-    rows = cursor.fetchall()
-    conn.close()
-    
-    if not rows:
-        await message.answer("📋 Логи пусты.")
-        return
-    
+import repo
+
+# Листание страниц: в callback_data кладется ключ крайней строки страницы,
+# "<" - страница перед ним, ">" - после него (формат: префикс:направление:ключ)
+
+def page_nav_row(prefix: str, rows, key, has_prev: bool, has_next: bool):
+    """Кнопки ◀/▶ для страницы или None, если листать некуда"""
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(
+            text="◀", callback_data=f"{prefix}:<:{'|'.join(map(str, key(rows[0])))}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(
+            text="▶", callback_data=f"{prefix}:>:{'|'.join(map(str, key(rows[-1])))}"))
+    return buttons or None
+
+def parse_page_callback(data: str, types_):
+    """Разбирает callback_data кнопки листания в (after, before)"""
+    _, direction, raw_key = data.split(":", 2)
+    key = tuple(cast(value) for cast, value in zip(types_, raw_key.split("|")))
+    return (None, key) if direction == "<" else (key, None)
+
+LOG_PAGE_KEY = (str, int)
+
+def log_page_key(row):
+    return row[1], row[6]
+
+def format_log_page(rows, has_prev, has_next):
+    """Текст и клавиатура страницы лога"""
     event_translations = {
         'added': '📚 Добавлена в библиотеку',
         'started_reading': '📖 Начато чтение',
@@ -90,7 +50,7 @@ async def get_book_logs(message: types.Message):
     
     text_parts = ["📋 <b>Последние действия:</b>\n"]
     
-    for event_type, event_date, notes, title, authors, list_item_id in rows:
+    for event_type, event_date, notes, title, authors, list_item_id, _ in rows:
         try:
             date_obj = datetime.fromisoformat(event_date.replace('Z', '+00:00'))
             formatted_date = date_obj.strftime("%d.%m.%Y %H:%M")
@@ -116,7 +76,35 @@ async def get_book_logs(message: types.Message):
     if text_parts and text_parts[-1] == "":
         text_parts.pop()
     
-    await message.answer("\n".join(text_parts), parse_mode="HTML")
+    nav_row = page_nav_row("logs_page", rows, log_page_key, has_prev, has_next)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[nav_row]) if nav_row else None
+    return "\n".join(text_parts), keyboard
+
+async def get_book_logs(message: types.Message):
+    """Показывает последние записи из логов"""
+    rows, has_prev, has_next = await repo.get_log_page(message.from_user.id)
+    
+    if not rows:
+        await message.answer("📋 Логи пусты.")
+        return
+    
+    text, keyboard = format_log_page(rows, has_prev, has_next)
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+async def logs_page(callback: types.CallbackQuery):
+    """Листание /logs: перерисовывает то же сообщение"""
+    await callback.answer()
+    after, before = parse_page_callback(callback.data, LOG_PAGE_KEY)
+    rows, has_prev, has_next = await repo.get_log_page(callback.from_user.id, after, before)
+    
+    if not rows:
+        rows, has_prev, has_next = await repo.get_log_page(callback.from_user.id)
+    if not rows:
+        await callback.message.edit_text("📋 Логи пусты.")
+        return
+    
+    text, keyboard = format_log_page(rows, has_prev, has_next)
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
 
 async def get_book_specific_log(message: types.Message):
     """Показывает логи для конкретной книги"""
@@ -126,27 +114,15 @@ async def get_book_specific_log(message: types.Message):
         await message.answer("❌ Укажите ID книги. Пример: /booklog 123")
         return
     
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT title, authors FROM books WHERE id = ?", (book_id,))
-    book_info = cursor.fetchone()
+    book_info = await repo.get_book(message.from_user.id, book_id)
     
     if not book_info:
-        conn.close()
         await message.answer("❌ Книга с таким ID не найдена.")
         return
     
-    title, authors = book_info
+    title, authors = book_info[1], book_info[2]
     
-    cursor.execute("""
-        SELECT event_type, event_date, notes, list_item_id
-        FROM book_log
-        WHERE book_id = ?
-        ORDER BY event_date DESC
-    """, (book_id,))
-    rows = cursor.fetchall()
-    conn.close()
+    rows = await repo.get_book_log(message.from_user.id, book_id)
     
     if not rows:
         await message.answer(f"📋 Логи для книги <b>{title}</b> отсутствуют.", parse_mode="HTML")
@@ -207,28 +183,17 @@ class ActionStates(StatesGroup):
 
 # ============ TO-BUY-LIST ============
 
-async def get_to_buy_list(message: types.Message):
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT id, authors, title, notes, priority, added_date
-        FROM to_buy_list
-        ORDER BY priority DESC, added_date ASC
-    """)
-    rows = cursor.fetchall()
-    conn.close()
-    
-    if not rows:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="➕ Добавить книгу", callback_data="add_to_buy")]
-        ])
-        await message.answer(
-            "📚 Список покупок пуст. Хотите что-то добавить?",
-            reply_markup=keyboard
-        )
-        return
-    
+TO_BUY_PAGE_KEY = (int, str, int)
+EMPTY_TO_BUY_TEXT = "📚 Список покупок пуст. Хотите что-то добавить?"
+EMPTY_TO_BUY_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="➕ Добавить книгу", callback_data="add_to_buy")]
+])
+
+def to_buy_page_key(row):
+    return row[4], row[5], row[0]
+
+def format_to_buy_page(rows, has_prev, has_next):
+    """Текст и клавиатура страницы списка покупок"""
     priority_names = {5: "🔥 Очень высокий", 4: "⭐ Высокий", 3: "📖 Средний", 2: "📋 Низкий", 1: "💤 Очень низкий"}
     grouped = {}
     for row in rows:
@@ -253,13 +218,41 @@ async def get_to_buy_list(message: types.Message):
                 
                 text_parts.append(f"• {' | '.join(book_info)} (ID: {book_id})")
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+    inline_keyboard = [
         [InlineKeyboardButton(text="📖→📚 Перенести в библиотеку", callback_data="move_to_lib_action")],
         [InlineKeyboardButton(text="🗑 Удалить книгу", callback_data="delete_buy_action")],
         [InlineKeyboardButton(text="➕ Добавить книгу", callback_data="add_to_buy")]
-    ])
+    ]
+    nav_row = page_nav_row("tbr_page", rows, to_buy_page_key, has_prev, has_next)
+    if nav_row:
+        inline_keyboard.insert(0, nav_row)
+    
+    return "\n".join(text_parts), InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
+
+async def get_to_buy_list(message: types.Message):
+    rows, has_prev, has_next = await repo.get_to_buy_page(message.from_user.id)
+    
+    if not rows:
+        await message.answer(EMPTY_TO_BUY_TEXT, reply_markup=EMPTY_TO_BUY_KEYBOARD)
+        return
+    
+    text, keyboard = format_to_buy_page(rows, has_prev, has_next)
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+async def to_buy_page(callback: types.CallbackQuery):
+    """Листание /gettbr: перерисовывает то же сообщение"""
+    await callback.answer()
+    after, before = parse_page_callback(callback.data, TO_BUY_PAGE_KEY)
+    rows, has_prev, has_next = await repo.get_to_buy_page(callback.from_user.id, after, before)
+    
+    if not rows:
+        rows, has_prev, has_next = await repo.get_to_buy_page(callback.from_user.id)
+    if not rows:
+        await callback.message.edit_text(EMPTY_TO_BUY_TEXT, reply_markup=EMPTY_TO_BUY_KEYBOARD)
+        return
     
-    await message.answer("\n".join(text_parts), parse_mode="HTML", reply_markup=keyboard)
+    text, keyboard = format_to_buy_page(rows, has_prev, has_next)
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
 
 async def add_to_buy_start(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
@@ -319,19 +312,8 @@ async def add_to_buy_priority(callback: types.CallbackQuery, state: FSMContext):
     title = data.get("title")
     notes = data.get("notes")
     
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        INSERT INTO to_buy_list (authors, title, notes, priority)
-        VALUES (?, ?, ?, ?)
-    """, (authors, title, notes, priority))
-    
-    list_item_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    list_item_id = await repo.add_to_buy_list(callback.from_user.id, authors, title, notes, priority)
     
-    await log_to_buy_event('added_to_buy_list', None, list_item_id, title, authors, notes)
     
     book_info = []
     if title:
@@ -363,11 +345,7 @@ async def process_buy_move_id(message: types.Message, state: FSMContext):
         await message.answer("Некорректный ID. Введите число:")
         return
     
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT authors, title, notes FROM to_buy_list WHERE id = ?", (book_id,))
-    book_info = cursor.fetchone()
-    conn.close()
+    book_info = await repo.get_to_buy_item(message.from_user.id, book_id)
     
     if not book_info:
         await message.answer("Книга с таким ID не найдена. Введите корректный ID:")
@@ -375,8 +353,6 @@ async def process_buy_move_id(message: types.Message, state: FSMContext):
     
     authors, title, notes = book_info
     
-    await log_to_buy_event('moved_from_buy_to_library', None, book_id, title, authors, notes)
-    
     await state.update_data(
         from_to_buy=True,
         to_buy_id=book_id,
@@ -399,23 +375,19 @@ async def process_buy_delete_id(message: types.Message, state: FSMContext):
         await message.answer("Некорректный ID. Введите число:")
         return
     
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT authors, title, notes FROM to_buy_list WHERE id = ?", (book_id,))
-    book_info = cursor.fetchone()
+    book_info = await repo.get_to_buy_item(message.from_user.id, book_id)
     
     if not book_info:
-        conn.close()
         await message.answer("Книга с таким ID не найдена. Введите корректный ID:")
         return
     
     authors, title, notes = book_info
     
-    await log_to_buy_event('removed_from_buy_list', None, book_id, title, authors, notes)
-    
-    cursor.execute("DELETE FROM to_buy_list WHERE id = ?", (book_id,))
-    conn.commit()
-    conn.close()
+    try:
+        await repo.remove_from_list(message.from_user.id, 'buy', book_id)
+    except ValueError:
+        await message.answer("Книга с таким ID не найдена. Введите корректный ID:")
+        return
     
     book_display = []
     if title:
@@ -446,31 +418,19 @@ async def process_read_mark_id(message: types.Message, state: FSMContext):
         await message.answer("Некорректный ID. Введите число:")
         return
     
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT b.id, b.title, b.authors, trl.notes FROM to_read_list trl
-        JOIN books b ON trl.book_id = b.id
-        WHERE trl.id = ?
-    """, (trl_id,))
-    book_info = cursor.fetchone()
+    book_info = await repo.get_to_read_item(message.from_user.id, trl_id)
     
     if not book_info:
-        conn.close()
         await message.answer("Книга с таким ID не найдена. Введите корректный ID:")
         return
     
-    book_id, title, authors, read_notes = book_info
-    
-    cursor.execute("UPDATE books SET is_read = 1 WHERE id = ?", (book_id,))
+    _, title, authors, _, _ = book_info
     
-    cursor.execute("DELETE FROM to_read_list WHERE id = ?", (trl_id,))
-    
-    conn.commit()
-    conn.close()
-    
-    await log_book_event(book_id, 'marked_as_read', read_notes, trl_id)
+    try:
+        await repo.mark_read(message.from_user.id, trl_id)
+    except ValueError:
+        await message.answer("Книга с таким ID не найдена. Введите корректный ID:")
+        return
     
     book_display = [f"<b>{title}</b>"]
     if authors:
@@ -489,28 +449,19 @@ async def process_read_delete_id(message: types.Message, state: FSMContext):
         await message.answer("Некорректный ID. Введите число:")
         return
     
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT b.id, b.title, b.authors, trl.notes FROM to_read_list trl
-        JOIN books b ON trl.book_id = b.id
-        WHERE trl.id = ?
-    """, (trl_id,))
-    book_info = cursor.fetchone()
+    book_info = await repo.get_to_read_item(message.from_user.id, trl_id)
     
     if not book_info:
-        conn.close()
         await message.answer("Книга с таким ID не найдена. Введите корректный ID:")
         return
     
-    book_id, title, authors, read_notes = book_info
+    _, title, authors, _, _ = book_info
     
-    await log_book_event(book_id, 'removed_from_read_list', read_notes, trl_id)
-    
-    cursor.execute("DELETE FROM to_read_list WHERE id = ?", (trl_id,))
-    conn.commit()
-    conn.close()
+    try:
+        await repo.remove_from_list(message.from_user.id, 'read', trl_id)
+    except ValueError:
+        await message.answer("Книга с таким ID не найдена. Введите корректный ID:")
+        return
     
     book_display = [f"<b>{title}</b>"]
     if authors:
@@ -524,30 +475,17 @@ async def process_read_delete_id(message: types.Message, state: FSMContext):
 
 # ============ TO-READ-LIST ============
 
-async def get_to_read_list(message: types.Message):
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT trl.id, b.title, b.authors, b.series_name, b.series_number, 
-               trl.notes, trl.added_date, b.id, trl.priority
-        FROM to_read_list trl
-        JOIN books b ON trl.book_id = b.id
-        ORDER BY trl.priority DESC, trl.added_date ASC
-    """)
-    rows = cursor.fetchall()
-    conn.close()
-    
-    if not rows:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="➕ Добавить книгу", callback_data="add_to_read")]
-        ])
-        await message.answer(
-            "📖 Список для чтения пуст. Хотите что-то добавить?",
-            reply_markup=keyboard
-        )
-        return
-    
+TO_READ_PAGE_KEY = (int, str, int)
+EMPTY_TO_READ_TEXT = "📖 Список для чтения пуст. Хотите что-то добавить?"
+EMPTY_TO_READ_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="➕ Добавить книгу", callback_data="add_to_read")]
+])
+
+def to_read_page_key(row):
+    return row[8], row[6], row[0]
+
+def format_to_read_page(rows, has_prev, has_next):
+    """Текст и клавиатура страницы списка для чтения"""
     priority_names = {5: "🔥 Очень высокий", 4: "⭐ Высокий", 3: "📖 Средний", 2: "📋 Низкий", 1: "💤 Очень низкий"}
     grouped = {}
     
@@ -583,14 +521,42 @@ async def get_to_read_list(message: types.Message):
                 
                 text_parts.append(f"• {' | '.join(book_info)} (ID: {trl_id})")
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+    inline_keyboard = [
         [InlineKeyboardButton(text="⏫ Изменить приоритет", callback_data="change_read_priority_action")],
         [InlineKeyboardButton(text="✅ Отметить как прочитанную", callback_data="mark_read_action")],
         [InlineKeyboardButton(text="🗑 Удалить из списка", callback_data="delete_read_action")],
         [InlineKeyboardButton(text="➕ Добавить книгу", callback_data="add_to_read")]
-    ])
+    ]
+    nav_row = page_nav_row("trl_page", rows, to_read_page_key, has_prev, has_next)
+    if nav_row:
+        inline_keyboard.insert(0, nav_row)
     
-    await message.answer("\n".join(text_parts), parse_mode="HTML", reply_markup=keyboard)
+    return "\n".join(text_parts), InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
+
+async def get_to_read_list(message: types.Message):
+    rows, has_prev, has_next = await repo.get_to_read_page(message.from_user.id)
+    
+    if not rows:
+        await message.answer(EMPTY_TO_READ_TEXT, reply_markup=EMPTY_TO_READ_KEYBOARD)
+        return
+    
+    text, keyboard = format_to_read_page(rows, has_prev, has_next)
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+async def to_read_page(callback: types.CallbackQuery):
+    """Листание /gettrl: перерисовывает то же сообщение"""
+    await callback.answer()
+    after, before = parse_page_callback(callback.data, TO_READ_PAGE_KEY)
+    rows, has_prev, has_next = await repo.get_to_read_page(callback.from_user.id, after, before)
+    
+    if not rows:
+        rows, has_prev, has_next = await repo.get_to_read_page(callback.from_user.id)
+    if not rows:
+        await callback.message.edit_text(EMPTY_TO_READ_TEXT, reply_markup=EMPTY_TO_READ_KEYBOARD)
+        return
+    
+    text, keyboard = format_to_read_page(rows, has_prev, has_next)
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
 
 async def change_read_priority_action(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
@@ -604,22 +570,13 @@ async def process_read_priority_id(message: types.Message, state: FSMContext):
         await message.answer("Некорректный ID. Введите число:")
         return
     
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT b.title, b.authors, trl.priority FROM to_read_list trl
-        JOIN books b ON trl.book_id = b.id
-        WHERE trl.id = ?
-    """, (trl_id,))
-    book_info = cursor.fetchone()
-    conn.close()
+    book_info = await repo.get_to_read_item(message.from_user.id, trl_id)
     
     if not book_info:
         await message.answer("Книга с таким ID не найдена. Введите корректный ID:")
         return
     
-    title, authors, current_priority = book_info
+    _, title, authors, _, current_priority = book_info
     book_display = [f"<b>{title}</b>"]
     if authors:
         book_display.append(f"Автор: {authors}")
@@ -653,31 +610,23 @@ async def process_new_priority(callback: types.CallbackQuery, state: FSMContext)
     data = await state.get_data()
     trl_id = data.get("trl_id")
     
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT b.id, b.title, b.authors, trl.priority FROM to_read_list trl
-        JOIN books b ON trl.book_id = b.id
-        WHERE trl.id = ?
-    """, (trl_id,))
-    book_info = cursor.fetchone()
+    book_info = await repo.get_to_read_item(callback.from_user.id, trl_id)
     
     if not book_info:
-        conn.close()
         await callback.message.edit_text("❌ Книга не найдена.")
         await state.clear()
         return
     
-    book_id, title, authors, old_priority = book_info
+    _, title, authors, _, _ = book_info
     
-    cursor.execute("UPDATE to_read_list SET priority = ? WHERE id = ?", (new_priority, trl_id))
-    conn.commit()
-    conn.close()
+    try:
+        await repo.change_priority(callback.from_user.id, trl_id, new_priority)
+    except ValueError:
+        await callback.message.edit_text("❌ Книга не найдена.")
+        await state.clear()
+        return
     
     priority_names = {5: "🔥 Очень высокий", 4: "⭐ Высокий", 3: "📖 Средний", 2: "📋 Низкий", 1: "💤 Очень низкий"}
-    log_note = f"Приоритет изменен с {old_priority} на {new_priority}"
-    await log_book_event(book_id, 'priority_changed', log_note, trl_id)
     
     book_display = [f"<b>{title}</b>"]
     if authors:
@@ -701,37 +650,12 @@ async def search_for_to_read(message: types.Message, state: FSMContext):
         await message.answer("Пустой запрос. Введите снова:")
         return
 
-    words = query.lower().split()
-    if not words:
-        await message.answer("Пустой запрос. Введите снова:")
-        return
-
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT b.id, b.title, b.authors, b.pages, b.series_name, b.series_number
-        FROM books b
-        LEFT JOIN to_read_list trl ON b.id = trl.book_id
-        WHERE trl.book_id IS NULL
-    """)
-    rows = cursor.fetchall()
-
-    filtered = []
-    for row in rows:
-        id, title, authors, pages, series_name, series_number = row
-        searchable_text = " ".join([
-            title or "",
-            authors or "",
-            series_name or ""
-        ]).lower()
-
-        if all(word in searchable_text for word in words):
-            filtered.append(row)
-            if len(filtered) >= 10:
-                break
-
-    conn.close()
+    filtered = await repo.find_books(message.from_user.id, query, limit=10, exclude_to_read=True)
+    text_parts = ["Выберите книгу (отправьте ID):"]
+    if not filtered:
+        # Точных совпадений нет - пробуем найти с учетом опечаток
+        filtered = await repo.fuzzy_find_books(message.from_user.id, query, limit=10, exclude_to_read=True)
+        text_parts.insert(0, "Точных совпадений нет. Возможно, вы искали:")
 
     if not filtered:
         await message.answer("Ничего не найдено или все найденные книги уже в списке для чтения 😢")
@@ -741,7 +665,6 @@ async def search_for_to_read(message: types.Message, state: FSMContext):
     await state.update_data(search_results=filtered)
     await state.set_state(ToReadStates.waiting_book_selection)
     
-    text_parts = ["Выберите книгу (отправьте ID):"]
     for book_id, title, authors, pages, series_name, series_number in filtered:
         book_info = [f"<b>{title}</b>"]
         if authors:
@@ -804,25 +727,17 @@ async def add_to_read_priority(callback: types.CallbackQuery, state: FSMContext)
     book_id = data.get("selected_book_id")
     notes = data.get("notes")
     
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
     # Получаем информацию о книге для подтверждения
-    cursor.execute("SELECT title, authors FROM books WHERE id = ?", (book_id,))
-    book_info = cursor.fetchone()
-    
-    cursor.execute("""
-        INSERT INTO to_read_list (book_id, notes, priority)
-        VALUES (?, ?, ?)
-    """, (book_id, notes, priority))
+    book_info = await repo.get_book(callback.from_user.id, book_id)
     
-    list_item_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    await log_book_event(book_id, 'added_to_read_list', notes, list_item_id)
+    try:
+        await repo.add_to_read_list(callback.from_user.id, book_id, notes, priority)
+    except ValueError as e:
+        await callback.message.answer(f"❌ {e}")
+        await state.clear()
+        return
     
-    title, authors = book_info
+    title, authors = book_info[1], book_info[2]
     book_display = [f"<b>{title}</b>"]
     if authors:
         book_display.append(f"Автор: {authors}")
@@ -850,15 +765,10 @@ async def move_to_library(callback: types.CallbackQuery, state: FSMContext):
     
     book_id = int(callback.data.split("_")[-1])
     
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
     # Получаем информацию о книге
-    cursor.execute("SELECT authors, title, notes FROM to_buy_list WHERE id = ?", (book_id,))
-    book_info = cursor.fetchone()
+    book_info = await repo.get_to_buy_item(callback.from_user.id, book_id)
     
     if not book_info:
-        conn.close()
         await callback.message.edit_text("❌ Книга не найдена.")
         return
     
@@ -872,8 +782,6 @@ async def move_to_library(callback: types.CallbackQuery, state: FSMContext):
         prefilled_notes=notes
     )
     
-    conn.close()
-    
     try:
         # Импортируем функцию добавления книги
         from .addmanual import addmanual_start  
@@ -888,29 +796,19 @@ async def mark_as_read(callback: types.CallbackQuery, state: FSMContext):
     
     trl_id = int(callback.data.split("_")[-1])
     
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT b.id, b.title, b.authors FROM to_read_list trl
-        JOIN books b ON trl.book_id = b.id
-        WHERE trl.id = ?
-    """, (trl_id,))
-    book_info = cursor.fetchone()
+    book_info = await repo.get_to_read_item(callback.from_user.id, trl_id)
     
     if not book_info:
-        conn.close()
         await callback.message.edit_text("❌ Книга не найдена.")
         return
     
-    book_id, title, authors = book_info
+    _, title, authors, _, _ = book_info
     
-    cursor.execute("UPDATE books SET is_read = 1 WHERE id = ?", (book_id,))
-    
-    cursor.execute("DELETE FROM to_read_list WHERE id = ?", (trl_id,))
-    
-    conn.commit()
-    conn.close()
+    try:
+        await repo.mark_read(callback.from_user.id, trl_id)
+    except ValueError:
+        await callback.message.edit_text("❌ Книга не найдена.")
+        return
     
     book_display = [f"<b>{title}</b>"]
     if authors:
@@ -929,26 +827,19 @@ async def confirm_delete_read(callback: types.CallbackQuery, state: FSMContext):
     # Получаем ID записи из callback_data (формат: confirm_delete_read_{trl_id})
     trl_id = int(callback.data.split("_")[-1])
     
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT b.title, b.authors FROM to_read_list trl
-        JOIN books b ON trl.book_id = b.id
-        WHERE trl.id = ?
-    """, (trl_id,))
-    book_info = cursor.fetchone()
+    book_info = await repo.get_to_read_item(callback.from_user.id, trl_id)
     
     if not book_info:
-        conn.close()
         await callback.message.edit_text("❌ Книга не найдена.")
         return
     
-    title, authors = book_info
+    _, title, authors, _, _ = book_info
     
-    cursor.execute("DELETE FROM to_read_list WHERE id = ?", (trl_id,))
-    conn.commit()
-    conn.close()
+    try:
+        await repo.remove_from_list(callback.from_user.id, 'read', trl_id)
+    except ValueError:
+        await callback.message.edit_text("❌ Книга не найдена.")
+        return
     
     book_display = [f"<b>{title}</b>"]
     if authors:
@@ -965,6 +856,11 @@ def register_handlers(dp: Dispatcher):
     dp.message.register(get_to_buy_list, Command("gettbr"))
     dp.message.register(get_to_read_list, Command("gettrl"))
     
+    # Листание страниц списков и лога
+    dp.callback_query.register(to_buy_page, F.data.startswith("tbr_page:"))
+    dp.callback_query.register(to_read_page, F.data.startswith("trl_page:"))
+    dp.callback_query.register(logs_page, F.data.startswith("logs_page:"))
+    
     # Callback'и для кнопок добавления
     dp.callback_query.register(add_to_buy_start, F.data == "add_to_buy")
     dp.callback_query.register(add_to_read_start, F.data == "add_to_read")
@@ -3,19 +3,14 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
-import sqlite3
-import os
-from dotenv import load_dotenv
 import logging
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 
 
 from .keyboards import format_keyboard, source_keyboard, yes_no_keyboard
-from db import add_book
+import repo
 
 
-load_dotenv()
-DB_FILE = os.getenv('DB_PATH', '/app/data/library.db')
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -100,7 +95,17 @@ async def addmanual_pages(message: types.Message, state: FSMContext):
         return
     await state.update_data(pages=int(message.text))
     await state.set_state(AddBookManualStates.waiting_publisher)
-    await message.answer("Введите издателя (можно оставить пустым):")
+
+    publishers = await repo.get_publishers(message.from_user.id, 10)
+    if publishers:
+        kb = ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text=publisher)] for publisher in publishers],
+            resize_keyboard=True,
+            one_time_keyboard=True
+        )
+        await message.answer("Выберите издателя из списка или введите вручную:", reply_markup=kb)
+    else:
+        await message.answer("Введите издателя (можно оставить пустым):")
 
 
 async def addmanual_char_count(message: types.Message, state: FSMContext):
@@ -122,18 +127,7 @@ async def addmanual_publisher(message: types.Message, state: FSMContext):
     await ask_genre(message, state)
 
 async def ask_genre(message: types.Message, state: FSMContext):
-    conn = get_conn()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT DISTINCT genre FROM books
-        WHERE genre IS NOT NULL AND genre != ''
-        ORDER BY genre COLLATE NOCASE
-        LIMIT 20
-    ''')
-    rows = cursor.fetchall()
-    conn.close()
-
-    genres = [row[0] for row in rows]
+    genres = await repo.get_genres(message.from_user.id, 20)
     buttons = [[KeyboardButton(text=genre)] for genre in genres]
     buttons.append([KeyboardButton(text="Ввести вручную")])
 
@@ -208,16 +202,6 @@ async def ask_is_series(message: types.Message, state: FSMContext):
     await message.answer("Относится ли книга к серии?", reply_markup=yes_no_keyboard)
 
 
-def get_conn():
-    """Создает подключение к базе данных с включенными внешними ключами"""
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        conn.execute("PRAGMA foreign_keys = ON")  
-        return conn
-    except sqlite3.Error as e:
-        logger.error(f"Ошибка подключения к базе данных: {e}")
-        raise
-
 async def is_series_chosen(message: types.Message, state: FSMContext):
     answer = message.text.lower()
     
@@ -228,17 +212,7 @@ async def is_series_chosen(message: types.Message, state: FSMContext):
         buttons = []
 
         if authors:
-            conn = get_conn()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT DISTINCT series_name
-                FROM books
-                WHERE authors = ? AND series_name IS NOT NULL AND series_name != ''
-            ''', (authors,))
-            rows = cursor.fetchall()
-            conn.close()
-
-            series_titles = [row[0] for row in rows]
+            series_titles = await repo.get_series_by_author(message.from_user.id, authors)
             buttons.extend([[KeyboardButton(text=title)] for title in series_titles])
 
         buttons.append([KeyboardButton(text="Ввести вручную")])
@@ -348,7 +322,7 @@ async def finish_adding_book(message_or_callback, state: FSMContext, url=""):
         data["url"] = url
 
     if data.get("format") == "digital":
-        book_id = add_book(
+        book_fields = dict(
             authors=data.get("authors"),
             title=data.get("title"),
             description=data.get("description", ""),
@@ -366,7 +340,7 @@ async def finish_adding_book(message_or_callback, state: FSMContext, url=""):
             is_read=data.get("is_read", False)
         )
     else:
-        book_id = add_book(
+        book_fields = dict(
             authors=data.get("authors"),
             title=data.get("title"),
             description=data.get("description", ""),
@@ -384,6 +358,16 @@ async def finish_adding_book(message_or_callback, state: FSMContext, url=""):
             is_read=data.get("is_read", False)
         )
 
+    owner_id = message_or_callback.from_user.id
+    if data.get("from_to_buy"):
+        # Книга из списка покупок: добавление, лог и удаление из списка одной транзакцией
+        try:
+            book_id = await repo.move_buy_to_library(owner_id, data.get("to_buy_id"), **book_fields)
+        except ValueError:
+            book_id = await repo.add_book(owner_id, **book_fields)
+    else:
+        book_id = await repo.add_book(owner_id, **book_fields)
+
     if isinstance(message_or_callback, types.Message):
         await message_or_callback.answer(f"✅ Книга добавлена вручную! ID {book_id}")
     elif isinstance(message_or_callback, types.CallbackQuery):
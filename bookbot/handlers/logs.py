@@ -1,30 +1,32 @@
 from aiogram import Dispatcher, types
 from aiogram.filters import Command
 import sqlite3
-from db import get_conn
+from db import get_conn, release_conn
+import repo
 import logging
 
 logger = logging.getLogger(__name__)
 
-def get_log_summary():
-    """Получает краткую и подробную статистику логов"""
-    conn = get_conn()
+def get_log_summary(owner_id):
+    """Получает краткую и подробную статистику логов владельца"""
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
 
     try:
         summary = {}
 
         # Общее количество событий
-        cursor.execute('SELECT COUNT(*) FROM book_log')
+        cursor.execute('SELECT COUNT(*) FROM book_log WHERE owner_id = ?', (owner_id,))
         summary['total_events'] = cursor.fetchone()[0]
 
         # Последние 5 событий
         cursor.execute('''
         SELECT id, book_id, event_type, event_date, notes, list_item_id
         FROM book_log
+        WHERE owner_id = ?
         ORDER BY event_date DESC
         LIMIT 5
-        ''')
+        ''', (owner_id,))
         recent_logs = cursor.fetchall()
         summary['recent_logs'] = [
             {
@@ -44,7 +46,7 @@ def get_log_summary():
         logger.error(f"Ошибка при получении логов: {e}")
         raise
     finally:
-        conn.close()
+        release_conn(conn)
 
 def format_log_summary(summary):
     """Форматирует информацию о логах для Telegram"""
@@ -70,7 +72,7 @@ def format_log_summary(summary):
     return "\n".join(formatted)
 
 async def cmd_log(message: types.Message):
-    summary = get_log_summary()
+    summary = await repo.run(get_log_summary, message.from_user.id)
     text = format_log_summary(summary)
     await message.answer(text, parse_mode="HTML")
 
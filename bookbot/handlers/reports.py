@@ -1,8 +1,12 @@
 from aiogram import Dispatcher, types, Bot
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 import sqlite3
-from db import get_conn
+from db import get_conn, release_conn
+import repo
+import result_cache
 import logging
+import json
+import re
 from datetime import datetime, timedelta
 import asyncio
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -14,111 +18,93 @@ logger = logging.getLogger(__name__)
 # Глобальные переменные для планировщика
 scheduler = None
 bot_instance = None
-user_id = None  # ID пользователя для отправки автоматических отчетов
+report_user_ids = set()  # ID пользователей, подписанных на автоматические отчеты
 
-def get_monthly_reading_report():
-    """Получает отчет о прочитанных книгах за текущий календарный месяц"""
-    conn = get_conn()
-    cursor = conn.cursor()
+# Какие события считаются прочтением и покупкой книги
+READING_EVENTS = ('finished_reading', 'marked_as_read')
+PURCHASE_EVENTS = ('moved_from_buy_to_library', 'added')
 
-    try:
-        # Начало текущего месяца
-        now = datetime.now()
-        month_start = datetime(now.year, now.month, 1, 0, 0, 0)
-        month_start_str = month_start.strftime('%Y-%m-%d %H:%M:%S')
+# Виды итогов в monthly_rollup и события, из которых они складываются
+ROLLUP_KINDS = {
+    'reading': READING_EVENTS,
+    'purchases': PURCHASE_EVENTS,
+}
 
-        # Получаем все события "finished_reading" за текущий календарный месяц с информацией о книгах
-        cursor.execute('''
-        SELECT 
-            bl.id,
-            bl.book_id,
-            bl.event_date,
-            bl.notes,
-            b.title,
-            b.authors,
-            b.series_name,
-            b.series_number,
-            b.pages,
-            b.format
-        FROM book_log bl
-        JOIN books b ON bl.book_id = b.id
-        WHERE bl.event_type = 'finished_reading' 
-        AND bl.event_date >= ?
-        ORDER BY bl.event_date DESC
-        ''', (month_start_str,))
-        
-        finished_books = cursor.fetchall()
-        
-        # Получаем также события "marked_as_read" (если используется)
-        cursor.execute('''
-        SELECT 
-            bl.id,
-            bl.book_id,
-            bl.event_date,
-            bl.notes,
-            b.title,
-            b.authors,
-            b.series_name,
-            b.series_number,
-            b.pages,
-            b.format
-        FROM book_log bl
-        JOIN books b ON bl.book_id = b.id
-        WHERE bl.event_type = 'marked_as_read' 
-        AND bl.event_date >= ?
-        ORDER BY bl.event_date DESC
-        ''', (month_start_str,))
-        
-        marked_books = cursor.fetchall()
-        
-        # Объединяем результаты и удаляем дубликаты по book_id
-        all_books = {}
-        
-        for book in finished_books + marked_books:
-            book_id = book[1]
-            # Если книга уже есть, берем более позднюю дату
-            if book_id not in all_books or book[2] > all_books[book_id][2]:
-                all_books[book_id] = book
-        
-        # Преобразуем в список и сортируем по дате
-        books_list = list(all_books.values())
-        books_list.sort(key=lambda x: x[2], reverse=True)
-        
-        # Подсчитываем статистику
-        total_books = len(books_list)
-        total_pages = sum(book[8] for book in books_list if book[8])
-        
-        result = {
-            'books': books_list,
-            'total_books': total_books,
-            'total_pages': total_pages,
-            'period': month_start.strftime('%d.%m.%Y'),
-            'month_name': month_start.strftime('%B %Y')  # название месяца для отображения
-        }
-        
-        logger.info(f"Получен отчет о чтении за {month_start.strftime('%B %Y')}: {total_books} книг")
-        return result
+# Таблицы, из которых строятся отчеты: готовый отчет сбрасывается при их изменении
+REPORT_TABLES = ('book_log', 'books')
 
-    except sqlite3.Error as e:
-        logger.error(f"Ошибка при получении отчета о чтении: {e}")
-        raise
-    finally:
-        conn.close()
+# Диапазон месяцев для /report: 2025-01..2025-06 или один месяц 2025-03
+PERIOD_RE = re.compile(r'^(?P<start>\d{4}-\d{2})(?:\.\.(?P<end>\d{4}-\d{2}))?$')
 
-def get_monthly_purchases_report():
-    """Получает отчет о купленных книгах за текущий календарный месяц"""
-    conn = get_conn()
-    cursor = conn.cursor()
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
-    try:
-        # Начало текущего месяца
-        now = datetime.now()
-        month_start = datetime(now.year, now.month, 1, 0, 0, 0)
-        month_start_str = month_start.strftime('%Y-%m-%d %H:%M:%S')
 
-        # Получаем все события покупки за текущий календарный месяц
-        cursor.execute('''
-        SELECT 
+def month_start(year, month):
+    """Первое число месяца, 00:00"""
+    return datetime(year, month, 1, 0, 0, 0)
+
+
+def next_month_start(date):
+    """Первое число месяца, следующего за месяцем date"""
+    if date.month == 12:
+        return month_start(date.year + 1, 1)
+    return month_start(date.year, date.month + 1)
+
+
+def current_month_range():
+    """Границы [начало, конец) текущего календарного месяца"""
+    now = datetime.now()
+    start = month_start(now.year, now.month)
+    return start, next_month_start(start)
+
+
+def previous_month_range():
+    """Границы [начало, конец) предыдущего календарного месяца"""
+    current_start, _ = current_month_range()
+    start = (current_start - timedelta(days=1)).replace(day=1)
+    return start, current_start
+
+
+def parse_period(text):
+    """Разбирает период вида 2025-01..2025-06 (или 2025-03) в границы [начало, конец)"""
+    match = PERIOD_RE.match(text.strip())
+    if not match:
+        raise ValueError("Укажите период в формате 2025-01..2025-06 или 2025-03")
+    try:
+        start = datetime.strptime(match.group('start'), '%Y-%m')
+        last = datetime.strptime(match.group('end') or match.group('start'), '%Y-%m')
+    except ValueError:
+        raise ValueError("Месяц должен быть от 01 до 12")
+    if last < start:
+        raise ValueError("Конец периода раньше начала")
+    return start, next_month_start(last)
+
+
+def period_name(start, end):
+    """Название периода для отображения: «March 2025» или «01.2025 – 06.2025»"""
+    last = end - timedelta(days=1)
+    if (start.year, start.month) == (last.year, last.month):
+        return start.strftime('%B %Y')
+    return f"{start.strftime('%m.%Y')} – {last.strftime('%m.%Y')}"
+
+
+def month_starts(start, end):
+    """Начала месяцев, попадающих в [start, end)"""
+    months = []
+    while start < end:
+        months.append(start)
+        start = next_month_start(start)
+    return months
+
+
+def _scan_period(cursor, owner_id, start, end, event_types):
+    """Последнее событие каждой книги за [start, end), найденное сканированием лога"""
+    placeholders = ', '.join('?' * len(event_types))
+    cursor.execute(f'''
+    SELECT id, book_id, event_date, notes, title, authors, series_name,
+           series_number, pages, format, source, char_count
+    FROM (
+        SELECT
             bl.id,
             bl.book_id,
             bl.event_date,
@@ -127,228 +113,321 @@ def get_monthly_purchases_report():
             b.authors,
             b.series_name,
             b.series_number,
+            b.pages,
             b.format,
-            b.source
+            b.source,
+            b.char_count,
+            ROW_NUMBER() OVER (
+                PARTITION BY bl.book_id ORDER BY bl.event_date DESC, bl.id DESC
+            ) AS rn
         FROM book_log bl
         JOIN books b ON bl.book_id = b.id
-        WHERE bl.event_type IN ('moved_from_buy_to_library', 'added') 
-        AND bl.event_date >= ?
-        ORDER BY bl.event_date DESC
-        ''', (month_start_str,))
-        
-        purchased_books = cursor.fetchall()
-        
-        # Удаляем дубликаты по book_id (берем последнее событие)
-        unique_books = {}
-        for book in purchased_books:
-            book_id = book[1]
-            if book_id not in unique_books or book[2] > unique_books[book_id][2]:
-                unique_books[book_id] = book
-        
-        books_list = list(unique_books.values())
-        books_list.sort(key=lambda x: x[2], reverse=True)
-        
+        WHERE bl.owner_id = ?
+        AND bl.event_type IN ({placeholders})
+        AND bl.event_date >= ? AND bl.event_date < ?
+    )
+    WHERE rn = 1
+    ''', (owner_id, *event_types, start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT)))
+    return cursor.fetchall()
+
+
+def _read_logged(cursor, owner_id, log_ids):
+    """Строки отчета по id событий из запечатанных итогов: выборка по первичному ключу лога.
+
+    Унарный + не дает SQLite взять индекс по владельцу и перебрать весь его лог.
+    """
+    cursor.execute('''
+    SELECT bl.id, bl.book_id, bl.event_date, bl.notes, b.title, b.authors, b.series_name,
+           b.series_number, b.pages, b.format, b.source, b.char_count
+    FROM book_log bl
+    JOIN books b ON bl.book_id = b.id
+    WHERE bl.id IN (SELECT value FROM json_each(?))
+    AND +bl.owner_id = ?
+    ''', (json.dumps(log_ids), owner_id))
+    return cursor.fetchall()
+
+
+def get_period_report(owner_id, start, end, kind):
+    """Отчет о книгах владельца с событиями вида kind (из ROLLUP_KINDS) за период [start, end).
+
+    Если у книги несколько подходящих событий, в отчет попадает последнее.
+    Строки: (log_id, book_id, event_date, notes, title, authors, series_name,
+    series_number, pages, format, source, char_count), от новых к старым.
+    Запечатанные месяцы берутся из monthly_rollup, остальные - сканированием
+    лога; закрытые незапечатанные месяцы перечислены в 'unsealed_months'.
+    """
+    event_types = ROLLUP_KINDS[kind]
+    current_start, _ = current_month_range()
+    closed = month_starts(start, min(end, current_start))
+    conn = get_conn(owner_id)
+    cursor = conn.cursor()
+
+    try:
+        sealed = {}
+        if closed:
+            cursor.execute('''
+            SELECT month, log_ids FROM monthly_rollup
+            WHERE owner_id = ? AND kind = ? AND sealed = 1 AND month >= ? AND month <= ?
+            ''', (owner_id, kind, closed[0].strftime('%Y-%m'), closed[-1].strftime('%Y-%m')))
+            sealed = {month: json.loads(log_ids) for month, log_ids in cursor.fetchall()}
+
+        logged = [log_id for log_ids in sealed.values() for log_id in log_ids]
+        rows = _read_logged(cursor, owner_id, logged) if logged else []
+        unsealed = [month for month in closed if month.strftime('%Y-%m') not in sealed]
+        # Незапечатанные месяцы подряд сканируются одним запросом, как и еще не закрытая часть периода
+        ranges = []
+        for month in unsealed:
+            if ranges and ranges[-1][1] == month:
+                ranges[-1][1] = next_month_start(month)
+            else:
+                ranges.append([month, next_month_start(month)])
+        if end > current_start:
+            ranges.append([max(start, current_start), end])
+        for range_start, range_end in ranges:
+            rows.extend(_scan_period(cursor, owner_id, range_start, range_end, event_types))
+
+        # У книги с событиями в нескольких месяцах остается последнее
+        latest = {}
+        for row in rows:
+            if row[1] not in latest or (row[2], row[0]) > (latest[row[1]][2], latest[row[1]][0]):
+                latest[row[1]] = row
+        books_list = sorted(latest.values(), key=lambda row: (row[2], row[0]), reverse=True)
+        name = period_name(start, end)
+
         result = {
             'books': books_list,
             'total_books': len(books_list),
-            'period': month_start.strftime('%d.%m.%Y'),
-            'month_name': month_start.strftime('%B %Y')  # название месяца для отображения
+            'total_pages': sum(book[8] for book in books_list if book[8]),
+            'period': start.strftime('%d.%m.%Y'),
+            'month_name': name,  # название периода для отображения
+            'months': (end.year - start.year) * 12 + end.month - start.month,
+            'unsealed_months': unsealed,
         }
-        
-        logger.info(f"Получен отчет о покупках за {month_start.strftime('%B %Y')}: {len(books_list)} книг")
+
+        logger.info(f"Получен отчет ({', '.join(event_types)}) за {name}: {len(books_list)} книг, "
+                    f"из итогов месяцев: {len(sealed)}, сканированием: {len(ranges)}")
         return result
 
     except sqlite3.Error as e:
-        logger.error(f"Ошибка при получении отчета о покупках: {e}")
+        logger.error(f"Ошибка при получении отчета за период: {e}")
         raise
     finally:
-        conn.close()
-
-def get_previous_month_reading_report():
-    """Получает отчет о прочитанных книгах за предыдущий календарный месяц"""
-    conn = get_conn()
+        release_conn(conn)
+
+
+def get_reading_report(owner_id, start, end):
+    """Отчет о прочитанных книгах владельца за период [start, end)"""
+    return get_period_report(owner_id, start, end, 'reading')
+
+
+def get_purchases_report(owner_id, start, end):
+    """Отчет о купленных книгах владельца за период [start, end)"""
+    return get_period_report(owner_id, start, end, 'purchases')
+
+
+def _compute_rollup(cursor, owner_id, start, end, event_types, last_log_id):
+    """Считает итоги владельца по книгам с событиями за [start, end) до события last_log_id включительно.
+
+    log_ids - последнее за месяц событие каждой книги из book_ids (в том же порядке).
+    """
+    placeholders = ', '.join('?' * len(event_types))
+    cursor.execute(f'''
+    SELECT COUNT(*), COALESCE(SUM(b.pages), 0), COALESCE(SUM(b.char_count), 0),
+           json_group_array(b.id), json_group_array(l.id)
+    FROM (
+        SELECT id, book_id,
+               ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY event_date DESC, id DESC) AS rn
+        FROM book_log
+        WHERE owner_id = ?
+        AND event_type IN ({placeholders})
+        AND event_date >= ? AND event_date < ?
+        AND id <= ?
+    ) l
+    JOIN books b ON b.id = l.book_id
+    WHERE l.rn = 1 AND b.owner_id = ?
+    ''', (owner_id, *event_types, start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT), last_log_id, owner_id))
+    books_count, total_pages, total_chars, book_ids, log_ids = cursor.fetchone()
+    return {
+        'books_count': books_count,
+        'total_pages': total_pages,
+        'total_chars': total_chars,
+        'book_ids': json.loads(book_ids),
+        'log_ids': json.loads(log_ids),
+        'last_log_id': last_log_id,
+    }
+
+
+def _extend_rollup(cursor, owner_id, rollup, start, end, event_types, last_log_id):
+    """Дополняет итоги владельца событиями с id в (rollup['last_log_id'], last_log_id]"""
+    placeholders = ', '.join('?' * len(event_types))
+    cursor.execute(f'''
+    SELECT DISTINCT b.id, b.pages, b.char_count
+    FROM book_log bl
+    JOIN books b ON bl.book_id = b.id
+    WHERE bl.id > ? AND bl.id <= ?
+    AND bl.owner_id = ?
+    AND bl.event_type IN ({placeholders})
+    AND bl.event_date >= ? AND bl.event_date < ?
+    ''', (rollup['last_log_id'], last_log_id, owner_id, *event_types,
+          start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT)))
+
+    known = set(rollup['book_ids'])
+    for book_id, pages, char_count in cursor.fetchall():
+        if book_id in known:
+            continue
+        known.add(book_id)
+        rollup['book_ids'].append(book_id)
+        rollup['books_count'] += 1
+        rollup['total_pages'] += pages or 0
+        rollup['total_chars'] += char_count or 0
+    rollup['last_log_id'] = last_log_id
+    return rollup
+
+
+def _save_rollup(cursor, owner_id, month, kind, rollup, sealed):
+    # События книг нужны только отчетам за закрытые месяцы: у текущего их не дозаполняет _extend_rollup
+    cursor.execute('''
+    INSERT OR REPLACE INTO monthly_rollup
+        (owner_id, month, kind, books_count, total_pages, total_chars, book_ids, log_ids, last_log_id, sealed,
+         updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (owner_id, month, kind, rollup['books_count'], rollup['total_pages'], rollup['total_chars'],
+          json.dumps(rollup['book_ids']), json.dumps(rollup['log_ids'] if sealed else []),
+          rollup['last_log_id'], int(sealed)))
+
+
+def seal_month(owner_id, start):
+    """Пересчитывает и запечатывает итоги владельца за закрытый месяц, начинающийся в start"""
+    end = next_month_start(start)
+    month = start.strftime('%Y-%m')
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
 
     try:
-        # Определяем предыдущий месяц
-        now = datetime.now()
-        if now.month == 1:
-            prev_month = 12
-            prev_year = now.year - 1
-        else:
-            prev_month = now.month - 1
-            prev_year = now.year
-            
-        # Начало предыдущего месяца
-        month_start = datetime(prev_year, prev_month, 1, 0, 0, 0)
-        month_start_str = month_start.strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Конец предыдущего месяца
-        if prev_month == 12:
-            next_month = 1
-            next_year = prev_year + 1
-        else:
-            next_month = prev_month + 1
-            next_year = prev_year
-            
-        month_end = datetime(next_year, next_month, 1, 0, 0, 0)
-        month_end_str = month_end.strftime('%Y-%m-%d %H:%M:%S')
-
-        # Получаем все события "finished_reading" за предыдущий календарный месяц с информацией о книгах
-        cursor.execute('''
-        SELECT 
-            bl.id,
-            bl.book_id,
-            bl.event_date,
-            bl.notes,
-            b.title,
-            b.authors,
-            b.series_name,
-            b.series_number,
-            b.pages,
-            b.format
-        FROM book_log bl
-        JOIN books b ON bl.book_id = b.id
-        WHERE bl.event_type = 'finished_reading' 
-        AND bl.event_date >= ? AND bl.event_date < ?
-        ORDER BY bl.event_date DESC
-        ''', (month_start_str, month_end_str))
-        
-        finished_books = cursor.fetchall()
-        
-        # Получаем также события "marked_as_read" (если используется)
-        cursor.execute('''
-        SELECT 
-            bl.id,
-            bl.book_id,
-            bl.event_date,
-            bl.notes,
-            b.title,
-            b.authors,
-            b.series_name,
-            b.series_number,
-            b.pages,
-            b.format
-        FROM book_log bl
-        JOIN books b ON bl.book_id = b.id
-        WHERE bl.event_type = 'marked_as_read' 
-        AND bl.event_date >= ? AND bl.event_date < ?
-        ORDER BY bl.event_date DESC
-        ''', (month_start_str, month_end_str))
-        
-        marked_books = cursor.fetchall()
-        
-        # Объединяем результаты и удаляем дубликаты по book_id
-        all_books = {}
-        
-        for book in finished_books + marked_books:
-            book_id = book[1]
-            # Если книга уже есть, берем более позднюю дату
-            if book_id not in all_books or book[2] > all_books[book_id][2]:
-                all_books[book_id] = book
-        
-        # Преобразуем в список и сортируем по дате
-        books_list = list(all_books.values())
-        books_list.sort(key=lambda x: x[2], reverse=True)
-        
-        # Подсчитываем статистику
-        total_books = len(books_list)
-        total_pages = sum(book[8] for book in books_list if book[8])
-        
-        result = {
-            'books': books_list,
-            'total_books': total_books,
-            'total_pages': total_pages,
-            'period': month_start.strftime('%d.%m.%Y'),
-            'month_name': month_start.strftime('%B %Y')  # название месяца для отображения
-        }
-        
-        logger.info(f"Получен отчет о чтении за {month_start.strftime('%B %Y')}: {total_books} книг")
-        return result
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM book_log')
+        last_log_id = cursor.fetchone()[0]
+        for kind, event_types in ROLLUP_KINDS.items():
+            rollup = _compute_rollup(cursor, owner_id, start, end, event_types, last_log_id)
+            _save_rollup(cursor, owner_id, month, kind, rollup, sealed=True)
+        conn.commit()
+        logger.info(f"Итоги за {month} запечатаны (владелец {owner_id})")
 
     except sqlite3.Error as e:
-        logger.error(f"Ошибка при получении отчета о чтении: {e}")
+        logger.error(f"Ошибка при запечатывании итогов за {month}: {e}")
+        conn.rollback()
         raise
     finally:
-        conn.close()
+        release_conn(conn)
+
 
-def get_previous_month_purchases_report():
-    """Получает отчет о купленных книгах за предыдущий календарный месяц"""
-    conn = get_conn()
+def get_month_rollup(owner_id, start):
+    """Итоги владельца за месяц, начинающийся в start: {вид: итоги}.
+
+    Закрытые месяцы читаются из запечатанных строк (при первом обращении
+    запечатываются), текущий дозаполняется только новыми событиями лога.
+    """
+    end = next_month_start(start)
+    month = start.strftime('%Y-%m')
+    current_start, _ = current_month_range()
+    if start > current_start:
+        return {kind: {'books_count': 0, 'total_pages': 0, 'total_chars': 0, 'book_ids': []}
+                for kind in ROLLUP_KINDS}
+
+    conn = get_conn(owner_id)
     cursor = conn.cursor()
 
     try:
-        # Определяем предыдущий месяц
-        now = datetime.now()
-        if now.month == 1:
-            prev_month = 12
-            prev_year = now.year - 1
-        else:
-            prev_month = now.month - 1
-            prev_year = now.year
-            
-        # Начало предыдущего месяца
-        month_start = datetime(prev_year, prev_month, 1, 0, 0, 0)
-        month_start_str = month_start.strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Конец предыдущего месяца
-        if prev_month == 12:
-            next_month = 1
-            next_year = prev_year + 1
-        else:
-            next_month = prev_month + 1
-            next_year = prev_year
-            
-        month_end = datetime(next_year, next_month, 1, 0, 0, 0)
-        month_end_str = month_end.strftime('%Y-%m-%d %H:%M:%S')
-
-        # Получаем все события покупки за предыдущий календарный месяц
         cursor.execute('''
-        SELECT 
-            bl.id,
-            bl.book_id,
-            bl.event_date,
-            bl.notes,
-            b.title,
-            b.authors,
-            b.series_name,
-            b.series_number,
-            b.format,
-            b.source
-        FROM book_log bl
-        JOIN books b ON bl.book_id = b.id
-        WHERE bl.event_type IN ('moved_from_buy_to_library', 'added') 
-        AND bl.event_date >= ? AND bl.event_date < ?
-        ORDER BY bl.event_date DESC
-        ''', (month_start_str, month_end_str))
-        
-        purchased_books = cursor.fetchall()
-        
-        # Удаляем дубликаты по book_id (берем последнее событие)
-        unique_books = {}
-        for book in purchased_books:
-            book_id = book[1]
-            if book_id not in unique_books or book[2] > unique_books[book_id][2]:
-                unique_books[book_id] = book
-        
-        books_list = list(unique_books.values())
-        books_list.sort(key=lambda x: x[2], reverse=True)
-        
-        result = {
-            'books': books_list,
-            'total_books': len(books_list),
-            'period': month_start.strftime('%d.%m.%Y'),
-            'month_name': month_start.strftime('%B %Y')  # название месяца для отображения
+        SELECT kind, books_count, total_pages, total_chars, book_ids, last_log_id, sealed
+        FROM monthly_rollup WHERE owner_id = ? AND month = ?
+        ''', (owner_id, month))
+        stored = {
+            row[0]: {
+                'books_count': row[1], 'total_pages': row[2], 'total_chars': row[3],
+                'book_ids': json.loads(row[4]), 'last_log_id': row[5], 'sealed': row[6],
+            }
+            for row in cursor.fetchall()
         }
-        
-        logger.info(f"Получен отчет о покупках за {month_start.strftime('%B %Y')}: {len(books_list)} книг")
+        if len(stored) == len(ROLLUP_KINDS) and all(r['sealed'] for r in stored.values()):
+            return stored
+
+        is_closed = start < current_start
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM book_log')
+        last_log_id = cursor.fetchone()[0]
+
+        result = {}
+        for kind, event_types in ROLLUP_KINDS.items():
+            rollup = stored.get(kind)
+            if rollup is None or is_closed:
+                rollup = _compute_rollup(cursor, owner_id, start, end, event_types, last_log_id)
+            elif rollup['last_log_id'] < last_log_id:
+                rollup = _extend_rollup(cursor, owner_id, rollup, start, end, event_types, last_log_id)
+            _save_rollup(cursor, owner_id, month, kind, rollup, sealed=is_closed)
+            rollup['sealed'] = int(is_closed)
+            result[kind] = rollup
+        conn.commit()
         return result
 
     except sqlite3.Error as e:
-        logger.error(f"Ошибка при получении отчета о покупках: {e}")
+        logger.error(f"Ошибка при получении итогов за {month}: {e}")
+        conn.rollback()
         raise
     finally:
-        conn.close()
+        release_conn(conn)
+
+
+def get_year_review(owner_id, year):
+    """Итоги владельца за год по месяцам из monthly_rollup"""
+    months = []
+    totals = {kind: {'books_count': 0, 'total_pages': 0, 'total_chars': 0} for kind in ROLLUP_KINDS}
+    current_start, _ = current_month_range()
+
+    for month in range(1, 13):
+        start = month_start(year, month)
+        if start > current_start:
+            break
+        rollup = get_month_rollup(owner_id, start)
+        months.append((start, rollup))
+        for kind, values in rollup.items():
+            for key in totals[kind]:
+                totals[kind][key] += values[key]
+
+    return {'year': year, 'months': months, 'totals': totals}
+
+
+def format_year_review(review):
+    """Форматирует итоги года для Telegram"""
+    formatted = []
+    formatted.append(f"🎉 <b>ИТОГИ {review['year']} ГОДА</b>")
+    formatted.append("")
+
+    reading = review['totals']['reading']
+    purchases = review['totals']['purchases']
+    if not reading['books_count'] and not purchases['books_count']:
+        formatted.append(f"Нет активности за {review['year']} год")
+        return "\n".join(formatted)
+
+    formatted.append(f"📚 Прочитано: <b>{reading['books_count']}</b> книг")
+    if reading['total_pages']:
+        formatted.append(f"📄 Страниц: <b>{reading['total_pages']}</b>")
+    if reading['total_chars']:
+        formatted.append(f"🔤 Знаков: <b>{reading['total_chars']}</b>")
+    formatted.append(f"🛒 Куплено: <b>{purchases['books_count']}</b> книг")
+    formatted.append("")
+
+    for start, rollup in review['months']:
+        month_reading = rollup['reading']
+        month_purchases = rollup['purchases']
+        if not month_reading['books_count'] and not month_purchases['books_count']:
+            continue
+        line = f"<b>{start.strftime('%B')}</b>: 📚 {month_reading['books_count']}"
+        if month_reading['total_pages']:
+            line += f" ({month_reading['total_pages']} стр.)"
+        line += f" • 🛒 {month_purchases['books_count']}"
+        formatted.append(line)
+
+    return "\n".join(formatted)
+
 
 def format_reading_report(report):
     """Форматирует отчет о прочитанном для Telegram"""
@@ -424,7 +503,7 @@ def format_purchases_report(report):
         authors = book[5]
         series_name = book[6]
         series_number = book[7]
-        book_format = book[8]
+        book_format = book[9]
         notes = book[3]
         
         # Формируем строку с информацией о книге
@@ -459,7 +538,10 @@ def format_purchases_report(report):
 def format_combined_report(reading_report, purchases_report):
     """Форматирует объединенный отчет о прочитанном и купленном"""
     formatted = []
-    formatted.append("📊 <b>МЕСЯЧНЫЙ ОТЧЕТ</b>")
+    if reading_report.get('months', 1) > 1:
+        formatted.append("📊 <b>ОТЧЕТ ЗА ПЕРИОД</b>")
+    else:
+        formatted.append("📊 <b>МЕСЯЧНЫЙ ОТЧЕТ</b>")
     
     # Используем красивое название месяца
     month_name = reading_report.get('month_name', 'текущий месяц')
@@ -535,7 +617,7 @@ def format_combined_report(reading_report, purchases_report):
             authors = book[5]
             series_name = book[6]
             series_number = book[7]
-            book_format = book[8]
+            book_format = book[9]
             notes = book[3]
             
             book_info = []
@@ -597,32 +679,26 @@ def split_message(text, max_length=4000):
     return parts
 
 async def send_monthly_report_auto():
-    """Автоматическая отправка месячного отчета"""
-    if not bot_instance or not user_id:
-        logger.warning("Бот или ID пользователя не настроены для автоматических отчетов")
+    """Автоматическая отправка месячного отчета всем подписанным пользователям"""
+    if not bot_instance or not report_user_ids:
+        logger.warning("Бот или ID пользователей не настроены для автоматических отчетов")
         return
-    
+
+    for user_id in sorted(report_user_ids):
+        await send_monthly_report(user_id)
+
+async def send_monthly_report(user_id):
+    """Отправка месячного отчета по библиотеке пользователя"""
     try:
-        # Определяем за какой месяц отчет (предыдущий месяц)
-        now = datetime.now()
-        if now.month == 1:
-            prev_month = 12
-            prev_year = now.year - 1
-        else:
-            prev_month = now.month - 1
-            prev_year = now.year
-            
-        prev_month_name = datetime(prev_year, prev_month, 1).strftime('%B %Y')
-        
-        logger.info(f"Отправка автоматического отчета за {prev_month_name}")
+        # Отчет за предыдущий месяц
+        start, end = previous_month_range()
+        prev_month_name = period_name(start, end)
         
-        # Получаем отчеты за предыдущий месяц
-        reading_report = get_previous_month_reading_report()
-        purchases_report = get_previous_month_purchases_report()
+        logger.info(f"Отправка автоматического отчета за {prev_month_name} пользователю {user_id}")
         
         # Форматируем объединенный отчет с префиксом
         header = f"🗓 <b>АВТОМАТИЧЕСКИЙ ОТЧЕТ ЗА {prev_month_name.upper()}</b>\n\n"
-        report_text = format_combined_report(reading_report, purchases_report)
+        report_text = await get_period_report_html(user_id, start, end)
         full_text = header + report_text
         
         # Разбиваем на части если нужно
@@ -651,12 +727,24 @@ async def send_monthly_report_auto():
         except:
             pass
 
+async def seal_previous_month():
+    """Запечатывание итогов закрывшегося месяца по расписанию.
+
+    Месяцы остальных владельцев запечатываются при первом /report или /year за них.
+    """
+    start, _ = previous_month_range()
+    for user_id in sorted(report_user_ids):
+        try:
+            await repo.write_library(user_id, seal_month, user_id, start)
+        except Exception as e:
+            logger.error(f"Ошибка при запечатывании итогов месяца пользователя {user_id}: {e}")
+
 def setup_scheduler(bot: Bot, target_user_id: int):
-    """Настройка планировщика для автоматических отчетов"""
-    global scheduler, bot_instance, user_id
+    """Подписка пользователя на автоматические отчеты и настройка планировщика"""
+    global scheduler, bot_instance
     
     bot_instance = bot
-    user_id = target_user_id
+    report_user_ids.add(target_user_id)
     
     if scheduler is None:
         scheduler = AsyncIOScheduler()
@@ -674,10 +762,23 @@ def setup_scheduler(bot: Bot, target_user_id: int):
             misfire_grace_time=3600  # если пропустили запуск, выполнить в течение часа
         )
         
+        # Первого числа запечатываем итоги закрывшегося месяца
+        scheduler.add_job(
+            seal_previous_month,
+            trigger=CronTrigger(
+                day=1,
+                hour=0,
+                minute=5
+            ),
+            id='seal_monthly_rollup',
+            replace_existing=True,
+            misfire_grace_time=86400
+        )
+        
         scheduler.start()
         logger.info(f"Планировщик настроен для пользователя {target_user_id}")
     else:
-        logger.info("Планировщик уже настроен")
+        logger.info(f"Планировщик уже настроен, добавлен пользователь {target_user_id}")
 
 def stop_scheduler():
     """Остановка планировщика"""
@@ -688,29 +789,88 @@ def stop_scheduler():
         logger.info("Планировщик остановлен")
 
 
+async def build_period_report(owner_id, start, end):
+    reading_report = await repo.run(get_reading_report, owner_id, start, end)
+    purchases_report = await repo.run(get_purchases_report, owner_id, start, end)
+
+    # Закрытые месяцы, которых еще нет в итогах, запечатываются: следующий отчет за них не сканирует лог
+    unsealed = set(reading_report['unsealed_months']) | set(purchases_report['unsealed_months'])
+    for month in sorted(unsealed):
+        try:
+            await repo.write_library(owner_id, seal_month, owner_id, month)
+        except Exception as e:
+            logger.error(f"Ошибка при запечатывании итогов месяца пользователя {owner_id}: {e}")
+
+    return format_combined_report(reading_report, purchases_report)
+
+async def get_period_report_html(owner_id, start, end):
+    """Готовый объединенный отчет владельца за период: общий для одновременных запросов, из кэша до новых событий"""
+    return await result_cache.cached(
+        ('period_report', owner_id, start, end), REPORT_TABLES,
+        lambda: build_period_report(owner_id, start, end), owner_id
+    )
+
+async def answer_period_report(message: types.Message, start, end):
+    """Отправляет объединенный отчет о прочитанном и купленном за период [start, end)"""
+    text = await get_period_report_html(message.from_user.id, start, end)
+    
+    # Разбиваем на части если нужно
+    parts = split_message(text)
+    
+    for i, part in enumerate(parts):
+        if i == 0:
+            await message.answer(part, parse_mode="HTML")
+        else:
+            await message.answer(f"<i>Продолжение отчета...</i>\n\n{part}", parse_mode="HTML")
+
 async def cmd_last_read(message: types.Message):
     """Команда для получения объединенного отчета о прочитанном и купленном за месяц"""
     try:
-        # Получаем оба отчета
-        reading_report = get_monthly_reading_report()
-        purchases_report = get_monthly_purchases_report()
-        
-        # Форматируем объединенный отчет
-        text = format_combined_report(reading_report, purchases_report)
-        
-        # Разбиваем на части если нужно
-        parts = split_message(text)
-        
-        for i, part in enumerate(parts):
-            if i == 0:
-                await message.answer(part, parse_mode="HTML")
-            else:
-                await message.answer(f"<i>Продолжение отчета...</i>\n\n{part}", parse_mode="HTML")
+        start, end = current_month_range()
+        await answer_period_report(message, start, end)
                 
     except Exception as e:
         logger.error(f"Ошибка при выполнении команды last_read: {e}")
         await message.answer("❌ Произошла ошибка при получении месячного отчета")
 
+async def cmd_report(message: types.Message, command: CommandObject):
+    """Команда для получения отчета за произвольный период: /report 2025-01..2025-06"""
+    if not command.args:
+        await message.answer(
+            "Укажите период: /report 2025-01..2025-06\n"
+            "Или один месяц: /report 2025-03"
+        )
+        return
+
+    try:
+        start, end = parse_period(command.args)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+
+    try:
+        await answer_period_report(message, start, end)
+
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды report: {e}")
+        await message.answer("❌ Произошла ошибка при получении отчета за период")
+
+async def cmd_year(message: types.Message, command: CommandObject):
+    """Команда для итогов года: /year 2025 (по умолчанию текущий год)"""
+    args = (command.args or '').strip()
+    if args and not re.fullmatch(r'\d{4}', args):
+        await message.answer("Укажите год: /year 2025")
+        return
+    year = int(args) if args else datetime.now().year
+
+    try:
+        review = await repo.write_library(message.from_user.id, get_year_review, message.from_user.id, year)
+        await message.answer(format_year_review(review), parse_mode="HTML")
+
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды year: {e}")
+        await message.answer("❌ Произошла ошибка при получении итогов года")
+
 async def cmd_setup_auto_reports(message: types.Message):
     """Команда для настройки автоматических отчетов"""
     try:
@@ -733,7 +893,10 @@ async def cmd_setup_auto_reports(message: types.Message):
 async def cmd_stop_auto_reports(message: types.Message):
     """Команда для остановки автоматических отчетов"""
     try:
-        stop_scheduler()
+        report_user_ids.discard(message.from_user.id)
+        # Планировщик нужен, пока есть хотя бы один подписанный пользователь
+        if not report_user_ids:
+            stop_scheduler()
         await message.answer("⏹ Автоматические отчеты остановлены")
         
     except Exception as e:
@@ -746,13 +909,12 @@ async def cmd_test_auto_report(message: types.Message):
         # Получаем ID пользователя
         current_user_id = message.from_user.id
         
-        # Временно устанавливаем глобальные переменные
-        global bot_instance, user_id
+        # Отчет уходит только текущему пользователю, подписки не меняются
+        global bot_instance
         bot_instance = message.bot
-        user_id = current_user_id
         
         # Запускаем автоматический отчет
-        await send_monthly_report_auto()
+        await send_monthly_report(current_user_id)
         
         await message.answer("✅ Тестовый автоматический отчет отправлен!")
         
@@ -763,6 +925,8 @@ async def cmd_test_auto_report(message: types.Message):
 def register_handlers(dp: Dispatcher):
     """Регистрация обработчиков команд"""
     dp.message.register(cmd_last_read, Command("last_read"))
+    dp.message.register(cmd_report, Command("report"))
+    dp.message.register(cmd_year, Command("year"))
     dp.message.register(cmd_setup_auto_reports, Command("setup_auto_reports"))
     dp.message.register(cmd_stop_auto_reports, Command("stop_auto_reports"))
     dp.message.register(cmd_test_auto_report, Command("test_auto_report"))
@@ -1,15 +1,21 @@
 from aiogram import Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
-import sqlite3
 from aiogram.fsm.state import State, StatesGroup
+import repo
+from search_query import parse_search_query, has_filters, SEARCH_SYNTAX_HELP
 
 class SearchStates(StatesGroup):
     waiting_query = State()
 
-async def search_start(message: types.Message, state: FSMContext):
+async def search_start(message: types.Message, command: CommandObject, state: FSMContext):
+    # /search author:Пратчетт unread - ищем сразу, без дополнительного шага
+    if command.args:
+        await run_search(message, command.args.strip())
+        return
+
     await state.set_state(SearchStates.waiting_query)
-    await message.answer("Введите автора, название книги или название серии:")
+    await message.answer(f"Введите автора, название книги или название серии:\n\n{SEARCH_SYNTAX_HELP}")
 
 async def search_books(message: types.Message, state: FSMContext):
     query = message.text.strip()
@@ -17,43 +23,27 @@ async def search_books(message: types.Message, state: FSMContext):
         await message.answer("Пустой запрос. Введите снова:")
         return
 
-    words = query.lower().split()
-    if not words:
-        await message.answer("Пустой запрос. Введите снова:")
-        return
-
-    conn = sqlite3.connect("data/library.db")
-    cursor = conn.cursor()
-
-    # Загружаем все данные, которые нужны для поиска
-    cursor.execute("""
-        SELECT id, title, authors, pages, series_name, series_number
-        FROM books
-    """)
-    rows = cursor.fetchall()
-
-    # Фильтрация в Python
-    filtered = []
-    for row in rows:
-        id, title, authors, pages, series_name, series_number = row
-        # Конкатенируем все текстовые поля в один большой текст для удобства
-        searchable_text = " ".join([
-            title or "",
-            authors or "",
-            series_name or ""
-        ]).lower()
+    await run_search(message, query)
+    await state.clear()
 
-        if all(word in searchable_text for word in words):
-            filtered.append(row)
-            if len(filtered) >= 10:  # лимит результатов
-                break
+async def run_search(message: types.Message, query: str):
+    try:
+        parsed = parse_search_query(query)
+        filtered = await repo.structured_search(message.from_user.id, query, limit=10)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
 
-    conn.close()
+    header = ""
+    if not filtered and not has_filters(parsed):
+        # Точных совпадений нет - пробуем найти с учетом опечаток
+        filtered = await repo.fuzzy_find_books(message.from_user.id, query, limit=10)
+        header = "Точных совпадений нет. Возможно, вы искали:\n\n"
 
     if not filtered:
         await message.answer("Ничего не найдено 😢")
     else:
-        text = "\n\n".join(
+        text = header + "\n\n".join(
             f"<b>{title}</b> (ID: {book_id})\n"
             f"Автор: {authors}"
             + (f"\nСерия: {series_name} (Том {series_number})" if series_name else "")
@@ -62,8 +52,6 @@ async def search_books(message: types.Message, state: FSMContext):
         )
         await message.answer(text, parse_mode="HTML")
 
-    await state.clear()
-
 
 
 
@@ -1,7 +1,15 @@
+import os
 from aiogram import types, Dispatcher
-from db import get_library_summary, format_library_summary
+from db import format_library_summary, get_writer_stats, get_book_cache_stats, get_library_stats, LIBRARY_SUMMARY_TABLES
+import repo
+import chat_order
+import result_cache
 from aiogram.filters import Command
+from dotenv import load_dotenv
 
+load_dotenv()
+# Telegram ID администраторов (через запятую), которым доступна /metrics; без них команда отключена
+ADMIN_IDS = {int(value) for value in os.getenv('ADMIN_IDS', '').replace(' ', '').split(',') if value}
 
 async def cmd_start(message: types.Message):
     welcome = ("📚 Добро пожаловать!\n"
@@ -10,11 +18,106 @@ async def cmd_start(message: types.Message):
                "/summary — сводка")
     await message.answer(welcome)
 
+async def build_summary_html(owner_id):
+    stats = await repo.get_library_summary(owner_id)
+    return format_library_summary(stats)
+
+async def get_summary_html(owner_id):
+    """Готовая сводка владельца: одна на все одновременные запросы, из кэша до изменения данных"""
+    return await result_cache.cached(('summary', owner_id), LIBRARY_SUMMARY_TABLES,
+                                     lambda: build_summary_html(owner_id), owner_id)
+
 async def cmd_summary(message: types.Message):
-    stats = get_library_summary()
-    txt = format_library_summary(stats)
+    txt = await get_summary_html(message.from_user.id)
     await message.answer(txt, parse_mode="HTML")
 
+async def cmd_rebuild_stats(message: types.Message):
+    """Пересчитывает счетчики статистики с нуля (если они разошлись с данными)"""
+    await repo.rebuild_library_stats(message.from_user.id)
+    txt = await get_summary_html(message.from_user.id)
+    await message.answer(f"🔄 Статистика пересчитана\n\n{txt}", parse_mode="HTML")
+
+def format_metrics():
+    """Форматирует метрики фоновых служб бота для Telegram"""
+    lines = ["📈 <b>МЕТРИКИ</b>", ""]
+
+    update_stats = chat_order.get_stats()
+    lines.append("<b>Обработка обновлений:</b>")
+    if update_stats is None:
+        lines.append("без упорядочивания по чатам")
+    else:
+        lines.append(
+            f"В работе: {update_stats['active']} из {update_stats['concurrency']} "
+            f"(максимум {update_stats['max_active']}), обработано: {update_stats['processed']}"
+        )
+        lines.append(
+            f"Чатов с обновлениями: {update_stats['chats']}, ждут своей очереди: {update_stats['queued']}, "
+            f"самая длинная очередь чата: {update_stats['max_chat_depth']}"
+        )
+        if update_stats['misrouted']:
+            lines.append(f"Пришло не тому воркеру кластера: {update_stats['misrouted']}")
+        if update_stats['chats_waiting']:
+            lines.append(
+                f"Чатов с очередью: {update_stats['chats_waiting']}, "
+                f"самая длинная сейчас: {update_stats['chat_depth']}"
+            )
+    lines.append("")
+
+    writer_stats = get_writer_stats()
+    lines.append("<b>Поток записи в базу:</b>")
+    if writer_stats is None:
+        lines.append("не запущен")
+    else:
+        lines.append(f"В очереди: {writer_stats['queue_depth']}, потоков: {writer_stats['threads']}")
+        lines.append(f"Выполнено изменений: {writer_stats['completed']}, с ошибкой: {writer_stats['failed']}")
+    lines.append("")
+
+    library_stats = get_library_stats()
+    if library_stats is not None:
+        lines.append("<b>Библиотеки пользователей:</b>")
+        lines.append(
+            f"Открыто: {library_stats['open']} из {library_stats['capacity']}, "
+            f"заняты сейчас: {library_stats['in_use']}"
+        )
+        lines.append(
+            f"Обращений к открытым: {library_stats['hits']}, открытий файлов: {library_stats['opened']}, "
+            f"закрыто по лимиту: {library_stats['evicted']}, без обращений: {library_stats['closed_idle']}"
+        )
+        lines.append("")
+
+    cache_stats = get_book_cache_stats()
+    lines.append("<b>Кэш книг:</b>")
+    lines.append(f"Записей: {cache_stats['size']} из {cache_stats['capacity']}")
+    lines.append(
+        f"Попаданий: {cache_stats['hits']}, промахов: {cache_stats['misses']} "
+        f"({cache_stats['hit_rate']:.0%} попаданий)"
+    )
+    lines.append(f"Вытеснено: {cache_stats['evictions']}, сбросов: {cache_stats['invalidations']}")
+    lines.append("")
+
+    result_stats = result_cache.get_stats()
+    lines.append("<b>Кэш ответов (/summary, отчеты):</b>")
+    lines.append(
+        f"Записей: {result_stats['size']} из {result_stats['capacity']}, "
+        f"считается сейчас: {result_stats['inflight']}"
+    )
+    lines.append(
+        f"Попаданий: {result_stats['hits']}, промахов: {result_stats['misses']}, "
+        f"объединено одновременных: {result_stats['coalesced']}, сброшено: {result_stats['invalidations']}"
+    )
+    lines.append(f"Устарело: {result_stats['expired']}, вытеснено: {result_stats['evictions']}")
+
+    return "\n".join(lines)
+
+async def cmd_metrics(message: types.Message):
+    """Метрики видны только администраторам: бот общий, а метрики описывают всех пользователей"""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ Команда доступна только администратору бота")
+        return
+    await message.answer(format_metrics(), parse_mode="HTML")
+
 def register_handlers(dp: Dispatcher):
     dp.message.register(cmd_start, Command("start"))
     dp.message.register(cmd_summary, Command("summary"))
+    dp.message.register(cmd_rebuild_stats, Command("rebuild_stats"))
+    dp.message.register(cmd_metrics, Command("metrics"))
@@ -1,25 +1,141 @@
 import asyncio
+import logging
 import os
+import signal
+from aiohttp import web
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from dotenv import load_dotenv
 from handlers import register_all_handlers
+from fsm_storage import SQLiteStorage
+from handlers import reports
+import chat_order
 import db
+import repo
 
-load_dotenv()  
+load_dotenv()
+# sqlite - состояния диалогов в базе (переживают перезапуск), memory - только в памяти
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
 
-async def main():
+# polling - бот сам опрашивает Telegram, webhook - Telegram присылает обновления на наш HTTP-сервер
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Публичный адрес, который регистрируется в Telegram; без него вебхук не устанавливается
+# (для локальной проверки обновлениями из файла)
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Unix-сокет вместо WEBHOOK_HOST:WEBHOOK_PORT (так воркеры cluster.py принимают обновления от фронта)
+WEBHOOK_SOCKET = os.getenv('WEBHOOK_SOCKET', '')
+# Адрес своего Bot API сервера (telegram-bot-api --local или заглушка бенчмарка) вместо api.telegram.org
+TG_API_URL = os.getenv('TG_API_URL', '')
+
+# Задаются cluster.py: номер воркера, число воркеров и как часто проверять изменения базы другими воркерами
+SHARD_ID = os.getenv('SHARD_ID', '')
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))
+CLUSTER_SYNC_INTERVAL = float(os.getenv('CLUSTER_SYNC_INTERVAL', '1.0'))
+
+logger = logging.getLogger(__name__)
+
+_sync_task = None
+
+async def sync_shared_db():
+    """Сбрасывает кэши воркера, когда другой воркер кластера изменил общую базу"""
+    while True:
+        try:
+            await repo.write(db.check_external_changes)
+        except Exception as e:
+            logger.error(f"Не удалось проверить изменения базы другими воркерами: {e}")
+        await asyncio.sleep(CLUSTER_SYNC_INTERVAL)
+
+async def on_startup():
+    global _sync_task
+    db.open_pool()
     db.init_db()
+    db.start_writer()
+    if SHARD_ID:
+        _sync_task = asyncio.create_task(sync_shared_db(), name='cluster_sync')
+        logger.info(f"Воркер {SHARD_ID}: кэши сверяются с общей базой раз в {CLUSTER_SYNC_INTERVAL} с")
+
+async def on_shutdown():
+    # Сначала дожидаемся начатых запросов, потом закрываем подключения
+    if _sync_task is not None:
+        _sync_task.cancel()
+    reports.stop_scheduler()
+    repo.shutdown()
+    db.stop_writer()
+    db.close_pool()
+
+async def set_webhook(bot: Bot, dispatcher: Dispatcher):
+    """Регистрирует адрес вебхука в Telegram (если задан WEBHOOK_BASE_URL)"""
+    if not WEBHOOK_BASE_URL:
+        logger.info("WEBHOOK_BASE_URL не задан, вебхук в Telegram не устанавливается")
+        return
+    url = WEBHOOK_BASE_URL.rstrip('/') + WEBHOOK_PATH
+    await bot.set_webhook(
+        url,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    logger.info(f"Вебхук установлен: {url}")
 
+async def healthcheck(request: web.Request):
+    return web.Response(text="ok")
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Принимает обновления по HTTP до SIGINT/SIGTERM, затем штатно останавливает бота"""
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET is not set in environment variables")
+
+    dp.startup.register(set_webhook)
+
+    app = web.Application()
+    # Запросы без заголовка X-Telegram-Bot-Api-Secret-Token с нашим секретом отклоняются (401)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    app.router.add_get('/healthz', healthcheck)
+    # Запуск и остановка приложения вызывают startup/shutdown диспетчера
+    setup_application(app, dp, bot=bot)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        if WEBHOOK_SOCKET:
+            await web.UnixSite(runner, WEBHOOK_SOCKET).start()
+            logger.info(f"Вебхук-сервер слушает {WEBHOOK_SOCKET}{WEBHOOK_PATH}")
+        else:
+            await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+            logger.info(f"Вебхук-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+async def main():
     TG_BOT_TOKEN = os.getenv("TG_BOT_TOKEN")
     if not TG_BOT_TOKEN:
         raise RuntimeError("TG_BOT_TOKEN is not set in environment variables")
 
-    bot = Bot(token=TG_BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TG_API_URL)) if TG_API_URL else None
+    bot = Bot(token=TG_BOT_TOKEN, session=session)
+    storage = MemoryStorage() if FSM_STORAGE == 'memory' else SQLiteStorage()
+    dp = Dispatcher(storage=storage)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    chat_order.setup(dp, shard=(int(SHARD_ID), SHARD_COUNT) if SHARD_ID and SHARD_COUNT else None)
     register_all_handlers(dp)
 
-    await dp.start_polling(bot)
+    if BOT_MODE == 'webhook':
+        await run_webhook(bot, dp)
+    else:
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     asyncio.run(main())
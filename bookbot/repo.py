@@ -0,0 +1,101 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import logging
+
+import db
+
+load_dotenv()
+DB_WORKERS = int(os.getenv('DB_WORKERS', '4'))
+logger = logging.getLogger(__name__)
+
+# Ограниченный пул потоков: запросы к SQLite не блокируют цикл событий бота
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+        logger.info(f"Пул потоков базы данных запущен ({DB_WORKERS} потоков)")
+    return _executor
+
+
+async def run(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с базой в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def write(func, *args, **kwargs):
+    """Выполняет изменение данных через поток записи базы (по очереди с остальными)"""
+    if db.writer_started():
+        return await asyncio.wrap_future(db.submit_write(func, *args, **kwargs))
+    return await run(func, *args, **kwargs)
+
+
+async def write_library(owner_id, func, *args, **kwargs):
+    """Выполняет изменение библиотеки владельца через ее поток записи"""
+    if db.writer_started():
+        return await asyncio.wrap_future(db.submit_library_write(owner_id, func, *args, **kwargs))
+    return await run(func, *args, **kwargs)
+
+
+def shutdown():
+    """Останавливает пул потоков, дожидаясь завершения начатых запросов"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+        logger.info("Пул потоков базы данных остановлен")
+
+
+def _async(func):
+    """Делает асинхронную обертку над функцией из db"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+
+def _write(func):
+    """Делает асинхронную обертку над изменяющей функцией библиотеки из db (owner_id - первый параметр)"""
+    @functools.wraps(func)
+    async def wrapper(owner_id, *args, **kwargs):
+        return await write_library(owner_id, func, owner_id, *args, **kwargs)
+    return wrapper
+
+
+# Книги
+add_book = _write(db.add_book)
+get_book = _async(db.get_book)
+find_books = _async(db.find_books)
+fuzzy_find_books = _async(db.fuzzy_find_books)
+structured_search = _async(db.structured_search)
+get_genres = _async(db.get_genres)
+get_publishers = _async(db.get_publishers)
+get_series_by_author = _async(db.get_series_by_author)
+
+# Список для чтения
+get_to_read_page = _async(db.get_to_read_page)
+get_to_read_item = _async(db.get_to_read_item)
+add_to_read_list = _write(db.add_to_read_list)
+
+# Список для покупки
+get_to_buy_page = _async(db.get_to_buy_page)
+get_to_buy_item = _async(db.get_to_buy_item)
+add_to_buy_list = _write(db.add_to_buy_list)
+
+# Операции со списками: изменение и событие лога одной транзакцией
+mark_read = _write(db.mark_read)
+change_priority = _write(db.change_priority)
+remove_from_list = _write(db.remove_from_list)
+move_buy_to_library = _write(db.move_buy_to_library)
+
+# Лог и статистика
+get_book_log = _async(db.get_book_log)
+get_log_page = _async(db.get_log_page)
+get_library_summary = _async(db.get_library_summary)
+rebuild_library_stats = _write(db.rebuild_library_stats)
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+import logging
+
+import db
+
+load_dotenv()
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', '60'))
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '500'))
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Кэш готовых ответов (/summary, отчеты) с общим вычислением.
+
+    Одинаковые запросы, пришедшие, пока ответ еще считается, ждут то же
+    вычисление, а не запускают свое. Готовый результат живет ttl секунд
+    или до изменения одной из таблиц, от которых он зависит, в библиотеке
+    его владельца. Если таблица изменилась во время вычисления, результат
+    отдается ждущим, но в кэш не попадает: он мог быть прочитан до изменения.
+    Записей не больше size: при переполнении вытесняются давно не читанные.
+    """
+
+    def __init__(self, ttl=RESULT_CACHE_TTL, size=RESULT_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        # Уведомления приходят из потока записи, поэтому записи и пометки под блокировкой
+        self._lock = threading.Lock()
+        # key -> (значение, срок жизни, таблицы, владелец)
+        self._entries = OrderedDict()
+        # key -> (таблицы, владелец) идущих вычислений
+        self._pending = {}
+        self._stale = set()
+        self._inflight = {}
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'invalidations': 0, 'expired': 0, 'evictions': 0}
+
+    async def get(self, key, tables, compute, owner_id=None):
+        """Возвращает результат для key: из кэша, из идущего вычисления или вызвав compute().
+
+        owner_id - владелец библиотеки, из которой посчитан результат
+        (None - результат зависит от данных всех владельцев).
+        """
+        tables = frozenset(tables)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[0]
+                del self._entries[key]
+                self._stats['expired'] += 1
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._stats['coalesced'] += 1
+            return await asyncio.shield(task)
+
+        self._stats['misses'] += 1
+        with self._lock:
+            self._pending[key] = (tables, owner_id)
+            self._stale.discard(key)
+        # Вычисление идет отдельной задачей, а вызвавшие ждут его через shield:
+        # отмена одного из них (отключился клиент) не отменяет ответ остальным
+        task = asyncio.create_task(self._compute(key, tables, owner_id, compute))
+        task.add_done_callback(_retrieve_exception)
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _compute(self, key, tables, owner_id, compute):
+        try:
+            value = await compute()
+            with self._lock:
+                if key not in self._stale and self.ttl > 0 and self.size > 0:
+                    self._entries[key] = (value, time.monotonic() + self.ttl, tables, owner_id)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+                        self._stats['evictions'] += 1
+            return value
+        finally:
+            self._inflight.pop(key, None)
+            with self._lock:
+                self._pending.pop(key, None)
+                self._stale.discard(key)
+
+    def invalidate(self, tables=None, book_ids=None, owner_id=None):
+        """Сбрасывает результаты владельца owner_id, зависящие от tables; подписан на db.on_data_changed.
+
+        tables=None - изменилось все, owner_id=None - изменились данные всех владельцев.
+        """
+        def affected(entry_tables, entry_owner):
+            return ((tables is None or entry_tables & tables)
+                    and (owner_id is None or entry_owner is None or entry_owner == owner_id))
+
+        with self._lock:
+            dropped = [key for key, entry in self._entries.items() if affected(entry[2], entry[3])]
+            for key in dropped:
+                del self._entries[key]
+            for key, (pending_tables, pending_owner) in self._pending.items():
+                if affected(pending_tables, pending_owner):
+                    self._stale.add(key)
+            if dropped:
+                self._stats['invalidations'] += len(dropped)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['capacity'] = self.size
+        stats['inflight'] = len(self._inflight)
+        return stats
+
+
+def _retrieve_exception(task):
+    # Ошибку получат ждущие; если все они уже отменены, не пишем предупреждение о ней
+    if not task.cancelled():
+        task.exception()
+
+
+_cache = ResultCache()
+db.on_data_changed(_cache.invalidate)
+
+
+async def cached(key, tables, compute, owner_id=None):
+    """Результат compute() для key из общего кэша; tables - таблицы владельца owner_id, от которых он зависит"""
+    return await _cache.get(key, tables, compute, owner_id)
+
+
+def get_stats():
+    """Метрики кэша ответов: попадания, промахи, объединенные запросы, сбросы, вытеснения"""
+    return _cache.get_stats()
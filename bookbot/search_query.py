@@ -0,0 +1,114 @@
+import re
+
+# Синонимы полей запроса: author:Пратчетт, автор:Пратчетт и т.д.
+FIELD_ALIASES = {
+    'author': 'author', 'authors': 'author', 'автор': 'author',
+    'title': 'title', 'название': 'title',
+    'series': 'series', 'серия': 'series',
+    'year': 'year', 'год': 'year',
+    'genre': 'genre', 'жанр': 'genre',
+    'format': 'format', 'формат': 'format',
+    'source': 'source', 'источник': 'source',
+}
+
+FORMAT_ALIASES = {
+    'physical': 'physical', 'физическая': 'physical', 'бумажная': 'physical',
+    'digital': 'digital', 'цифровая': 'digital', 'электронная': 'digital',
+}
+
+SOURCES = ('shop', 'author.today', 'ficbook', 'ao3')
+
+READ_FLAGS = {
+    'read': 1, 'прочитано': 1, 'прочитанные': 1,
+    'unread': 0, 'непрочитано': 0, 'непрочитанные': 0,
+}
+
+TOKEN_RE = re.compile(
+    r'(?P<key>[^\s:"]+):(?:"(?P<quoted>[^"]*)"|(?P<value>\S+))'
+    r'|"(?P<phrase>[^"]*)"'
+    r'|(?P<word>\S+)'
+)
+YEAR_RE = re.compile(r'^(?:(?P<op>>=|<=|>|<|=)?(?P<year>\d{4})|(?P<start>\d{4})\.\.(?P<end>\d{4}))$')
+
+SEARCH_SYNTAX_HELP = (
+    "Можно уточнить запрос фильтрами:\n"
+    "author:Пратчетт title:стража series:\"Плоский мир\"\n"
+    "year:2000, year:>2000, year:1990..2000\n"
+    "genre:фэнтези format:digital source:ficbook\n"
+    "\"точная фраза\" — слова подряд, title:\"...\" и author:\"...\" тоже\n"
+    "read / unread — только прочитанные / непрочитанные (\"read\" в кавычках — обычное слово)"
+)
+
+
+def _parse_year(value):
+    """Разбирает фильтр по году в список условий (оператор, год)"""
+    match = YEAR_RE.match(value)
+    if not match:
+        raise ValueError(f"Не понимаю год «{value}». Примеры: year:2000, year:>2000, year:1990..2000")
+    if match.group('start'):
+        return [('>=', int(match.group('start'))), ('<=', int(match.group('end')))]
+    return [(match.group('op') or '=', int(match.group('year')))]
+
+
+def parse_search_query(text):
+    """Разбирает строку поиска на свободный текст, фильтры по полям и флаг прочитанности.
+
+    Текст в кавычках ищется как фраза (слова подряд) и никогда не считается
+    флагом read/unread. У author: и title: значения хранятся парами
+    (значение, в кавычках ли); значения в кавычках у series: ищутся как
+    точное название серии, без кавычек - по началу названия.
+    """
+    parsed = {
+        'words': [], 'phrases': [], 'author': [], 'title': [], 'series': [], 'year': [],
+        'genre': [], 'format': [], 'source': [], 'is_read': None,
+    }
+
+    for match in TOKEN_RE.finditer(text):
+        key = match.group('key')
+        field = FIELD_ALIASES.get(key.lower()) if key else None
+
+        if field is None:
+            if key:
+                # Неизвестный ключ - считаем весь токен обычным текстом (например, "Глава:1")
+                parsed['words'].append(match.group(0).replace('"', ''))
+                continue
+            if match.group('phrase') is not None:
+                if match.group('phrase').strip():
+                    parsed['phrases'].append(match.group('phrase').strip())
+                continue
+            word = match.group('word')
+            if word.lower() in READ_FLAGS:
+                parsed['is_read'] = READ_FLAGS[word.lower()]
+            else:
+                parsed['words'].append(word)
+            continue
+
+        quoted = match.group('quoted') is not None
+        value = (match.group('quoted') if quoted else match.group('value')).strip()
+        if not value:
+            continue
+
+        if field == 'year':
+            parsed['year'].extend(_parse_year(value))
+        elif field == 'format':
+            fmt = FORMAT_ALIASES.get(value.lower())
+            if fmt is None:
+                raise ValueError(f"Неизвестный формат «{value}». Доступно: physical, digital")
+            parsed['format'].append(fmt)
+        elif field == 'source':
+            if value.lower() not in SOURCES:
+                raise ValueError(f"Неизвестный источник «{value}». Доступно: {', '.join(SOURCES)}")
+            parsed['source'].append(value.lower())
+        elif field in ('series', 'author', 'title'):
+            parsed[field].append((value, quoted))
+        else:
+            parsed[field].append(value)
+
+    return parsed
+
+
+def has_filters(parsed):
+    """Есть ли в запросе что-то кроме свободного текста"""
+    return parsed['is_read'] is not None or any(
+        parsed[field] for field in ('author', 'title', 'series', 'year', 'genre', 'format', 'source')
+    )
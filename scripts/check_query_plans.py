@@ -0,0 +1,162 @@
+"""Проверка планов горячих запросов к базе.
+
+Создает временную базу с небольшой библиотекой, вызывает настоящие функции
+доступа к данным, перехватывает выполненные ими SELECT и проверяет
+EXPLAIN QUERY PLAN каждого: ожидаемый индекс используется, полного
+сканирования таблиц лога и списков нет, а у запросов, которые отдают строки
+в порядке индекса (списки, лог), нет сортировки во временном B-дереве.
+
+    python scripts/check_query_plans.py
+
+Код выхода 1, если хотя бы одна проверка не прошла.
+"""
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bookbot'))
+
+# Таблицы, которые не должны читаться полным сканированием (с псевдонимами из запросов)
+GUARDED_TABLES = ('book_log', 'bl', 'to_read_list', 'trl', 'to_buy_list')
+FULL_SCAN_RE = re.compile(r'^SCAN (\w+)$')
+# Библиотеки двух пользователей; проверяются запросы первого
+OWNERS = (101, 202)
+OWNER_ID = OWNERS[0]
+
+
+def owner_of(i):
+    return OWNERS[i % len(OWNERS)]
+
+
+def seed(db):
+    """Наполняет базу книгами, списками и событиями лога нескольких владельцев"""
+    conn = db.get_conn()
+    try:
+        conn.executemany(
+            "INSERT INTO books (owner_id, authors, title, format, pages) VALUES (?, ?, ?, 'physical', ?)",
+            [(owner_of(i), f"Автор {i % 50}", f"Книга {i}", 100 + i) for i in range(500)],
+        )
+        conn.executemany(
+            "INSERT INTO book_log (owner_id, book_id, event_type, event_date) VALUES (?, ?, ?, ?)",
+            [(owner_of(i % 500), i % 500 + 1, ('added', 'finished_reading', 'started_reading')[i % 3],
+              f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d} 12:00:00") for i in range(3000)],
+        )
+        conn.executemany(
+            "INSERT INTO to_buy_list (owner_id, authors, title, priority) VALUES (?, ?, ?, ?)",
+            [(owner_of(i), f"Автор {i}", f"Покупка {i}", i % 5 + 1) for i in range(200)],
+        )
+        conn.executemany(
+            "INSERT INTO to_read_list (owner_id, book_id) VALUES (?, ?)",
+            [(owner_of(i), i + 1) for i in range(200)],
+        )
+        conn.commit()
+    finally:
+        db.release_conn(conn)
+
+
+def capture(db, func, *args):
+    """Вызывает func и возвращает выполненные ею SELECT"""
+    statements = []
+    conn = db.get_conn()
+    conn.set_trace_callback(statements.append)
+    db.release_conn(conn)
+    try:
+        func(*args)
+    finally:
+        conn = db.get_conn()
+        conn.set_trace_callback(None)
+        db.release_conn(conn)
+    return [sql for sql in statements if sql.lstrip().upper().startswith(('SELECT', 'WITH'))]
+
+
+def explain(db, sql):
+    conn = db.get_conn()
+    try:
+        return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+    finally:
+        db.release_conn(conn)
+
+
+def check(db, name, func, args, expected_index, ordered=False):
+    """Проверяет планы всех SELECT, выполненных func(*args)"""
+    statements = capture(db, func, *args)
+    problems = []
+    details = []
+    for sql in statements:
+        plan = explain(db, sql)
+        details.extend(plan)
+        for line in plan:
+            match = FULL_SCAN_RE.match(line)
+            if match and match.group(1) in GUARDED_TABLES:
+                problems.append(f"полное сканирование: {line}")
+            if ordered and 'USE TEMP B-TREE FOR ORDER BY' in line:
+                problems.append(f"сортировка без индекса: {line}")
+    if not statements:
+        problems.append("не выполнено ни одного SELECT")
+    elif not any(expected_index in line for line in details):
+        problems.append(f"не используется {expected_index}")
+
+    status = 'OK  ' if not problems else 'FAIL'
+    print(f"{status} {name}")
+    for line in details:
+        print(f"       {line}")
+    for problem in problems:
+        print(f"     ! {problem}")
+    return not problems
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp(prefix='bookgoblin-plans-')
+    os.environ['DB_PATH'] = os.path.join(tmp_dir, 'library.db')
+    # Одно подключение в пуле, чтобы перехватывать все запросы на нем
+    os.environ['DB_POOL_SIZE'] = '1'
+
+    import db
+    from handlers import reports
+
+    db.init_db()
+    seed(db)
+
+    start, end = reports.parse_period('2025-01..2025-06')
+    current_start, _ = reports.current_month_range()
+    # Ключи строк из середины лога и списков для проверки листания страниц
+    log_key = ('2025-06-15 12:00:00', 1500)
+    list_key = (3, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 100)
+    owner = OWNER_ID
+    checks = [
+        ('отчет о прочитанном за период', reports.get_reading_report, (owner, start, end),
+         'idx_book_log_owner_type_date'),
+        ('отчет о покупках за период', reports.get_purchases_report, (owner, start, end),
+         'idx_book_log_owner_type_date'),
+        ('итоги закрытого месяца', reports.seal_month, (owner, datetime(2025, 5, 1)), 'idx_book_log_owner_type_date'),
+        ('отчет за запечатанный месяц', reports.get_reading_report, (owner, datetime(2025, 5, 1), datetime(2025, 6, 1)),
+         'SEARCH bl USING INTEGER PRIMARY KEY'),
+        ('итоги текущего месяца', reports.get_month_rollup, (owner, current_start), 'idx_book_log_owner_type_date'),
+        ('/booklog', db.get_book_log, (owner, 41), 'idx_book_log_book_date', True),
+        ('/logs', db.get_log_page, (owner,), 'idx_book_log_owner_date', True),
+        ('/logs ▶', db.get_log_page, (owner, log_key), 'idx_book_log_owner_date', True),
+        ('/logs ◀', db.get_log_page, (owner, None, log_key), 'idx_book_log_owner_date', True),
+        ('/gettbr', db.get_to_buy_page, (owner,), 'idx_to_buy_list_owner_priority', True),
+        ('/gettbr ▶', db.get_to_buy_page, (owner, list_key), 'idx_to_buy_list_owner_priority', True),
+        ('/gettbr ◀', db.get_to_buy_page, (owner, None, list_key), 'idx_to_buy_list_owner_priority', True),
+        ('/gettrl', db.get_to_read_page, (owner,), 'idx_to_read_list_owner_priority', True),
+        ('/gettrl ▶', db.get_to_read_page, (owner, list_key), 'idx_to_read_list_owner_priority', True),
+        ('/gettrl ◀', db.get_to_read_page, (owner, None, list_key), 'idx_to_read_list_owner_priority', True),
+        ('/summary', db.get_library_summary, (owner,), 'sqlite_autoindex_library_stats_1'),
+        ('/search format:', db.structured_search, (owner, 'format:digital'), 'idx_books_owner_format'),
+        ('/search source:', db.structured_search, (owner, 'source:ficbook'), 'idx_books_owner_source'),
+        ('/search genre:', db.structured_search, (owner, 'genre:фэнтези'), 'idx_books_owner_genre_norm'),
+    ]
+
+    results = [check(db, *item) for item in checks]
+    db.close_pool()
+
+    print(f"\nПроверок пройдено: {sum(results)}/{len(results)}")
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""Отправка записанного Update на локальный вебхук-сервер бота.
+
+Бот должен быть запущен с BOT_MODE=webhook; адрес и секрет берутся из тех же
+переменных окружения (WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET).
+
+    python scripts/post_update.py scripts/updates/start.json [--text "/summary"] [--url http://127.0.0.1:8080/webhook]
+
+Печатает HTTP-статус ответа: 200 - обновление принято, 401 - неверный секрет.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import aiohttp
+from dotenv import load_dotenv
+
+
+async def post(url, secret, update):
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json=update, headers=headers) as response:
+            return response.status, await response.text()
+
+
+def main():
+    load_dotenv()
+    default_url = (f"http://127.0.0.1:{os.getenv('WEBHOOK_PORT', '8080')}"
+                   f"{os.getenv('WEBHOOK_PATH', '/webhook')}")
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('update', help='JSON-файл с объектом Update')
+    parser.add_argument('--url', default=default_url)
+    parser.add_argument('--secret', default=os.getenv('WEBHOOK_SECRET', ''))
+    parser.add_argument('--text', help='заменить текст сообщения (например, другой командой)')
+    args = parser.parse_args()
+
+    with open(args.update, encoding='utf-8') as f:
+        update = json.load(f)
+    if args.text is not None:
+        message = update['message']
+        message['text'] = args.text
+        command = args.text.split()[0] if args.text.startswith('/') else None
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}] if command else []
+
+    status, body = asyncio.run(post(args.url, args.secret, update))
+    print(f"{status} {body}".strip())
+    return 0 if status == 200 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())